@@ -1,4 +1,5 @@
 import os
+from typing import List, Literal, Optional
 
 from pydantic import BaseSettings
 
@@ -11,11 +12,142 @@ class Settings(BaseSettings):
 
     # Data
     upload_directory: str = "/tmp/fmds/upload"
+    # Size of the chunks read and written when an uploaded file is saved
+    upload_chunk_size: int = 64 * 1024
+    # Store each distinct file once, named by its sha256 checksum. The contents
+    # with the same file share a blob that is removed with its last content
+    content_addressed_storage: bool = False
+    # Maximum number of files of a batch upload
+    batch_upload_max_items: int = 1000
     sqlalchemy_database_url: str
+    # Use an asyncio engine and AsyncSession for the requests sessions
+    async_database: bool = False
+    # Url with an async driver (e.g. mysql+aiomysql://...).
+    # Fallback to sqlalchemy_database_url if not set
+    sqlalchemy_async_database_url: Optional[str] = None
+    # Connection pool of each engine. The size, overflow and timeout are ignored by
+    # SQLite. The connections are checked before use and replaced after
+    # database_pool_recycle seconds, keep it below the server timeout
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: float = 30.0
+    database_pool_recycle: int = 3600
+    database_pool_pre_ping: bool = True
+    # Read replicas, the read-only routes query them in turn instead of the
+    # primary. The async urls fallback to the sync ones. A replica whose
+    # connections fail isn't used for database_replica_ejection_time seconds
+    sqlalchemy_replica_urls: List[str] = []
+    sqlalchemy_async_replica_urls: List[str] = []
+    database_replica_ejection_time: float = 30.0
+
+    # Contents access counters are buffered and written in bulk.
+    # Flush every access_counter_flush_interval seconds or as soon as
+    # access_counter_flush_threshold contents are pending. While the flushes fail,
+    # the accesses of more than access_counter_max_pending contents are dropped
+    access_counter_flush_interval: float = 5.0
+    access_counter_flush_threshold: int = 1000
+    access_counter_max_pending: int = 100_000
+
+    # The deleted contents files are queued in the database and removed in the
+    # background, by batches of file_deletion_batch_size. The queue is processed
+    # after each deletion and every file_deletion_interval seconds, so the
+    # removals that failed are retried
+    file_deletion_interval: float = 300.0
+    file_deletion_batch_size: int = 500
+    # The reconciliation (python -m app.reconcile) ignores the files younger than
+    # reconciliation_grace_period seconds, their content may be in creation. The
+    # contents are streamed from the database by chunks of reconciliation_chunk_size
+    reconciliation_grace_period: float = 3600.0
+    reconciliation_chunk_size: int = 1000
+
+    # Answer the keywords searches from an in-memory inverted index built at startup.
+    # Each worker has its own index, only the changes made by the worker are seen
+    keyword_index_enabled: bool = False
+    # Complete the keywords prefixes (GET /keywords) from an in-memory sorted array
+    # built at startup, each worker has its own like the index. Disabled, the
+    # completions are queried from the database
+    keyword_completion_enabled: bool = False
+    keyword_completion_max_results: int = 20
+    # Typo tolerant search (GET /contents/?fuzzy=true), each searched keyword is
+    # replaced by the fuzzy_search_max_expansions most similar keywords, at least
+    # fuzzy_search_min_similarity similar. They are found by an in-memory trigram
+    # index of the keywords built at startup, each worker has its own
+    fuzzy_search_enabled: bool = False
+    fuzzy_search_max_expansions: int = 5
+    fuzzy_search_min_similarity: float = 0.25
+
+    # In-memory LRU cache of the contents files, with a total and a per file budget.
+    # The files are cached for content_cache_ttl seconds, the deletions made by the
+    # other workers are seen after it
+    content_cache_enabled: bool = False
+    content_cache_max_bytes: int = 256 * 1024 * 1024
+    content_cache_max_item_bytes: int = 4 * 1024 * 1024
+    content_cache_ttl: float = 60.0
+
+    # In-memory LRU cache of the contents locations used by the downloads. The
+    # locations are cached for content_location_cache_ttl seconds, the deletions
+    # made by the other workers are seen after it. The unknown filenames are cached
+    # for content_location_cache_negative_ttl seconds
+    content_location_cache_enabled: bool = False
+    content_location_cache_size: int = 100_000
+    content_location_cache_ttl: float = 60.0
+    content_location_cache_negative_ttl: float = 5.0
+
+    # Rank the contents by their recent downloads (GET /contents/trending), with an
+    # exponential decay of trending_half_life seconds. The downloads are estimated
+    # by a count-min sketch and the trending_capacity most downloaded contents are
+    # tracked. Each worker has its own ranking, saved every
+    # trending_snapshot_interval seconds so it survives restarts. The snapshot is
+    # written in the upload directory if trending_snapshot_path isn't set, give each
+    # worker its own path
+    trending_enabled: bool = False
+    trending_half_life: float = 3600.0
+    trending_capacity: int = 1000
+    trending_sketch_width: int = 4096
+    trending_sketch_depth: int = 4
+    trending_snapshot_path: Optional[str] = None
+    trending_snapshot_interval: float = 60.0
+
+    # Smaller copies of the images, generated by rendition_workers processes after
+    # the upload and on demand (GET /contents/{filename}?size=). Each size is the
+    # maximum width and height of a rendition. Needs Pillow (the renditions extra)
+    renditions_enabled: bool = False
+    rendition_sizes: List[int] = [200, 480, 1080]
+    # Also generate the first frame of the GIFs after the upload (?still=true)
+    rendition_gif_still: bool = True
+    rendition_workers: int = 2
+    # Above, the renditions are only generated on demand, not after the upload
+    rendition_max_pending: int = 1000
+
+    # How the contents files are sent. "stream" reads them by chunks. "sendfile" lets
+    # the server send them with sendfile if it supports the ASGI zero copy
+    # extension, else they are streamed. "x-accel-redirect" (nginx) and
+    # "x-sendfile" (Apache, lighttpd) let the front proxy send them, the
+    # x-accel-redirect location must serve the upload directory
+    file_send_mode: Literal[
+        "stream", "sendfile", "x-accel-redirect", "x-sendfile"
+    ] = "stream"
+    file_send_accel_location: str = "/protected/"
+    # Open files kept for the stream and sendfile modes, 0 disables the cache
+    file_descriptor_cache_size: int = 256
+
+    # Maximum and default number of contents returned by a search page
+    search_max_page_size: int = 100
+
+    # Expose the requests, statements and file operations metrics on /metrics
+    metrics_enabled: bool = False
 
     # Security
     access_token_expire_minutes: int = 15
     secret_key: str
+    # Threads verifying the passwords (bcrypt) out of the event loop. Above
+    # password_hash_max_pending logins running or waiting, a login is rejected (503)
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 16
+    # Cache of the verified tokens, a cached token skips the user lookup until its
+    # expiration or jwt_cache_ttl seconds. 0 disables the cache
+    jwt_cache_size: int = 10_000
+    jwt_cache_ttl: float = 60.0
 
     class Config:
         env_file = os.getenv("FMDS_ENV_FILE", ".env")
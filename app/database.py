@@ -1,12 +1,199 @@
-from sqlalchemy import create_engine
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 from app import config
 
 settings = config.Settings()
 
-engine = create_engine(settings.sqlalchemy_database_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Session info key of the read-only sessions, their queries may go to a replica
+READ_ONLY = "read_only"
+_REPLICA = "replica"
+
+
+def _engine_options(url: str) -> Dict[str, Any]:
+    """
+    Get the pool options of an engine
+    :param url: the database url
+    :return: the create_engine keyword arguments
+    """
+    options = {
+        "pool_pre_ping": settings.database_pool_pre_ping,
+        "pool_recycle": settings.database_pool_recycle,
+    }
+    # The SQLite pools have no size, each connection is a file handle
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=settings.database_pool_size,
+            max_overflow=settings.database_max_overflow,
+            pool_timeout=settings.database_pool_timeout,
+        )
+    return options
+
+
+class ReplicaSet:
+    """
+    The read replicas engines, used in turn. A replica whose connections fail is
+    ejected for replica_ejection_time seconds.
+    """
+
+    def __init__(self, engines: List[Engine], ejection_time: float):
+        """
+        Construct the replica set
+        :param engines: the replicas engines, the sync_engine of the async ones
+        :param ejection_time: the seconds during which a failing replica isn't used
+        """
+        self.engines = engines
+        self._ejection_time = ejection_time
+        self._ejected_until: Dict[Engine, float] = {}
+        self._turns = itertools.cycle(engines)
+        # The sessions are created in the threadpool too
+        self._lock = threading.Lock()
+        for engine in engines:
+            event.listen(engine, "handle_error", self._handle_error)
+
+    def choose(self) -> Optional[Engine]:
+        """
+        Get the next healthy replica
+        :return: the replica engine or None if all are ejected
+        """
+        now = time.monotonic()
+        with self._lock:
+            for _ in self.engines:
+                engine = next(self._turns)
+                if self._ejected_until.get(engine, 0.0) <= now:
+                    return engine
+        return None
+
+    def eject(self, engine: Engine) -> None:
+        """
+        Stop using a replica for a while
+        :param engine: the failing replica engine
+        """
+        with self._lock:
+            self._ejected_until[engine] = time.monotonic() + self._ejection_time
+
+    def _handle_error(self, context) -> None:
+        # Lost connections and failed connection attempts, not the query errors
+        if context.is_disconnect or context.connection is None:
+            self.eject(context.engine)
+
+
+class RoutingSession(Session):
+    """
+    Session that sends the SELECT of the read-only sessions to a replica, the same
+    one for the whole session. Everything else goes to the primary.
+    """
+
+    replicas: Optional[ReplicaSet] = None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (
+            self.replicas is not None
+            and self.info.get(READ_ONLY)
+            and not self._flushing
+            and getattr(clause, "is_select", False)
+        ):
+            replica = self.info.get(_REPLICA)
+            if replica is None:
+                replica = self.info[_REPLICA] = self._connect_replica()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause, **kwargs)
+
+    def _connect_replica(self) -> Optional[Engine]:
+        """
+        Connect the session to a healthy replica, a failing one is ejected by the
+        replica set and the next one is tried
+        :return: the replica engine or None to use the primary
+        """
+        for _ in self.replicas.engines:
+            replica = self.replicas.choose()
+            if replica is None:
+                break
+            try:
+                self.connection(bind_arguments={"bind": replica})
+            except exc.DBAPIError:
+                continue
+            return replica
+        return None
+
+
+engine = create_engine(
+    settings.sqlalchemy_database_url,
+    **_engine_options(settings.sqlalchemy_database_url)
+)
+
+# The async engine needs an async driver so it is only created when asked.
+# The sync engine is still used for the schema creation.
+async_engine = None
+if settings.async_database:
+    async_url = (
+        settings.sqlalchemy_async_database_url or settings.sqlalchemy_database_url
+    )
+    async_engine = create_async_engine(async_url, **_engine_options(async_url))
+
+# The replicas are used by the sessions of the selected mode only
+replica_urls = settings.sqlalchemy_replica_urls
+if settings.async_database:
+    replica_urls = settings.sqlalchemy_async_replica_urls or replica_urls
+    replica_engines = [
+        create_async_engine(url, **_engine_options(url)).sync_engine
+        for url in replica_urls
+    ]
+else:
+    replica_engines = [
+        create_engine(url, **_engine_options(url)) for url in replica_urls
+    ]
+if replica_engines:
+    RoutingSession.replicas = ReplicaSet(
+        replica_engines, settings.database_replica_ejection_time
+    )
+
+# The sessions live for one request, the objects are not expired on commit to
+# serialize them without reloading them
+SessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=engine,
+    class_=RoutingSession,
+)
+ReadSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=engine,
+    class_=RoutingSession,
+    info={READ_ONLY: True},
+)
+
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+if async_engine is not None:
+    AsyncSessionLocal = sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        bind=async_engine,
+        class_=AsyncSession,
+        sync_session_class=RoutingSession,
+    )
+    AsyncReadSessionLocal = sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        bind=async_engine,
+        class_=AsyncSession,
+        sync_session_class=RoutingSession,
+        info={READ_ONLY: True},
+    )
 
 Base = declarative_base()
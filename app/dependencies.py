@@ -1,7 +1,9 @@
 from functools import lru_cache
+from typing import Optional
 
 from app import config, services
-from app.database import SessionLocal
+from app.database import (AsyncReadSessionLocal, AsyncSessionLocal,
+                          ReadSessionLocal, SessionLocal)
 
 
 @lru_cache
@@ -9,9 +11,25 @@ def get_settings():
     return config.Settings()
 
 
+@lru_cache
+def get_metrics_service() -> Optional[services.MetricsService]:
+    if not get_settings().metrics_enabled:
+        return None
+    return services.MetricsService()
+
+
 @lru_cache
 def get_file_service() -> services.FileService:
-    return services.FileService(get_settings())
+    return services.FileService(get_settings(), get_metrics_service())
+
+
+@lru_cache
+def get_rendition_service() -> Optional[services.RenditionService]:
+    if not get_settings().renditions_enabled:
+        return None
+    return services.RenditionService(
+        get_settings(), get_file_service(), get_metrics_service()
+    )
 
 
 def get_db():
@@ -22,6 +40,106 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+@lru_cache
+def get_access_counter_service() -> services.AccessCounterService:
+    session_factory = (
+        AsyncSessionLocal if get_settings().async_database else SessionLocal
+    )
+    return services.AccessCounterService(get_settings(), session_factory)
+
+
+@lru_cache
+def get_file_deletion_service() -> services.FileDeletionService:
+    session_factory = (
+        AsyncSessionLocal if get_settings().async_database else SessionLocal
+    )
+    return services.FileDeletionService(
+        get_settings(), get_file_service(), session_factory
+    )
+
+
+@lru_cache
+def get_keyword_index_service() -> Optional[services.KeywordIndexService]:
+    if not get_settings().keyword_index_enabled:
+        return None
+    return services.KeywordIndexService()
+
+
+@lru_cache
+def get_keyword_completion_service() -> Optional[services.KeywordCompletionService]:
+    if not get_settings().keyword_completion_enabled:
+        return None
+    return services.KeywordCompletionService(get_settings())
+
+
+@lru_cache
+def get_trigram_index_service() -> Optional[services.TrigramIndexService]:
+    if not get_settings().fuzzy_search_enabled:
+        return None
+    return services.TrigramIndexService(get_settings())
+
+
+@lru_cache
+def get_trending_service() -> Optional[services.TrendingService]:
+    if not get_settings().trending_enabled:
+        return None
+    return services.TrendingService(get_settings())
+
+
+@lru_cache
+def get_content_cache_service() -> Optional[services.ContentCacheService]:
+    if not get_settings().content_cache_enabled:
+        return None
+    return services.ContentCacheService(get_settings())
+
+
+@lru_cache
+def get_content_location_cache_service() -> Optional[
+    services.ContentLocationCacheService
+]:
+    if not get_settings().content_location_cache_enabled:
+        return None
+    return services.ContentLocationCacheService(get_settings())
+
+
+@lru_cache
+def get_file_descriptor_cache_service() -> Optional[
+    services.FileDescriptorCacheService
+]:
+    settings = get_settings()
+    # The proxy opens the files itself
+    if settings.file_descriptor_cache_size == 0 or settings.file_send_mode not in (
+        "stream",
+        "sendfile",
+    ):
+        return None
+    return services.FileDescriptorCacheService(settings)
+
+
+# Database session dependency for the routes, according to the database mode
+get_session = get_async_db if get_settings().async_database else get_db
+# The same for the read-only routes, their queries may go to a replica
+get_read_session = get_async_read_db if get_settings().async_database else get_read_db
+
+
 @lru_cache
 def get_security_service() -> services.SecurityService:
     return services.SecurityService(get_settings())
@@ -29,4 +147,10 @@ def get_security_service() -> services.SecurityService:
 
 @lru_cache
 def get_jwt_bearer_service() -> services.JWTBearerService:
-    return services.JWTBearerService(next(get_db()), get_security_service())
+    # The users are only read
+    session_factory = (
+        AsyncReadSessionLocal if get_settings().async_database else ReadSessionLocal
+    )
+    return services.JWTBearerService(
+        get_settings(), get_security_service(), session_factory
+    )
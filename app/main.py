@@ -1,11 +1,128 @@
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 
-from app.database import Base, engine
-from app.routers import contents, security
+from app import dependencies, repositories, services
+from app.database import (Base, SessionLocal, async_engine, engine,
+                          replica_engines)
+from app.middleware import MetricsMiddleware
+from app.routers import contents, keywords, metrics, security, stats
 
 Base.metadata.create_all(bind=engine)
 
 app = FastAPI()
 
 app.include_router(contents.router, prefix="/api/v1")
+app.include_router(keywords.router, prefix="/api/v1")
 app.include_router(security.router, prefix="/api/v1")
+app.include_router(stats.router, prefix="/api/v1")
+app.include_router(metrics.router)
+
+# Nothing is measured when the metrics are disabled
+_metrics = dependencies.get_metrics_service()
+if _metrics is not None:
+    app.add_middleware(MetricsMiddleware, metrics=_metrics)
+    _metrics.instrument_engine(engine)
+    if async_engine is not None:
+        _metrics.instrument_engine(async_engine.sync_engine)
+    for replica_engine in replica_engines:
+        _metrics.instrument_engine(replica_engine)
+    _metrics.add_gauge(
+        "fmds_access_counter_pending",
+        "Number of contents access counters waiting to be flushed",
+        lambda: dependencies.get_access_counter_service().pending,
+    )
+
+
+@app.on_event("startup")
+async def start_access_counter():
+    dependencies.get_access_counter_service().start()
+
+
+@app.on_event("shutdown")
+async def stop_access_counter():
+    # Flush the buffered counters before exiting
+    await dependencies.get_access_counter_service().stop()
+
+
+@app.on_event("startup")
+async def start_file_deletion():
+    dependencies.get_file_deletion_service().start()
+
+
+@app.on_event("shutdown")
+async def stop_file_deletion():
+    # The remaining deletions stay queued in the database
+    await dependencies.get_file_deletion_service().stop()
+
+
+@app.on_event("startup")
+async def start_trending():
+    trending = dependencies.get_trending_service()
+    if trending is not None:
+        await trending.load()
+        trending.start()
+
+
+@app.on_event("shutdown")
+async def stop_trending():
+    # Snapshot the ranking before exiting
+    trending = dependencies.get_trending_service()
+    if trending is not None:
+        await trending.stop()
+
+
+@app.on_event("shutdown")
+def stop_password_hash_pool():
+    dependencies.get_security_service().shutdown()
+
+
+@app.on_event("shutdown")
+async def stop_rendition_workers():
+    renditions = dependencies.get_rendition_service()
+    if renditions is not None:
+        await renditions.stop()
+
+
+@app.on_event("shutdown")
+def close_file_descriptors():
+    descriptors = dependencies.get_file_descriptor_cache_service()
+    if descriptors is not None:
+        descriptors.close()
+
+
+@app.on_event("startup")
+async def build_keyword_index():
+    keyword_index = dependencies.get_keyword_index_service()
+    if keyword_index is not None:
+        await run_in_threadpool(_load_keyword_index, keyword_index)
+
+
+def _load_keyword_index(keyword_index: services.KeywordIndexService) -> None:
+    with SessionLocal() as db:
+        keyword_index.build(repositories.content.get_contents_keywords(db))
+
+
+@app.on_event("startup")
+async def build_keyword_completion():
+    keyword_completion = dependencies.get_keyword_completion_service()
+    if keyword_completion is not None:
+        await run_in_threadpool(_load_keyword_completion, keyword_completion)
+
+
+def _load_keyword_completion(
+    keyword_completion: services.KeywordCompletionService,
+) -> None:
+    with SessionLocal() as db:
+        keyword_completion.build(repositories.keyword.get_keywords_usages(db))
+
+
+@app.on_event("startup")
+async def build_trigram_index():
+    trigram_index = dependencies.get_trigram_index_service()
+    if trigram_index is not None:
+        await run_in_threadpool(_load_trigram_index, trigram_index)
+
+
+def _load_trigram_index(trigram_index: services.TrigramIndexService) -> None:
+    with SessionLocal() as db:
+        trigram_index.build(repositories.keyword.get_keywords_names(db))
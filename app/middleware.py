@@ -0,0 +1,50 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.services.metrics import MetricsService
+
+# Route label of the requests that don't match any route
+UNMATCHED_ROUTE = "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware that measures the duration and the statements of the requests"""
+
+    def __init__(self, app: ASGIApp, metrics: MetricsService):
+        """
+        Construct the middleware
+        :param app: the wrapped application
+        :param metrics: the metrics service that records the measures
+        """
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        request = self.metrics.start_request()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router adds the matched endpoint to the scope
+            endpoint = scope.get("endpoint")
+            route = endpoint.__name__ if endpoint is not None else UNMATCHED_ROUTE
+            self.metrics.finish_request(
+                request,
+                route,
+                scope["method"],
+                status_code,
+                time.perf_counter() - start,
+            )
@@ -1,2 +1,2 @@
-from .content import Content, Keyword
+from .content import Blob, Content, Keyword, PendingDeletion
 from .user import User
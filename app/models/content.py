@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Table
+from sqlalchemy import CHAR, Column, ForeignKey, Integer, String, Table
 from sqlalchemy.orm import relationship
 
 from app.database import Base
@@ -16,8 +16,15 @@ class Content(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(30), unique=True, index=True, nullable=False)
-    filepath = Column(String(200), unique=True, nullable=False)
+    # Not unique, the contents of a blob share its filepath
+    filepath = Column(String(200), nullable=False)
     count = Column(Integer, default=0, nullable=False)
+    # Read from the image headers on upload, null if they couldn't be read
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    frames = Column(Integer, nullable=True)
+    # Only set with the content addressed storage
+    blob_id = Column(Integer, ForeignKey("blobs.id"), nullable=True)
 
     keywords = relationship(
         "Keyword", secondary=association_table, back_populates="contents"
@@ -33,3 +40,32 @@ class Keyword(Base):
     contents = relationship(
         "Content", secondary=association_table, back_populates="keywords"
     )
+
+
+class Blob(Base):
+    """A file of the content addressed storage, shared by the identical contents"""
+
+    __tablename__ = "blobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # Hex sha256 digest of the file
+    checksum = Column(CHAR(64), unique=True, index=True, nullable=False)
+    filepath = Column(String(200), unique=True, nullable=False)
+    # Number of contents using the blob. The blob file is removed once it drops to 0
+    reference_count = Column(Integer, default=0, nullable=False)
+
+
+class PendingDeletion(Base):
+    """
+    A content file to remove, queued in the transaction that deletes its content so
+    the removal survives a crash
+    """
+
+    __tablename__ = "pending_deletions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # The file of a content without blob
+    filepath = Column(String(200), nullable=True)
+    # Or the blob to purge, if it is still unreferenced. Not a foreign key, the purge
+    # deletes the blob row
+    blob_id = Column(Integer, nullable=True)
@@ -0,0 +1,63 @@
+"""
+Reconcile the upload directory with the contents table.
+
+Print the orphan files, without content, and the dangling contents, whose file is
+missing. With --clean, the orphan files are removed and the dangling contents are
+deleted. The directory and the table are streamed, the memory use doesn't grow with
+the number of files.
+The running workers keep the dangling contents in their in-memory indexes until
+they restart.
+
+    python -m app.reconcile
+    python -m app.reconcile --clean
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+from typing import Iterator, TextIO
+
+from app import dependencies, services
+from app.database import SessionLocal
+from app.services.reconciliation import Mismatch
+
+
+def _spool(mismatches: Iterator[Mismatch], spool: TextIO) -> None:
+    for mismatch in mismatches:
+        print(mismatch.kind, mismatch.filepath, mismatch.filename or "", sep="\t")
+        spool.write(json.dumps(mismatch) + "\n")
+
+
+def _unspool(spool: TextIO) -> Iterator[Mismatch]:
+    spool.seek(0)
+    for line in spool:
+        yield Mismatch(*json.loads(line))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--clean",
+        action="store_true",
+        help="remove the orphan files and delete the dangling contents",
+    )
+    args = parser.parse_args()
+
+    reconciliation = services.ReconciliationService(
+        dependencies.get_settings(), dependencies.get_file_service(), SessionLocal
+    )
+    # The mismatches are only fixed once the scan is over
+    with tempfile.TemporaryFile(mode="w+") as spool:
+        _spool(reconciliation.scan(), spool)
+        if not args.clean:
+            return
+        fixed = sum(1 for _ in reconciliation.clean(_unspool(spool)))
+
+    # The removals queued by the cleaning
+    file_deletion = dependencies.get_file_deletion_service()
+    removed = asyncio.get_event_loop().run_until_complete(file_deletion.process())
+    print(f"fixed: {fixed}, removed files: {removed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,27 @@
-from . import user
+from typing import Any, Awaitable, Callable, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import blob, content, deletion, keyword, user
+
+
+async def call(
+    db: Union[Session, AsyncSession],
+    func: Callable[..., Any],
+    async_func: Callable[..., Awaitable[Any]],
+    *args,
+    **kwargs
+) -> Any:
+    """
+    Call the repository function that matches the session type.
+    :param db: The session database object, sync or async
+    :param func: The repository function for a sync session
+    :param async_func: The repository function for an async session
+    :param args: The arguments given to the function after the session
+    :param kwargs: The keyword arguments given to the function
+    :return: The function result
+    """
+    if isinstance(db, AsyncSession):
+        return await async_func(db, *args, **kwargs)
+    return func(db, *args, **kwargs)
@@ -0,0 +1,189 @@
+from typing import Awaitable, Callable
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Delete, Select, Update
+
+from app import models
+
+# The blob rows are the locks of the blob files:
+# - an upload takes a reference (UPDATE or INSERT) before moving the file at its place
+# - the last reference release leaves the row with a 0 count, then the purge locks
+#   and deletes the row and removes the file before committing.
+# An orphan blob file, without row, gets an unreferenced row (a tombstone) before
+# its purge is queued, so a concurrent upload of the same content takes a reference
+# on it instead of finding the file about to be removed.
+# An upload of the same content during the purge waits for the row lock, then
+# creates a new row and moves its file at the place of the removed one.
+
+
+def _select_blob(checksum: str) -> Select:
+    return select(models.Blob).where(models.Blob.checksum == checksum)
+
+
+def _select_blob_id(checksum: str) -> Select:
+    return select(models.Blob.id).where(models.Blob.checksum == checksum)
+
+
+def _reference_blob(checksum: str) -> Update:
+    return (
+        update(models.Blob)
+        .where(models.Blob.checksum == checksum)
+        .values({models.Blob.reference_count: models.Blob.reference_count + 1})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _release_blob(blob_id: int) -> Update:
+    return (
+        update(models.Blob)
+        .where(models.Blob.id == blob_id)
+        .values({models.Blob.reference_count: models.Blob.reference_count - 1})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _select_blob_references(blob_id: int) -> Select:
+    return select(models.Blob.reference_count).where(models.Blob.id == blob_id)
+
+
+def _select_unreferenced_blob(blob_id: int) -> Select:
+    return (
+        select(models.Blob.filepath)
+        .where(models.Blob.id == blob_id, models.Blob.reference_count <= 0)
+        .with_for_update()
+    )
+
+
+def _delete_blob(blob_id: int) -> Delete:
+    return (
+        delete(models.Blob)
+        .where(models.Blob.id == blob_id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def acquire_blob(db: Session, checksum: str, filepath: str) -> models.Blob:
+    """
+    Take a reference on the blob of a checksum, create it if it doesn't exist.
+    The transaction isn't committed.
+    :param db: The session database object
+    :param checksum: The hex sha256 digest of the file
+    :param filepath: The blob filepath, used if it is created
+    :return: The blob entity
+    """
+    while True:
+        if db.execute(_reference_blob(checksum)).rowcount == 0:
+            try:
+                # The savepoint keeps the transaction usable if another upload
+                # created the blob in the meantime
+                with db.begin_nested():
+                    db.add(
+                        models.Blob(
+                            checksum=checksum, filepath=filepath, reference_count=1
+                        )
+                    )
+            except IntegrityError:
+                continue
+        return db.execute(_select_blob(checksum)).scalars().one()
+
+
+async def acquire_blob_async(
+    db: AsyncSession, checksum: str, filepath: str
+) -> models.Blob:
+    """
+    Async version of acquire_blob
+    :param db: The async session database object
+    :param checksum: The hex sha256 digest of the file
+    :param filepath: The blob filepath, used if it is created
+    :return: The blob entity
+    """
+    while True:
+        if (await db.execute(_reference_blob(checksum))).rowcount == 0:
+            try:
+                async with db.begin_nested():
+                    db.add(
+                        models.Blob(
+                            checksum=checksum, filepath=filepath, reference_count=1
+                        )
+                    )
+            except IntegrityError:
+                continue
+        return (await db.execute(_select_blob(checksum))).scalars().one()
+
+
+def release_blob(db: Session, blob_id: int) -> bool:
+    """
+    Release a reference on a blob. The transaction isn't committed.
+    :param db: The session database object
+    :param blob_id: The blob entity id
+    :return: True if the blob isn't referenced anymore and can be purged
+    """
+    db.execute(_release_blob(blob_id))
+    return db.execute(_select_blob_references(blob_id)).scalar() <= 0
+
+
+async def release_blob_async(db: AsyncSession, blob_id: int) -> bool:
+    """
+    Async version of release_blob
+    :param db: The async session database object
+    :param blob_id: The blob entity id
+    :return: True if the blob isn't referenced anymore and can be purged
+    """
+    await db.execute(_release_blob(blob_id))
+    return (await db.execute(_select_blob_references(blob_id))).scalar() <= 0
+
+
+def purge_blob(db: Session, blob_id: int, delete_file: Callable[[str], None]) -> None:
+    """
+    Delete a blob and its file if it is still unreferenced, then commit.
+    The file is deleted before the commit, while the row is locked.
+    :param db: The session database object
+    :param blob_id: The blob entity id
+    :param delete_file: The function that deletes the blob file
+    """
+    filepath = db.execute(_select_unreferenced_blob(blob_id)).scalar()
+    if filepath is not None:
+        db.execute(_delete_blob(blob_id))
+        delete_file(filepath)
+    db.commit()
+
+
+async def purge_blob_async(
+    db: AsyncSession, blob_id: int, delete_file: Callable[[str], Awaitable[None]]
+) -> None:
+    """
+    Async version of purge_blob
+    :param db: The async session database object
+    :param blob_id: The blob entity id
+    :param delete_file: The coroutine function that deletes the blob file
+    """
+    filepath = (await db.execute(_select_unreferenced_blob(blob_id))).scalar()
+    if filepath is not None:
+        await db.execute(_delete_blob(blob_id))
+        await delete_file(filepath)
+    await db.commit()
+
+
+def get_or_create_tombstone(db: Session, checksum: str, filepath: str) -> int:
+    """
+    Get the blob of a checksum, create it without reference if it doesn't exist.
+    The transaction isn't committed.
+    :param db: The session database object
+    :param checksum: The hex sha256 digest of the file
+    :param filepath: The blob filepath, used if it is created
+    :return: The blob entity id
+    """
+    while True:
+        blob_id = db.execute(_select_blob_id(checksum)).scalar()
+        if blob_id is not None:
+            return blob_id
+        try:
+            with db.begin_nested():
+                db.add(
+                    models.Blob(checksum=checksum, filepath=filepath, reference_count=0)
+                )
+        except IntegrityError:
+            continue
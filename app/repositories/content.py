@@ -1,9 +1,159 @@
-from typing import Iterator, List
+import mimetypes
+from typing import (Any, Dict, Iterable, Iterator, List, NamedTuple, Optional,
+                    Tuple, Union)
 
-from sqlalchemy import desc, func
-from sqlalchemy.orm import Session
+from sqlalchemy import (LargeBinary, and_, case, cast, delete, desc, func,
+                        insert, or_, select, update)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql import ColumnElement, Delete, Select, Update
 
 from app import models, schemas
+from app.models.content import association_table
+from app.repositories.blob import release_blob, release_blob_async
+from app.repositories.deletion import queue_deletion
+from app.repositories.keyword import (IN_CHUNK_SIZE, get_keywords_entities,
+                                      get_or_create_keywords_ids,
+                                      get_or_create_keywords_ids_async)
+from app.utils.iterables import chunks
+
+
+class ContentMatch(NamedTuple):
+    """A keywords search result and its keyset"""
+
+    content: Union[models.Content, schemas.ContentRead]
+    id: int
+    matches: int
+
+
+class ContentLocation(NamedTuple):
+    """What is needed to serve a content file"""
+
+    id: int
+    filepath: str
+    mimetype: Optional[str]
+    # The image size, None if unknown
+    width: Optional[int]
+    height: Optional[int]
+
+
+# The statements are built once for both the sync and async sessions, only the
+# execution differs.
+
+
+# The keywords are always needed with the contents (ContentRead), they are loaded
+# eagerly in one batched SELECT ... IN instead of one lazy SELECT per content.
+
+
+def _select_content_by_filename(filename: str) -> Select:
+    return (
+        select(models.Content)
+        .where(models.Content.filename == filename)
+        .options(selectinload(models.Content.keywords))
+    )
+
+
+def _select_content_location(filename: str) -> Select:
+    return select(
+        models.Content.id,
+        models.Content.filepath,
+        models.Content.width,
+        models.Content.height,
+    ).where(models.Content.filename == filename)
+
+
+def _select_contents_ids(filenames: List[str]) -> Select:
+    return select(models.Content.filename, models.Content.id).where(
+        models.Content.filename.in_(filenames)
+    )
+
+
+def _select_contents_by_ids(ids: List[int], keyword: Optional[str] = None) -> Select:
+    statement = (
+        select(models.Content)
+        .where(models.Content.id.in_(ids))
+        .options(selectinload(models.Content.keywords))
+    )
+    if keyword is not None:
+        statement = statement.where(
+            models.Content.keywords.any(models.Keyword.name == keyword)
+        )
+    return statement
+
+
+# The keywords are written without the ORM collection: their ids come from
+# get_or_create_keywords_ids, the association rows are inserted in bulk and the
+# collection is set as already committed.
+
+
+def _select_contents_by_keywords(
+    keywords: List[str], limit: Optional[int], after: Optional[Tuple[int, int]]
+) -> Select:
+    matches = func.count()
+    statement = (
+        select(models.Content, matches)
+        .join(models.Content.keywords)
+        .where(models.Keyword.name.in_(keywords))
+        .group_by(models.Content.id)
+        .order_by(desc(matches), models.Content.id)
+        .options(selectinload(models.Content.keywords))
+    )
+    # Keyset pagination, start right after the (matches, id) of the previous page
+    if after is not None:
+        after_matches, after_id = after
+        statement = statement.having(
+            or_(
+                matches < after_matches,
+                and_(matches == after_matches, models.Content.id > after_id),
+            )
+        )
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+
+def _update_contents_access(increments: Dict[int, int]) -> Update:
+    # One statement for all the contents, the increment is picked by id
+    return (
+        update(models.Content)
+        .where(models.Content.id.in_(increments))
+        .values(
+            {
+                models.Content.count: models.Content.count
+                + case(increments, value=models.Content.id)
+            }
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _content_row(
+    content: schemas.ContentCreate, blob: Optional[models.Blob]
+) -> Dict[str, Any]:
+    return {
+        "filename": content.filename,
+        "filepath": content.filepath,
+        "count": 0,
+        "blob_id": blob.id if blob is not None else None,
+        "width": content.width,
+        "height": content.height,
+        "frames": content.frames,
+    }
+
+
+def _association_rows(content_id: int, keywords_ids: Iterable[int]) -> List[dict]:
+    return [
+        {"contents_id": content_id, "keywords_id": keyword_id}
+        for keyword_id in keywords_ids
+    ]
+
+
+def _delete_associations(content_id: int, keywords_ids: Iterable[int]) -> Delete:
+    return delete(association_table).where(
+        association_table.c.contents_id == content_id,
+        association_table.c.keywords_id.in_(keywords_ids),
+    )
 
 
 def get_content_by_filename(db: Session, filename: str) -> [models.Content, None]:
@@ -13,70 +163,359 @@ def get_content_by_filename(db: Session, filename: str) -> [models.Content, None
     :param filename: The content filename
     :return: The Content model or None
     """
-    return db.query(models.Content).filter(models.Content.filename == filename).first()
+    return db.execute(_select_content_by_filename(filename)).scalars().first()
 
 
-def create_content(db: Session, content: schemas.ContentCreate) -> models.Content:
+async def get_content_by_filename_async(
+    db: AsyncSession, filename: str
+) -> [models.Content, None]:
+    """
+    Async version of get_content_by_filename
+    :param db: The async session database object
+    :param filename: The content filename
+    :return: The Content model or None
+    """
+    return (await db.execute(_select_content_by_filename(filename))).scalars().first()
+
+
+def _to_location(row) -> Optional[ContentLocation]:
+    if row is None:
+        return None
+    content_id, filepath, width, height = row
+    mimetype = mimetypes.guess_type(filepath)[0]
+    return ContentLocation(content_id, filepath, mimetype, width, height)
+
+
+def get_content_location_by_filename(
+    db: Session, filename: str
+) -> Optional[ContentLocation]:
+    """
+    Retrieve the location of a content file by its filename, without loading the
+    entity
+    :param db: The session database object
+    :param filename: The content filename
+    :return: The content location or None
+    """
+    return _to_location(db.execute(_select_content_location(filename)).first())
+
+
+async def get_content_location_by_filename_async(
+    db: AsyncSession, filename: str
+) -> Optional[ContentLocation]:
+    """
+    Async version of get_content_location_by_filename
+    :param db: The async session database object
+    :param filename: The content filename
+    :return: The content location or None
+    """
+    result = await db.execute(_select_content_location(filename))
+    return _to_location(result.first())
+
+
+def create_content(
+    db: Session, content: schemas.ContentCreate, blob: Optional[models.Blob] = None
+) -> models.Content:
     """
     Create a content entity, the keywords if they don't exists and save it into the
     database.
     :param db: The session database object
     :param content: The content schema to create
+    :param blob: The blob of the file with the content addressed storage
     :return: The created content entity
     """
 
-    # Retrieve existing keywords
-    keywords = content.keywords
-    db_keywords = (
-        db.query(models.Keyword).filter(models.Keyword.name.in_(keywords)).all()
-    )
-
-    # Find missing keywords entities and create them
-    for db_keyword in db_keywords:
-        keywords.remove(db_keyword.name)
-    for keyword in keywords:
-        db_keywords.append(models.Keyword(name=keyword))
+    # Retrieve existing keywords and create the missing ones
+    keywords_ids = get_or_create_keywords_ids(db, content.keywords)
 
     # Create the content entity
-    db_content = models.Content(
-        filename=content.filename, filepath=content.filepath, keywords=db_keywords
-    )
+    db_content = models.Content(**_content_row(content, blob))
     db.add(db_content)
+    db.flush()
+    if keywords_ids:
+        rows = _association_rows(db_content.id, keywords_ids.values())
+        db.execute(insert(association_table), rows)
+    keywords = get_keywords_entities(db, keywords_ids)
+    set_committed_value(db_content, "keywords", keywords)
+    # The session doesn't expire on commit, the entity and its keywords are
+    # still loaded so there is no need to refresh it
     db.commit()
-    db.refresh(db_content)
     return db_content
 
 
-def increment_content_access(db: Session, content_id: int) -> None:
+async def create_content_async(
+    db: AsyncSession,
+    content: schemas.ContentCreate,
+    blob: Optional[models.Blob] = None,
+) -> models.Content:
+    """
+    Async version of create_content
+    :param db: The async session database object
+    :param content: The content schema to create
+    :param blob: The blob of the file with the content addressed storage
+    :return: The created content entity
     """
-    Increment the access counter for a content entity.
+    keywords_ids = await get_or_create_keywords_ids_async(db, content.keywords)
+
+    db_content = models.Content(**_content_row(content, blob))
+    db.add(db_content)
+    await db.flush()
+    if keywords_ids:
+        rows = _association_rows(db_content.id, keywords_ids.values())
+        await db.execute(insert(association_table), rows)
+    keywords = get_keywords_entities(db.sync_session, keywords_ids)
+    set_committed_value(db_content, "keywords", keywords)
+    await db.commit()
+    return db_content
+
+
+def create_contents(
+    db: Session,
+    contents: List[schemas.ContentCreate],
+    blobs: Optional[List[Optional[models.Blob]]] = None,
+) -> List[models.Content]:
+    """
+    Create many content entities and their missing keywords with a few bulk
+    statements, in one transaction.
     :param db: The session database object
-    :param content_id: The content entity id
+    :param contents: The contents schemas to create
+    :param blobs: The blob of each content file with the content addressed storage
+    :return: The created content entities, in the same order
     """
-    db.query(models.Content).filter_by(id=content_id).update(
-        {models.Content.count: models.Content.count + 1}
-    )
+    if len(contents) == 0:
+        return []
+    blobs = blobs or [None] * len(contents)
+
+    # Retrieve existing keywords and create the missing ones
+    names = [name for content in contents for name in content.keywords]
+    keywords_ids = get_or_create_keywords_ids(db, names)
+
+    # The ids of an executemany aren't returned by every driver, they are selected
+    rows = [_content_row(content, blob) for content, blob in zip(contents, blobs)]
+    db.execute(insert(models.Content), rows)
+    contents_ids = {}
+    for chunk in chunks([content.filename for content in contents], IN_CHUNK_SIZE):
+        contents_ids.update(db.execute(_select_contents_ids(chunk)).all())
+    associations = [
+        row
+        for content in contents
+        for row in _association_rows(
+            contents_ids[content.filename],
+            dict.fromkeys(keywords_ids[name] for name in content.keywords),
+        )
+    ]
+    if associations:
+        db.execute(insert(association_table), associations)
     db.commit()
 
+    db_contents = {}
+    for chunk in chunks(list(contents_ids.values()), IN_CHUNK_SIZE):
+        for db_content in db.execute(_select_contents_by_ids(chunk)).scalars():
+            db_contents[db_content.filename] = db_content
+    return [db_contents[content.filename] for content in contents]
 
-def get_contents_by_keywords(
-    db: Session, keywords: [Iterator[str], List[str]]
+
+async def create_contents_async(
+    db: AsyncSession,
+    contents: List[schemas.ContentCreate],
+    blobs: Optional[List[Optional[models.Blob]]] = None,
 ) -> List[models.Content]:
+    """
+    Async version of create_contents
+    :param db: The async session database object
+    :param contents: The contents schemas to create
+    :param blobs: The blob of each content file with the content addressed storage
+    :return: The created content entities, in the same order
+    """
+    if len(contents) == 0:
+        return []
+    blobs = blobs or [None] * len(contents)
+
+    names = [name for content in contents for name in content.keywords]
+    keywords_ids = await get_or_create_keywords_ids_async(db, names)
+
+    rows = [_content_row(content, blob) for content, blob in zip(contents, blobs)]
+    await db.execute(insert(models.Content), rows)
+    contents_ids = {}
+    for chunk in chunks([content.filename for content in contents], IN_CHUNK_SIZE):
+        contents_ids.update((await db.execute(_select_contents_ids(chunk))).all())
+    associations = [
+        row
+        for content in contents
+        for row in _association_rows(
+            contents_ids[content.filename],
+            dict.fromkeys(keywords_ids[name] for name in content.keywords),
+        )
+    ]
+    if associations:
+        await db.execute(insert(association_table), associations)
+    await db.commit()
+
+    db_contents = {}
+    for chunk in chunks(list(contents_ids.values()), IN_CHUNK_SIZE):
+        result = await db.execute(_select_contents_by_ids(chunk))
+        for db_content in result.scalars():
+            db_contents[db_content.filename] = db_content
+    return [db_contents[content.filename] for content in contents]
+
+
+def increment_contents_access(db: Session, increments: Dict[int, int]) -> None:
+    """
+    Increment the access counters of several content entities in one statement,
+    then commit. Keep the number of entities below IN_CHUNK_SIZE.
+    :param db: The session database object
+    :param increments: The increment to add for each content entity id
+    """
+    db.execute(_update_contents_access(increments))
+    db.commit()
+
+
+async def increment_contents_access_async(
+    db: AsyncSession, increments: Dict[int, int]
+) -> None:
+    """
+    Async version of increment_contents_access
+    :param db: The async session database object
+    :param increments: The increment to add for each content entity id
+    """
+    await db.execute(_update_contents_access(increments))
+    await db.commit()
+
+
+def get_contents_by_keywords(
+    db: Session,
+    keywords: [Iterator[str], List[str]],
+    limit: Optional[int] = None,
+    after: Optional[Tuple[int, int]] = None,
+) -> List[ContentMatch]:
     """
     Retrieves content that matches at least one keyword.
-    The list is ordered by the number of matched keywords.
+    The list is ordered by the number of matched keywords, then by id.
     :param db: The session database object
     :param keywords:
+    :param limit: The maximum number of contents to retrieve, no limit if None
+    :param after: The (matches, id) keyset of the last content of the previous page
     :return: The ordered list of matched contents
     """
-    return (
-        db.query(models.Content)
-        .join(models.Content, models.Keyword.contents)
-        .filter(models.Keyword.name.in_(keywords))
-        .group_by(models.Content.id)
-        .order_by(desc(func.count()))
-        .all()
+    statement = _select_contents_by_keywords(list(keywords), limit, after)
+    return [
+        ContentMatch(content, content.id, matches)
+        for content, matches in db.execute(statement)
+    ]
+
+
+async def get_contents_by_keywords_async(
+    db: AsyncSession,
+    keywords: [Iterator[str], List[str]],
+    limit: Optional[int] = None,
+    after: Optional[Tuple[int, int]] = None,
+) -> List[ContentMatch]:
+    """
+    Async version of get_contents_by_keywords
+    :param db: The async session database object
+    :param keywords:
+    :param limit: The maximum number of contents to retrieve, no limit if None
+    :param after: The (matches, id) keyset of the last content of the previous page
+    :return: The ordered list of matched contents
+    """
+    statement = _select_contents_by_keywords(list(keywords), limit, after)
+    return [
+        ContentMatch(content, content.id, matches)
+        for content, matches in await db.execute(statement)
+    ]
+
+
+def get_contents_by_ids(
+    db: Session, ids: List[int], keyword: Optional[str] = None
+) -> Dict[int, models.Content]:
+    """
+    Retrieve contents by their ids, the missing ones are ignored
+    :param db: The session database object
+    :param ids: The contents ids
+    :param keyword: Only retrieve the contents with this normalized keyword
+    :return: The contents by id
+    """
+    contents = {}
+    for chunk in chunks(ids, IN_CHUNK_SIZE):
+        statement = _select_contents_by_ids(chunk, keyword)
+        contents.update((c.id, c) for c in db.execute(statement).scalars())
+    return contents
+
+
+async def get_contents_by_ids_async(
+    db: AsyncSession, ids: List[int], keyword: Optional[str] = None
+) -> Dict[int, models.Content]:
+    """
+    Async version of get_contents_by_ids
+    :param db: The async session database object
+    :param ids: The contents ids
+    :param keyword: Only retrieve the contents with this normalized keyword
+    :return: The contents by id
+    """
+    contents = {}
+    for chunk in chunks(ids, IN_CHUNK_SIZE):
+        result = await db.execute(_select_contents_by_ids(chunk, keyword))
+        contents.update((c.id, c) for c in result.scalars())
+    return contents
+
+
+def _bytewise(column: ColumnElement, dialect: str) -> ColumnElement:
+    """
+    Get a string column compared byte by byte, in the order of the Python strings.
+    The default MySQL collations ignore the case and Postgres follows the locale.
+    :param column: the string column
+    :param dialect: the database dialect name
+    :return: the column expression to order by
+    """
+    if dialect == "mysql":
+        return cast(column, LargeBinary)
+    if dialect == "postgresql":
+        return column.collate("C")
+    # The SQLite BINARY default collation already compares the bytes
+    return column
+
+
+def get_contents_files(db: Session, chunk_size: int) -> Iterator[Tuple[str, int, str]]:
+    """
+    Stream the files of all the contents, used to reconcile them with the upload
+    directory. The contents of a blob share its filepath.
+    :param db: The session database object
+    :param chunk_size: The number of rows fetched at once
+    :return: An iterator of (filepath, content id, content filename) ordered by
+    filepath, compared as the Python strings, then by id
+    """
+    filepath = _bytewise(models.Content.filepath, db.get_bind().dialect.name)
+    statement = (
+        select(models.Content.filepath, models.Content.id, models.Content.filename)
+        .order_by(filepath, models.Content.id)
+        .execution_options(stream_results=True)
     )
+    for row in db.execute(statement).yield_per(chunk_size):
+        yield tuple(row)
+
+
+def get_contents_keywords(db: Session) -> Iterator[Tuple]:
+    """
+    Stream the keywords of all the contents, used to build in-memory indexes.
+    :param db: The session database object
+    :return: An iterator of (content id, content filename, width, height, frames,
+    keyword name) ordered by content id
+    """
+    statement = (
+        select(
+            models.Content.id,
+            models.Content.filename,
+            models.Content.width,
+            models.Content.height,
+            models.Content.frames,
+            models.Keyword.name,
+        )
+        .select_from(models.Content)
+        .join(models.Content.keywords)
+        .order_by(models.Content.id)
+        .execution_options(stream_results=True)
+    )
+    for row in db.execute(statement).yield_per(1000):
+        yield tuple(row)
 
 
 def update_content_keywords(
@@ -95,20 +534,88 @@ def update_content_keywords(
     if content is None:
         return None
 
-    # Retrieve existing keywords
-    db_keywords = (
-        db.query(models.Keyword).filter(models.Keyword.name.in_(keywords)).all()
-    )
-
-    # Find missing keywords entities and create them
-    for db_keyword in db_keywords:
-        keywords.remove(db_keyword.name)
-    for keyword in keywords:
-        db_keywords.append(models.Keyword(name=keyword))
+    # Retrieve existing keywords and create the missing ones
+    keywords_ids = get_or_create_keywords_ids(db, keywords)
 
-    # Update the content entity
-    content.keywords = db_keywords
-    db.add(content)
+    # Only the changed association rows are written
+    current = {keyword.id for keyword in content.keywords}
+    removed = current.difference(keywords_ids.values())
+    added = [id_ for id_ in keywords_ids.values() if id_ not in current]
+    if removed:
+        db.execute(_delete_associations(content.id, removed))
+    if added:
+        db.execute(insert(association_table), _association_rows(content.id, added))
+    keywords = get_keywords_entities(db, keywords_ids)
+    set_committed_value(content, "keywords", keywords)
     db.commit()
-    db.refresh(content)
     return content
+
+
+async def update_content_keywords_async(
+    db: AsyncSession, filename: str, keywords: [Iterator[str], List[str]]
+) -> [models.Content, None]:
+    """
+    Async version of update_content_keywords
+    :param db: The async session database object
+    :param filename: The content filename
+    :param keywords: The new keywords for the entity
+    :return: The updated content entity or None if it doesn't exist
+    """
+    content = await get_content_by_filename_async(db, filename)
+    if content is None:
+        return None
+
+    keywords_ids = await get_or_create_keywords_ids_async(db, keywords)
+
+    current = {keyword.id for keyword in content.keywords}
+    removed = current.difference(keywords_ids.values())
+    added = [id_ for id_ in keywords_ids.values() if id_ not in current]
+    if removed:
+        await db.execute(_delete_associations(content.id, removed))
+    if added:
+        rows = _association_rows(content.id, added)
+        await db.execute(insert(association_table), rows)
+    keywords = get_keywords_entities(db.sync_session, keywords_ids)
+    set_committed_value(content, "keywords", keywords)
+    await db.commit()
+    return content
+
+
+def delete_content(db: Session, content: models.Content) -> bool:
+    """
+    Delete a content entity from the database and release its blob. The removal of
+    its file, or the purge of its blob, is queued in the same transaction.
+    :param db: The session database object
+    :param content: The content entity to delete
+    :return: True if the content file isn't used anymore
+    """
+    db.delete(content)
+    unused = content.blob_id is None or release_blob(db, content.blob_id)
+    if unused:
+        _queue_file_deletion(db, content)
+    db.commit()
+    return unused
+
+
+async def delete_content_async(db: AsyncSession, content: models.Content) -> bool:
+    """
+    Async version of delete_content
+    :param db: The async session database object
+    :param content: The content entity to delete
+    :return: True if the content file isn't used anymore
+    """
+    await db.delete(content)
+    unused = content.blob_id is None or await release_blob_async(db, content.blob_id)
+    if unused:
+        _queue_file_deletion(db, content)
+    await db.commit()
+    return unused
+
+
+def _queue_file_deletion(
+    db: Union[Session, AsyncSession], content: models.Content
+) -> None:
+    if content.blob_id is None:
+        queue_deletion(db, filepath=content.filepath)
+    else:
+        queue_deletion(db, blob_id=content.blob_id)
@@ -0,0 +1,96 @@
+from typing import List, Optional, Union
+
+from sqlalchemy import delete, select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Delete, Select
+
+from app import models
+from app.repositories.keyword import IN_CHUNK_SIZE
+from app.utils.iterables import chunks
+
+# The queued deletions are added to the transaction of the caller, so a content
+# and its file removal are committed together. They are processed in id order.
+
+
+def _select_pending_deletions(after_id: int, limit: int) -> Select:
+    return (
+        select(
+            models.PendingDeletion.id,
+            models.PendingDeletion.filepath,
+            models.PendingDeletion.blob_id,
+        )
+        .where(models.PendingDeletion.id > after_id)
+        .order_by(models.PendingDeletion.id)
+        .limit(limit)
+    )
+
+
+def _delete_pending_deletions(ids: List[int]) -> Delete:
+    return (
+        delete(models.PendingDeletion)
+        .where(models.PendingDeletion.id.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def queue_deletion(
+    db: Union[Session, AsyncSession],
+    filepath: Optional[str] = None,
+    blob_id: Optional[int] = None,
+) -> None:
+    """
+    Queue the removal of a file, or the purge of a blob. The transaction isn't
+    committed.
+    :param db: The session database object, sync or async
+    :param filepath: The file to remove, of a content without blob
+    :param blob_id: The blob entity id to purge if it is still unreferenced
+    """
+    db.add(models.PendingDeletion(filepath=filepath, blob_id=blob_id))
+
+
+def get_pending_deletions(db: Session, after_id: int, limit: int) -> List[Row]:
+    """
+    Retrieve a batch of queued deletions
+    :param db: The session database object
+    :param after_id: Only the deletions queued after this one, 0 for the first batch
+    :param limit: The maximum number of deletions
+    :return: The (id, filepath, blob_id) rows ordered by id
+    """
+    return db.execute(_select_pending_deletions(after_id, limit)).all()
+
+
+async def get_pending_deletions_async(
+    db: AsyncSession, after_id: int, limit: int
+) -> List[Row]:
+    """
+    Async version of get_pending_deletions
+    :param db: The async session database object
+    :param after_id: Only the deletions queued after this one, 0 for the first batch
+    :param limit: The maximum number of deletions
+    :return: The (id, filepath, blob_id) rows ordered by id
+    """
+    return (await db.execute(_select_pending_deletions(after_id, limit))).all()
+
+
+def delete_pending_deletions(db: Session, ids: List[int]) -> None:
+    """
+    Remove the processed deletions from the queue, then commit
+    :param db: The session database object
+    :param ids: The deletions ids
+    """
+    for chunk in chunks(ids, IN_CHUNK_SIZE):
+        db.execute(_delete_pending_deletions(chunk))
+    db.commit()
+
+
+async def delete_pending_deletions_async(db: AsyncSession, ids: List[int]) -> None:
+    """
+    Async version of delete_pending_deletions
+    :param db: The async session database object
+    :param ids: The deletions ids
+    """
+    for chunk in chunks(ids, IN_CHUNK_SIZE):
+        await db.execute(_delete_pending_deletions(chunk))
+    await db.commit()
@@ -0,0 +1,232 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import desc, event, func, insert, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.sql import Insert, Select
+
+from app import models
+from app.models.content import association_table
+from app.utils.iterables import chunks
+
+# Maximum number of values in the IN clauses and multi rows inserts
+IN_CHUNK_SIZE = 500
+
+# The keywords are never removed nor renamed, a name -> id mapping stays valid.
+# The ids are only cached once the transaction that read or created them is
+# committed, until then they are kept in the session info.
+KEYWORD_ID_CACHE_SIZE = 100_000
+_PENDING_IDS = "keywords_ids"
+
+_ids_cache: "OrderedDict[str, int]" = OrderedDict()
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_committed_ids(session: Session) -> None:
+    # Also dispatched when a savepoint is released
+    if session.in_nested_transaction():
+        return
+    for name, keyword_id in session.info.pop(_PENDING_IDS, {}).items():
+        _ids_cache[name] = keyword_id
+        _ids_cache.move_to_end(name)
+    while len(_ids_cache) > KEYWORD_ID_CACHE_SIZE:
+        _ids_cache.popitem(last=False)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_ids(session: Session) -> None:
+    session.info.pop(_PENDING_IDS, None)
+
+
+def _select_keywords_ids(names: List[str], lock: bool = False) -> Select:
+    statement = select(models.Keyword.name, models.Keyword.id).where(
+        models.Keyword.name.in_(names)
+    )
+    # A locking read sees the rows committed by the concurrent transactions, a
+    # MySQL consistent read would only see its snapshot
+    return statement.with_for_update(read=True) if lock else statement
+
+
+def _select_keywords_usages() -> Select:
+    usage = func.count(association_table.c.contents_id)
+    return (
+        select(models.Keyword.name, usage)
+        .outerjoin(
+            association_table, association_table.c.keywords_id == models.Keyword.id
+        )
+        .group_by(models.Keyword.id, models.Keyword.name)
+    )
+
+
+def _select_keywords_by_prefix(prefix: str, limit: int) -> Select:
+    statement = _select_keywords_usages()
+    usage = statement.selected_columns[1]
+    return (
+        statement.where(models.Keyword.name.startswith(prefix, autoescape=True))
+        .order_by(desc(usage), models.Keyword.name)
+        .limit(limit)
+    )
+
+
+# None if the dialect has no upsert
+def _upsert_keywords(dialect_name: str, names: List[str]) -> Optional[Insert]:
+    rows = [{"name": name} for name in names]
+    if dialect_name == "mysql":
+        statement = mysql.insert(models.Keyword).values(rows)
+        return statement.on_duplicate_key_update(name=statement.inserted.name)
+    if dialect_name == "sqlite":
+        statement = sqlite.insert(models.Keyword).values(rows)
+        return statement.on_conflict_do_nothing(index_elements=["name"])
+    if dialect_name == "postgresql":
+        statement = postgresql.insert(models.Keyword).values(rows)
+        return statement.on_conflict_do_nothing(index_elements=["name"])
+    return None
+
+
+def _get_cached_ids(names: Iterable[str]) -> Dict[str, int]:
+    ids = {}
+    for name in dict.fromkeys(names):
+        keyword_id = _ids_cache.get(name)
+        if keyword_id is not None:
+            ids[name] = keyword_id
+    return ids
+
+
+def _add_pending_ids(db: Session, ids: Dict[str, int]) -> None:
+    if not ids:
+        return
+    db.info.setdefault(_PENDING_IDS, {}).update(ids)
+
+
+def get_or_create_keywords_ids(db: Session, names: Iterable[str]) -> Dict[str, int]:
+    """
+    Get the ids of keywords by their names, the missing keywords are created.
+    The concurrent creations of a keyword don't conflict, they are upserted.
+    Nothing is committed.
+    :param db: The session database object
+    :param names: The keywords names
+    :return: The id of each keyword name
+    """
+    names = list(dict.fromkeys(names))
+    ids = _get_cached_ids(names)
+    missing = [name for name in names if name not in ids]
+    found = {}
+    for chunk in chunks(missing, IN_CHUNK_SIZE):
+        found.update(db.execute(_select_keywords_ids(chunk)).all())
+    missing = [name for name in missing if name not in found]
+    for chunk in chunks(missing, IN_CHUNK_SIZE):
+        _create_keywords(db, chunk)
+        found.update(db.execute(_select_keywords_ids(chunk, lock=True)).all())
+    _add_pending_ids(db, found)
+    ids.update(found)
+    return {name: ids[name] for name in names}
+
+
+async def get_or_create_keywords_ids_async(
+    db: AsyncSession, names: Iterable[str]
+) -> Dict[str, int]:
+    """
+    Async version of get_or_create_keywords_ids
+    :param db: The async session database object
+    :param names: The keywords names
+    :return: The id of each keyword name
+    """
+    names = list(dict.fromkeys(names))
+    ids = _get_cached_ids(names)
+    missing = [name for name in names if name not in ids]
+    found = {}
+    for chunk in chunks(missing, IN_CHUNK_SIZE):
+        found.update((await db.execute(_select_keywords_ids(chunk))).all())
+    missing = [name for name in missing if name not in found]
+    for chunk in chunks(missing, IN_CHUNK_SIZE):
+        await db.run_sync(_create_keywords, chunk)
+        statement = _select_keywords_ids(chunk, lock=True)
+        found.update((await db.execute(statement)).all())
+    _add_pending_ids(db.sync_session, found)
+    ids.update(found)
+    return {name: ids[name] for name in names}
+
+
+def _create_keywords(db: Session, names: List[str]) -> None:
+    """
+    Insert keywords, the existing ones are ignored
+    :param db: The session database object
+    :param names: The keywords names
+    """
+    statement = _upsert_keywords(db.get_bind().dialect.name, names)
+    if statement is not None:
+        db.execute(statement)
+        return
+    # No upsert, one savepoint per keyword
+    for name in names:
+        try:
+            with db.begin_nested():
+                db.execute(insert(models.Keyword).values(name=name))
+        except IntegrityError:
+            pass
+
+
+def get_keywords_entities(db: Session, ids: Dict[str, int]) -> List[models.Keyword]:
+    """
+    Get the keywords entities from their ids without loading them. The entities
+    already in the session are reused.
+    :param db: The session database object, sync or the sync session of an async one
+    :param ids: The id of each keyword name
+    :return: The keywords entities, in the ids order
+    """
+    keywords = []
+    for name, keyword_id in ids.items():
+        keyword = models.Keyword(id=keyword_id, name=name)
+        make_transient_to_detached(keyword)
+        keywords.append(db.merge(keyword, load=False))
+    return keywords
+
+
+def get_keywords_names(db: Session) -> Iterator[str]:
+    """
+    Stream the keywords names, used to build in-memory indexes
+    :param db: The session database object
+    :return: An iterator of the keywords names
+    """
+    statement = select(models.Keyword.name).execution_options(stream_results=True)
+    return db.execute(statement).yield_per(1000).scalars()
+
+
+def get_keywords_usages(db: Session) -> Iterator[Tuple[str, int]]:
+    """
+    Stream the keywords with their number of contents, used to build in-memory
+    indexes
+    :param db: The session database object
+    :return: An iterator of (keyword name, number of contents)
+    """
+    for name, usage in db.execute(_select_keywords_usages()):
+        yield name, usage
+
+
+def get_keywords_by_prefix(
+    db: Session, prefix: str, limit: int
+) -> List[Tuple[str, int]]:
+    """
+    Get the keywords starting with a prefix, the most used first
+    :param db: The session database object
+    :param prefix: The normalized prefix
+    :param limit: The maximum number of keywords
+    :return: The (keyword name, number of contents) list
+    """
+    return db.execute(_select_keywords_by_prefix(prefix, limit)).all()
+
+
+async def get_keywords_by_prefix_async(
+    db: AsyncSession, prefix: str, limit: int
+) -> List[Tuple[str, int]]:
+    """
+    Async version of get_keywords_by_prefix
+    :param db: The async session database object
+    :param prefix: The normalized prefix
+    :param limit: The maximum number of keywords
+    :return: The (keyword name, number of contents) list
+    """
+    return (await db.execute(_select_keywords_by_prefix(prefix, limit))).all()
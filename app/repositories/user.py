@@ -1,8 +1,15 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
 
 from app import models
 
 
+def _select_user(username: str) -> Select:
+    return select(models.User).where(models.User.username == username)
+
+
 def get_user(db: Session, username: str) -> models.User:
     """
     Retrieve an user by its username
@@ -10,4 +17,14 @@ def get_user(db: Session, username: str) -> models.User:
     :param username: The user's username
     :return: The User model or None
     """
-    return db.query(models.User).filter(models.User.username == username).first()
+    return db.execute(_select_user(username)).scalars().first()
+
+
+async def get_user_async(db: AsyncSession, username: str) -> models.User:
+    """
+    Async version of get_user
+    :param db: The async session database object
+    :param username: The user's username
+    :return: The User model or None
+    """
+    return (await db.execute(_select_user(username))).scalars().first()
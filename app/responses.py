@@ -0,0 +1,228 @@
+import os
+import secrets
+from typing import AsyncIterator, List, Mapping, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from app.services.descriptor_cache import FileDescriptorCacheService
+
+# ASGI extension of the servers that can send a file themselves, with sendfile
+ZERO_COPY_EXTENSION = "http.response.zerocopysend"
+
+
+class ContentResponse(Response):
+    """
+    Response of a content body, either whole (200) or partial (206) with one range
+    or several ranges in a multipart/byteranges body.
+    The subclasses tell where the bytes are read from.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(
+        self,
+        size: int,
+        media_type: str,
+        headers: Optional[Mapping[str, str]] = None,
+        ranges: Optional[List[Tuple[int, int]]] = None,
+        method: Optional[str] = None,
+    ):
+        """
+        Construct the response
+        :param size: the content size in bytes
+        :param media_type: the content mime type
+        :param headers: the additional headers
+        :param ranges: the inclusive (first byte, last byte) ranges to send, the
+        whole content if None
+        :param method: the request method, only the headers are sent for HEAD
+        """
+        self.size = size
+        self.background = None
+        self.send_header_only = method is not None and method.upper() == "HEAD"
+        headers = dict(headers or {})
+        headers["accept-ranges"] = "bytes"
+
+        # Parts of the body: (bytes sent before, first byte, last byte)
+        self._parts: List[Tuple[bytes, int, int]] = []
+        self._epilogue = b""
+        if ranges is None:
+            self.status_code = 200
+            self.media_type = media_type
+            if size > 0:
+                self._parts.append((b"", 0, size - 1))
+            headers["content-length"] = str(size)
+        elif len(ranges) == 1:
+            self.status_code = 206
+            self.media_type = media_type
+            first, last = ranges[0]
+            self._parts.append((b"", first, last))
+            headers["content-range"] = f"bytes {first}-{last}/{size}"
+            headers["content-length"] = str(last - first + 1)
+        else:
+            self.status_code = 206
+            boundary = secrets.token_hex(16)
+            self.media_type = f"multipart/byteranges; boundary={boundary}"
+            for first, last in ranges:
+                part_headers = (
+                    f"--{boundary}\r\n"
+                    f"Content-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {first}-{last}/{size}\r\n\r\n"
+                )
+                # The CRLF that ends the previous part is sent with the next headers
+                prefix = (b"\r\n" if self._parts else b"") + part_headers.encode()
+                self._parts.append((prefix, first, last))
+            self._epilogue = f"\r\n--{boundary}--\r\n".encode()
+            length = len(self._epilogue) + sum(
+                len(prefix) + last - first + 1 for prefix, first, last in self._parts
+            )
+            headers["content-length"] = str(length)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            await self.send_body(send)
+
+    async def send_body(self, send: Send) -> None:
+        """
+        Send all the parts of the body
+        :param send: the ASGI send function
+        """
+        for prefix, first, last in self._parts:
+            if prefix:
+                await send(
+                    {"type": "http.response.body", "body": prefix, "more_body": True}
+                )
+            await self.send_part(send, first, last - first + 1)
+        await send(
+            {"type": "http.response.body", "body": self._epilogue, "more_body": False}
+        )
+
+    async def send_part(self, send: Send, offset: int, length: int) -> None:
+        """
+        Send a part of the content
+        :param send: the ASGI send function
+        :param offset: the first byte
+        :param length: the number of bytes
+        """
+        async for chunk in self.read(offset, length):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+    def read(self, offset: int, length: int) -> AsyncIterator[bytes]:
+        """
+        Read a part of the content by chunks
+        :param offset: the first byte
+        :param length: the number of bytes
+        :return: an async iterator of the chunks
+        """
+        raise NotImplementedError()
+
+
+class FileContentResponse(ContentResponse):
+    """
+    Content response read from a file. With sendfile, the file is given to the
+    server when it supports the zero copy extension, else it is read by chunks.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *args,
+        descriptors: Optional[FileDescriptorCacheService] = None,
+        sendfile: bool = False,
+        **kwargs,
+    ):
+        """
+        Construct the response
+        :param path: the file path
+        :param descriptors: the cache of the open files, None if disabled
+        :param sendfile: let the server send the file if it can
+        See ContentResponse for the other parameters
+        """
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.sendfile = sendfile
+        self._descriptors = descriptors
+        self._file = None
+        self._zero_copy = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self._zero_copy = self.sendfile and ZERO_COPY_EXTENSION in scope.get(
+            "extensions", {}
+        )
+        await super().__call__(scope, receive, send)
+
+    async def send_body(self, send: Send) -> None:
+        # The file is opened once for all the parts
+        if self._descriptors is None:
+            self._file = await run_in_threadpool(
+                open, self.path, mode="rb", buffering=0
+            )
+            try:
+                await super().send_body(send)
+            finally:
+                self._file.close()
+            return
+        descriptor = await self._descriptors.acquire(self.path)
+        try:
+            self._file = descriptor.file
+            await super().send_body(send)
+        finally:
+            self._descriptors.release(descriptor)
+
+    async def send_part(self, send: Send, offset: int, length: int) -> None:
+        if not self._zero_copy:
+            await super().send_part(send, offset, length)
+            return
+        await send(
+            {
+                "type": ZERO_COPY_EXTENSION,
+                "file": self._file,
+                "offset": offset,
+                "count": length,
+                "more_body": True,
+            }
+        )
+
+    async def read(self, offset: int, length: int) -> AsyncIterator[bytes]:
+        # pread doesn't move the file position, the file can be shared
+        fd = self._file.fileno()
+        while length > 0:
+            chunk = await run_in_threadpool(
+                os.pread, fd, min(self.chunk_size, length), offset
+            )
+            if not chunk:
+                raise RuntimeError(f"File at path {self.path} has been truncated.")
+            offset += len(chunk)
+            length -= len(chunk)
+            yield chunk
+
+
+class MemoryContentResponse(ContentResponse):
+    """Content response of a body already in memory"""
+
+    def __init__(self, body: bytes, *args, **kwargs):
+        """
+        Construct the response
+        :param body: the whole content body
+        See ContentResponse for the other parameters
+        """
+        super().__init__(len(body), *args, **kwargs)
+        self._body = body
+
+    async def read(self, offset: int, length: int) -> AsyncIterator[bytes]:
+        if offset == 0 and length == len(self._body):
+            # No copy for the whole body
+            yield self._body
+        else:
+            yield self._body[offset : offset + length]
@@ -1,19 +1,47 @@
+import json
 import os
+import tarfile
+import zipfile
 from logging import getLogger
-from typing import List
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from urllib.parse import quote
 
-import magic
-from fastapi import (APIRouter, BackgroundTasks, Depends, File, Form,
-                     HTTPException, Query, UploadFile, status)
-from fastapi.responses import FileResponse
+import aiofiles
+import aiofiles.os
+import timeflake
+from fastapi import (APIRouter, Depends, File, Form, HTTPException, Query,
+                     Request, Response, UploadFile, status)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app import dependencies, models
+from app import dependencies, models, repositories
+from app.config import Settings
 from app.models import User
+from app.repositories import blob as blob_repository
 from app.repositories import content as repository
-from app.schemas.content import ContentCreate, ContentPatch, ContentRead
-from app.services.file import FileService
+from app.responses import FileContentResponse, MemoryContentResponse
+from app.schemas.content import (ContentBatchItem, ContentCreate, ContentPatch,
+                                 ContentRead)
+from app.services.content_cache import ContentCacheService
+from app.services.counter import AccessCounterService
+from app.services.deletion import FileDeletionService
+from app.services.descriptor_cache import FileDescriptorCacheService
+from app.services.file import (FileService, StoredFile,
+                               UnsupportedMediaTypeError)
+from app.services.keyword_completion import KeywordCompletionService
+from app.services.keyword_index import KeywordIndexService
+from app.services.location_cache import ContentLocationCacheService
+from app.services.rendition import Rendition, RenditionService
+from app.services.trending import TrendingService
+from app.services.trigram_index import TrigramIndexService
+from app.utils.archives import UnsupportedArchiveError, iter_archive_files
+from app.utils.http import (CACHE_CONTROL_IMMUTABLE, RangeNotSatisfiableError,
+                            format_http_date, is_not_modified,
+                            is_range_applicable, parse_range)
 from app.utils.keywords import normalize_keywords, split_keywords_generator
+from app.utils.pagination import decode_cursor, encode_cursor
 
 LOGGER = getLogger("fastapi")
 VALID_MIMES_TYPES = ["image/gif", "image/jpeg", "image/png"]
@@ -21,34 +49,176 @@ VALID_MIMES_TYPES = ["image/gif", "image/jpeg", "image/png"]
 router = APIRouter()
 
 
+# Declared before /contents/{filename} so "trending" isn't taken for a filename
+@router.get(
+    "/contents/trending",
+    tags=["contents"],
+    description="Get the contents downloaded the most recently, optionally only "
+    "those with a keyword. The ranking is approximate and decays over time",
+    status_code=status.HTTP_200_OK,
+    response_model=List[ContentRead],
+)
+async def get_trending_contents(
+    keyword: Optional[str] = Query(None, min_length=1),
+    limit: Optional[int] = Query(
+        None, ge=1, description="Number of contents, capped to the maximum page size"
+    ),
+    settings: Settings = Depends(dependency=dependencies.get_settings),
+    trending: Optional[TrendingService] = Depends(
+        dependency=dependencies.get_trending_service
+    ),
+    db: Union[Session, AsyncSession] = Depends(
+        dependency=dependencies.get_read_session
+    ),
+):
+    if trending is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="The trending is disabled"
+        )
+    limit = min(limit or settings.search_max_page_size, settings.search_max_page_size)
+    if keyword is not None:
+        keyword = next(normalize_keywords([keyword]))
+
+    ranking = trending.top()
+    # Without keyword, most of the tracked contents are not needed. Some margin is
+    # kept for the deleted ones
+    ids = [content_id for content_id, _ in ranking]
+    if keyword is None:
+        ids = ids[: 2 * limit]
+    contents = await repositories.call(
+        db,
+        repository.get_contents_by_ids,
+        repository.get_contents_by_ids_async,
+        ids,
+        keyword,
+    )
+    ranked = [contents[content_id] for content_id in ids if content_id in contents]
+    return ranked[:limit]
+
+
 @router.get(
     "/contents/{filename}",
     tags=["contents"],
-    description="Get a content entity as binary",
+    description="Get a content entity as binary. The response can be cached "
+    "forever, conditional (If-None-Match, If-Modified-Since) and range requests are "
+    "supported. With the renditions enabled, a smaller copy or the first frame of "
+    "the image can be requested",
     status_code=status.HTTP_200_OK,
     response_class=FileResponse,
 )
 async def get_content(
     filename: str,
-    background_tasks: BackgroundTasks,
+    request: Request,
     count: bool = True,
-    db: Session = Depends(dependency=dependencies.get_db),
+    rendition_size: Optional[int] = Query(
+        None,
+        alias="size",
+        ge=1,
+        description="Maximum width and height, the closest larger rendition is served",
+    ),
+    still: bool = Query(False, description="Only the first frame of a GIF"),
+    counter_service: AccessCounterService = Depends(
+        dependency=dependencies.get_access_counter_service
+    ),
+    content_cache: Optional[ContentCacheService] = Depends(
+        dependency=dependencies.get_content_cache_service
+    ),
+    location_cache: Optional[ContentLocationCacheService] = Depends(
+        dependency=dependencies.get_content_location_cache_service
+    ),
+    renditions: Optional[RenditionService] = Depends(
+        dependency=dependencies.get_rendition_service
+    ),
+    descriptors: Optional[FileDescriptorCacheService] = Depends(
+        dependency=dependencies.get_file_descriptor_cache_service
+    ),
+    trending: Optional[TrendingService] = Depends(
+        dependency=dependencies.get_trending_service
+    ),
+    settings: Settings = Depends(dependency=dependencies.get_settings),
+    db: Union[Session, AsyncSession] = Depends(
+        dependency=dependencies.get_read_session
+    ),
 ):
 
-    content = _get_content_or_not_found(filename, db)
-    if not os.path.exists(content.filepath):
-        # Should not append
+    location = await _get_location_or_not_found(filename, location_cache, db)
+
+    # increase the counter, it will be written with the next flush
+    if count:
+        counter_service.increment(location.id)
+        if trending is not None:
+            trending.record(location.id)
+
+    rendition = None
+    if renditions is not None and (rendition_size is not None or still):
+        rendition = renditions.select(
+            location.mimetype, location.width, location.height, rendition_size, still
+        )
+
+    # The files never change, the validators are known without reading the file
+    etag = f'"{filename}"' if rendition is None else f'"{filename}@{rendition.name}"'
+    last_modified = _get_upload_timestamp(filename)
+    headers = {"etag": etag, "cache-control": CACHE_CONTROL_IMMUTABLE}
+    if last_modified is not None:
+        headers["last-modified"] = format_http_date(last_modified)
+    if is_not_modified(request.headers, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    filepath, mimetype = location.filepath, location.mimetype
+    try:
+        if rendition is not None:
+            filepath = await _get_rendition(renditions, filepath, rendition)
+            if filepath != location.filepath:
+                mimetype = rendition.mimetype
+            else:
+                # The image can't be rendered, the original is served
+                headers["etag"] = f'"{filename}"'
+        if settings.file_send_mode in ("x-accel-redirect", "x-sendfile"):
+            return _offload_response(settings, filepath, mimetype, headers)
+        body = content_cache.get(filepath) if content_cache is not None else None
+        if body is None:
+            size = (await aiofiles.os.stat(filepath)).st_size
+            if content_cache is not None and content_cache.accepts(size):
+                async with aiofiles.open(filepath, mode="rb") as fp:
+                    body = await fp.read()
+                content_cache.put(filepath, body)
+    except FileNotFoundError:
+        # Should not append, or the content has been deleted by another worker
         LOGGER.error(
             f"get_content. The file %s is not found but the entity exists",
-            content.filepath,
+            filepath,
         )
+        if location_cache is not None:
+            location_cache.invalidate(filename)
         _raise_content_not_found(filename)
+    if body is not None:
+        size = len(body)
 
-    # increase asynchronously the counter
-    if count:
-        background_tasks.add_task(repository.increment_content_access, db, content.id)
+    ranges = None
+    range_header = request.headers.get("range")
+    if range_header is not None and is_range_applicable(
+        request.headers, headers["etag"], last_modified
+    ):
+        try:
+            ranges = parse_range(range_header, size)
+        except RangeNotSatisfiableError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={"content-range": f"bytes */{size}"},
+            )
 
-    return FileResponse(content.filepath)
+    if body is not None:
+        return MemoryContentResponse(body, mimetype, headers, ranges, request.method)
+    return FileContentResponse(
+        filepath,
+        size,
+        mimetype,
+        headers,
+        ranges,
+        request.method,
+        descriptors=descriptors,
+        sendfile=settings.file_send_mode == "sendfile",
+    )
 
 
 @router.post(
@@ -62,50 +232,244 @@ async def upload_content(
     file: UploadFile = File(...),
     keywords: str = Form(...),
     file_service: FileService = Depends(dependency=dependencies.get_file_service),
-    db: Session = Depends(dependency=dependencies.get_db),
+    keyword_index: Optional[KeywordIndexService] = Depends(
+        dependency=dependencies.get_keyword_index_service
+    ),
+    keyword_completion: Optional[KeywordCompletionService] = Depends(
+        dependency=dependencies.get_keyword_completion_service
+    ),
+    trigram_index: Optional[TrigramIndexService] = Depends(
+        dependency=dependencies.get_trigram_index_service
+    ),
+    location_cache: Optional[ContentLocationCacheService] = Depends(
+        dependency=dependencies.get_content_location_cache_service
+    ),
+    renditions: Optional[RenditionService] = Depends(
+        dependency=dependencies.get_rendition_service
+    ),
+    db: Union[Session, AsyncSession] = Depends(dependency=dependencies.get_session),
     _: User = Depends(dependency=dependencies.get_jwt_bearer_service()),
 ):
-    # File verification
-    # Mime type
-    mime_type = magic.from_buffer(await file.read(2048), mime=True)
-    await file.seek(0)
-    if mime_type not in VALID_MIMES_TYPES:
-        raise HTTPException(
-            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            detail=f"The media type '{mime_type}' is not supported",
-        )
-
     # Keyword verification
     if len(keywords) == 0:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Empty keywords"
         )
-
     keywords = list(normalize_keywords(split_keywords_generator(keywords)))
-    filepath, filename = file_service.push(file, mimetype=mime_type)
 
-    content_create = ContentCreate(
-        filename=filename, filepath=filepath, keywords=keywords
-    )
+    # The mime type is verified while the file is saved
+    try:
+        stored_file = await file_service.push_async(file, VALID_MIMES_TYPES)
+    except UnsupportedMediaTypeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=format(e)
+        )
+
+    try:
+        blob = await _publish(stored_file, file_service, db)
+        content_create = _content_create(stored_file, blob, keywords)
+
+        # Create the response
+        content = await repositories.call(
+            db,
+            repository.create_content,
+            repository.create_content_async,
+            content_create,
+            blob,
+        )
+    finally:
+        await file_service.discard(stored_file)
 
-    # Create the response
-    content = repository.create_content(db, content_create)
+    if keyword_index is not None:
+        keyword_index.index_content(content)
+    if keyword_completion is not None:
+        keyword_completion.add_keywords(keyword.name for keyword in content.keywords)
+    if trigram_index is not None:
+        trigram_index.add_keywords(keyword.name for keyword in content.keywords)
+    if location_cache is not None:
+        # The filename may have been requested before its upload
+        location_cache.invalidate(content.filename)
+    if renditions is not None:
+        _schedule_renditions(renditions, stored_file)
     return content
 
 
+@router.post(
+    "/contents/batch",
+    tags=["contents"],
+    description="Create many content entities at once. The files are sent either "
+    "as a multipart list with their keywords in the same order, or as a zip or tar "
+    "archive with a JSON manifest of the keywords by file path. The result of each "
+    "file is returned in the same order",
+    status_code=status.HTTP_200_OK,
+    response_model=List[ContentBatchItem],
+)
+async def upload_contents_batch(
+    files: List[UploadFile] = File(None),
+    keywords: List[str] = Form(None),
+    archive: Optional[UploadFile] = File(None),
+    manifest: Optional[str] = Form(None, example='{"cats/1.jpeg": "cat, computer"}'),
+    settings: Settings = Depends(dependency=dependencies.get_settings),
+    file_service: FileService = Depends(dependency=dependencies.get_file_service),
+    keyword_index: Optional[KeywordIndexService] = Depends(
+        dependency=dependencies.get_keyword_index_service
+    ),
+    keyword_completion: Optional[KeywordCompletionService] = Depends(
+        dependency=dependencies.get_keyword_completion_service
+    ),
+    trigram_index: Optional[TrigramIndexService] = Depends(
+        dependency=dependencies.get_trigram_index_service
+    ),
+    location_cache: Optional[ContentLocationCacheService] = Depends(
+        dependency=dependencies.get_content_location_cache_service
+    ),
+    renditions: Optional[RenditionService] = Depends(
+        dependency=dependencies.get_rendition_service
+    ),
+    db: Union[Session, AsyncSession] = Depends(dependency=dependencies.get_session),
+    _: User = Depends(dependency=dependencies.get_jwt_bearer_service()),
+):
+    max_items = settings.batch_upload_max_items
+    if archive is not None:
+        try:
+            manifest = json.loads(manifest) if manifest is not None else None
+        except ValueError:
+            manifest = None
+        if not isinstance(manifest, dict):
+            _raise_bad_request("The manifest must be a JSON object")
+        items = _iter_archive_items(archive, manifest)
+    elif files:
+        if keywords is None or len(keywords) != len(files):
+            _raise_bad_request("Each file must have its keywords")
+        if len(files) > max_items:
+            _raise_too_many_items(max_items)
+        items = _iter_files_items(files, keywords)
+    else:
+        _raise_bad_request("No files nor archive")
+
+    results: List[ContentBatchItem] = []
+    # (index in results, keywords, staged file)
+    staged: List[Tuple[int, List[str], StoredFile]] = []
+    try:
+        # The files are staged one by one, the invalid ones are only reported
+        async for name, item_keywords, file in items:
+            if len(results) == max_items:
+                _raise_too_many_items(max_items)
+            result = ContentBatchItem(name=name, status_code=status.HTTP_201_CREATED)
+            results.append(result)
+            if not item_keywords:
+                result.status_code = status.HTTP_400_BAD_REQUEST
+                result.detail = "Empty or missing keywords"
+                continue
+            try:
+                stored_file = await file_service.push_async(file, VALID_MIMES_TYPES)
+            except UnsupportedMediaTypeError as e:
+                result.status_code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+                result.detail = format(e)
+                continue
+            item_keywords = normalize_keywords(split_keywords_generator(item_keywords))
+            staged.append((len(results) - 1, list(item_keywords), stored_file))
+
+        contents_create, blobs = [], []
+        for _, item_keywords, stored_file in staged:
+            blob = await _publish(stored_file, file_service, db)
+            blobs.append(blob)
+            contents_create.append(_content_create(stored_file, blob, item_keywords))
+
+        # All the entities are inserted in one transaction
+        contents = await repositories.call(
+            db,
+            repository.create_contents,
+            repository.create_contents_async,
+            contents_create,
+            blobs,
+        )
+    finally:
+        for _, _, stored_file in staged:
+            await file_service.discard(stored_file)
+
+    for (index, _, stored_file), content in zip(staged, contents):
+        results[index].content = content
+        if keyword_index is not None:
+            keyword_index.index_content(content)
+        names = [keyword.name for keyword in content.keywords]
+        if keyword_completion is not None:
+            keyword_completion.add_keywords(names)
+        if trigram_index is not None:
+            trigram_index.add_keywords(names)
+        if location_cache is not None:
+            location_cache.invalidate(content.filename)
+        if renditions is not None:
+            _schedule_renditions(renditions, stored_file)
+    return results
+
+
 @router.get(
     "/contents/",
     tags=["contents"],
-    description="Get contents by matching keywords",
+    description="Get contents by matching keywords. The results are paginated, "
+    "the next page cursor is given by the X-Next-Cursor header",
     status_code=status.HTTP_200_OK,
     response_model=List[ContentRead],
 )
 async def search_content_by_keywords(
+    response: Response,
     keywords: List[str] = Query(...),
-    db: Session = Depends(dependency=dependencies.get_db),
+    limit: Optional[int] = Query(
+        None, ge=1, description="Page size, capped to the maximum page size"
+    ),
+    cursor: Optional[str] = Query(
+        None, description="The X-Next-Cursor header of the previous page"
+    ),
+    stream: bool = Query(
+        False, description="Stream all the results as JSON lines instead of a page"
+    ),
+    fuzzy: bool = Query(
+        False,
+        description="Also match the keywords similar to the searched ones, ignored "
+        "if the fuzzy search is disabled",
+    ),
+    settings: Settings = Depends(dependency=dependencies.get_settings),
+    keyword_index: Optional[KeywordIndexService] = Depends(
+        dependency=dependencies.get_keyword_index_service
+    ),
+    trigram_index: Optional[TrigramIndexService] = Depends(
+        dependency=dependencies.get_trigram_index_service
+    ),
+    db: Union[Session, AsyncSession] = Depends(
+        dependency=dependencies.get_read_session
+    ),
 ):
-    db_keywords = repository.get_contents_by_keywords(db, normalize_keywords(keywords))
-    return db_keywords
+    keywords = list(normalize_keywords(keywords))
+    if fuzzy and trigram_index is not None:
+        # The contents are then ranked by the number of matched expansions
+        expansions = (trigram_index.expand(keyword) for keyword in keywords)
+        keywords = list(
+            dict.fromkeys(name for expanded in expansions for name, _ in expanded)
+        )
+    try:
+        after = decode_cursor(cursor) if cursor is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=format(e))
+
+    max_page_size = settings.search_max_page_size
+    if stream:
+        return StreamingResponse(
+            _stream_contents_by_keywords(
+                keywords, after, max_page_size, keyword_index, db
+            ),
+            media_type="application/x-ndjson",
+        )
+
+    # One more content is retrieved to know if there is a next page
+    limit = min(limit or max_page_size, max_page_size)
+    matches = await _search_page(keywords, limit + 1, after, keyword_index, db)
+    if len(matches) > limit:
+        matches = matches[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            matches[-1].matches, matches[-1].id
+        )
+    return [match.content for match in matches]
 
 
 @router.delete(
@@ -116,24 +480,55 @@ async def search_content_by_keywords(
 )
 async def delete_content_by_id(
     filename: str,
-    file_service: FileService = Depends(dependency=dependencies.get_file_service),
-    db: Session = Depends(dependency=dependencies.get_db),
+    file_deletion: FileDeletionService = Depends(
+        dependency=dependencies.get_file_deletion_service
+    ),
+    keyword_index: Optional[KeywordIndexService] = Depends(
+        dependency=dependencies.get_keyword_index_service
+    ),
+    keyword_completion: Optional[KeywordCompletionService] = Depends(
+        dependency=dependencies.get_keyword_completion_service
+    ),
+    content_cache: Optional[ContentCacheService] = Depends(
+        dependency=dependencies.get_content_cache_service
+    ),
+    location_cache: Optional[ContentLocationCacheService] = Depends(
+        dependency=dependencies.get_content_location_cache_service
+    ),
+    descriptors: Optional[FileDescriptorCacheService] = Depends(
+        dependency=dependencies.get_file_descriptor_cache_service
+    ),
+    trending: Optional[TrendingService] = Depends(
+        dependency=dependencies.get_trending_service
+    ),
+    db: Union[Session, AsyncSession] = Depends(dependency=dependencies.get_session),
     _: User = Depends(dependency=dependencies.get_jwt_bearer_service()),
 ):
-    content = _get_content_or_not_found(filename, db)
+    content = await _get_content_or_not_found(filename, db)
+    keywords = [keyword.name for keyword in content.keywords]
 
-    # It is preferable that the entity is first deleted from the database.
-    db.delete(content)
-    db.commit()
+    # The file removal is queued with the entity deletion, the file is removed in
+    # the background
+    unused = await repositories.call(
+        db, repository.delete_content, repository.delete_content_async, content
+    )
+    if keyword_index is not None:
+        keyword_index.remove_content(content.id)
+    if keyword_completion is not None:
+        keyword_completion.remove_keywords(keywords)
+    if trending is not None:
+        trending.remove(content.id)
+    if location_cache is not None:
+        location_cache.invalidate(filename)
 
-    try:
-        file_service.delete(content.filepath)
-    except OSError or FileNotFoundError as e:
-        LOGGER.error(
-            f"delete_content_by_id. The file %s couldn't de deleted. %s",
-            content.filepath,
-            e,
-        )
+    if not unused:
+        # Another content still uses the blob
+        return
+    if content_cache is not None:
+        content_cache.invalidate_file(content.filepath)
+    if descriptors is not None:
+        descriptors.invalidate(content.filepath)
+    file_deletion.notify()
 
 
 @router.patch(
@@ -146,7 +541,16 @@ async def delete_content_by_id(
 async def update_content_by_id(
     filename: str,
     content_patch: ContentPatch,
-    db: Session = Depends(dependency=dependencies.get_db),
+    keyword_index: Optional[KeywordIndexService] = Depends(
+        dependency=dependencies.get_keyword_index_service
+    ),
+    keyword_completion: Optional[KeywordCompletionService] = Depends(
+        dependency=dependencies.get_keyword_completion_service
+    ),
+    trigram_index: Optional[TrigramIndexService] = Depends(
+        dependency=dependencies.get_trigram_index_service
+    ),
+    db: Union[Session, AsyncSession] = Depends(dependency=dependencies.get_session),
     _: User = Depends(dependency=dependencies.get_jwt_bearer_service()),
 ):
     if len(content_patch.keywords) == 0:
@@ -154,26 +558,322 @@ async def update_content_by_id(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="an entity must have at least one keyword",
         )
-    keywords = normalize_keywords(content_patch.keywords)
-    content = repository.update_content_keywords(db, filename, keywords)
+    keywords = list(normalize_keywords(content_patch.keywords))
+    previous_keywords = []
+    if keyword_completion is not None:
+        # The usages of the previous keywords are decremented
+        previous = await _get_content_or_not_found(filename, db)
+        previous_keywords = [keyword.name for keyword in previous.keywords]
+    content = await repositories.call(
+        db,
+        repository.update_content_keywords,
+        repository.update_content_keywords_async,
+        filename,
+        keywords,
+    )
     if content is None:
         _raise_content_not_found(filename)
+    if keyword_index is not None:
+        keyword_index.index_content(content)
+    if keyword_completion is not None:
+        keyword_completion.remove_keywords(previous_keywords)
+        keyword_completion.add_keywords(keyword.name for keyword in content.keywords)
+    if trigram_index is not None:
+        trigram_index.add_keywords(keyword.name for keyword in content.keywords)
     return content
 
 
-def _get_content_or_not_found(filename: str, db: Session) -> models.Content:
+async def _get_content_or_not_found(
+    filename: str, db: Union[Session, AsyncSession]
+) -> models.Content:
     """
     Retrieve a content by its filename or raise a http not found exception
     :param filename: the content filename
+    :param db: the session database object, sync or async
     :return: the content model
     """
-    content = repository.get_content_by_filename(db, filename)
+    content = await repositories.call(
+        db,
+        repository.get_content_by_filename,
+        repository.get_content_by_filename_async,
+        filename,
+    )
 
     if content is None:
         _raise_content_not_found(filename)
     return content
 
 
+async def _get_location_or_not_found(
+    filename: str,
+    location_cache: Optional[ContentLocationCacheService],
+    db: Union[Session, AsyncSession],
+) -> repository.ContentLocation:
+    """
+    Retrieve the location of a content from the cache if enabled, else from the
+    database, or raise a http not found exception
+    :param filename: the content filename
+    :param location_cache: the location cache service or None if disabled
+    :param db: the session database object, sync or async
+    :return: the content location
+    """
+    cached, location = False, None
+    if location_cache is not None:
+        cached, location = location_cache.get(filename)
+    if not cached:
+        location = await repositories.call(
+            db,
+            repository.get_content_location_by_filename,
+            repository.get_content_location_by_filename_async,
+            filename,
+        )
+        if location_cache is not None:
+            location_cache.put(filename, location)
+
+    if location is None:
+        _raise_content_not_found(filename)
+    return location
+
+
+async def _publish(
+    stored_file: StoredFile,
+    file_service: FileService,
+    db: Union[Session, AsyncSession],
+) -> Optional[models.Blob]:
+    """
+    Move a staged file at its place, with its blob reference in the content
+    addressed storage mode. The reference isn't committed.
+    :param stored_file: the staged file
+    :param file_service: the file service
+    :param db: the session database object, sync or async
+    :return: the blob of the file or None if the storage isn't content addressed
+    """
+    # The blob reference is taken before publishing the file, so the blob
+    # can't be purged in the meantime
+    blob = None
+    if file_service.content_addressed:
+        blob = await repositories.call(
+            db,
+            blob_repository.acquire_blob,
+            blob_repository.acquire_blob_async,
+            stored_file.checksum,
+            stored_file.filepath,
+        )
+    await file_service.publish(stored_file)
+    return blob
+
+
+def _content_create(
+    stored_file: StoredFile, blob: Optional[models.Blob], keywords: List[str]
+) -> ContentCreate:
+    """
+    Build the content to create for a published file
+    :param stored_file: the published file
+    :param blob: the blob of the file or None if the storage isn't content addressed
+    :param keywords: the normalized keywords
+    :return: the content schema
+    """
+    return ContentCreate(
+        filename=stored_file.filename,
+        filepath=blob.filepath if blob is not None else stored_file.filepath,
+        keywords=keywords,
+        width=stored_file.image.width,
+        height=stored_file.image.height,
+        frames=stored_file.image.frames,
+    )
+
+
+async def _iter_files_items(
+    files: List[UploadFile], keywords: List[str]
+) -> AsyncIterator[Tuple[str, str, UploadFile]]:
+    """
+    Iterate over the files of a multipart batch upload
+    :param files: the uploaded files
+    :param keywords: the keywords string of each file
+    :return: an async iterator of (file name, keywords string, file)
+    """
+    for file, file_keywords in zip(files, keywords):
+        yield file.filename, file_keywords, file
+
+
+async def _iter_archive_items(
+    archive: UploadFile, manifest: Dict[str, str]
+) -> AsyncIterator[Tuple[str, str, UploadFile]]:
+    """
+    Iterate over the files of an archive batch upload. The archive is read in the
+    threadpool, file by file.
+    :param archive: the uploaded zip or tar archive
+    :param manifest: the keywords string of each file, by path in the archive
+    :return: an async iterator of (file path, keywords string, file), the keywords
+    string is None if the file isn't in the manifest
+    """
+    archive_files = iter_archive_files(archive.file)
+    try:
+        while True:
+            try:
+                archive_file = await run_in_threadpool(next, archive_files, None)
+            except UnsupportedArchiveError as e:
+                _raise_bad_request(format(e))
+            except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+                _raise_bad_request(f"Corrupted archive. {e}")
+            if archive_file is None:
+                break
+            path, fileobj = archive_file
+            yield path, manifest.get(path), UploadFile(path, fileobj)
+    finally:
+        await run_in_threadpool(archive_files.close)
+
+
+def _get_upload_timestamp(filename: str) -> Optional[float]:
+    """
+    Get the upload time of a content from its timeflake filename
+    :param filename: the content filename
+    :return: the POSIX timestamp or None if the filename isn't a timeflake
+    """
+    try:
+        return timeflake.parse(from_base62=filename.split(".")[0]).timestamp / 1000
+    except (TypeError, ValueError):
+        return None
+
+
+def _schedule_renditions(renditions: RenditionService, stored_file: StoredFile) -> None:
+    """
+    Generate the renditions of an uploaded file in background
+    :param renditions: the rendition service
+    :param stored_file: the published file
+    """
+    renditions.schedule(
+        stored_file.filepath,
+        stored_file.mimetype,
+        stored_file.image.width,
+        stored_file.image.height,
+    )
+
+
+async def _get_rendition(
+    renditions: RenditionService, filepath: str, rendition: Rendition
+) -> str:
+    """
+    Get a rendition of a content file, generated if needed. The original file is
+    served if the image can't be rendered
+    :param renditions: the rendition service
+    :param filepath: the original file path
+    :param rendition: the selected rendition
+    :return: the rendition path, or the original file path
+    :raise FileNotFoundError: the original file doesn't exist
+    """
+    try:
+        return await renditions.get(filepath, rendition)
+    except FileNotFoundError:
+        raise
+    except Exception as e:
+        LOGGER.error(
+            "get_content. The rendition %s of %s couldn't be generated. %s",
+            rendition.name,
+            filepath,
+            e,
+        )
+        return filepath
+
+
+def _offload_response(
+    settings: Settings, filepath: str, mimetype: str, headers: Dict[str, str]
+) -> Response:
+    """
+    Create a response without body, the front proxy sends the file instead. It
+    also answers the range requests
+    :param settings: the settings object needed to get the file send mode
+    :param filepath: the file to send
+    :param mimetype: the file mime type
+    :param headers: the response headers
+    :return: the response
+    """
+    if settings.file_send_mode == "x-accel-redirect":
+        relative_path = os.path.relpath(filepath, settings.upload_directory)
+        location = settings.file_send_accel_location.rstrip("/")
+        headers["x-accel-redirect"] = f"{location}/{quote(relative_path)}"
+    else:
+        headers["x-sendfile"] = filepath
+    return Response(headers=headers, media_type=mimetype)
+
+
+async def _search_page(
+    keywords: List[str],
+    limit: int,
+    after: Optional[Tuple[int, int]],
+    keyword_index: Optional[KeywordIndexService],
+    db: Union[Session, AsyncSession],
+) -> List[repository.ContentMatch]:
+    """
+    Retrieve a page of contents matching the keywords, from the keyword index if
+    enabled or from the database.
+    :param keywords: the normalized keywords
+    :param limit: the page size
+    :param after: the keyset of the last content of the previous page
+    :param keyword_index: the keyword index service or None if disabled
+    :param db: the session database object, sync or async
+    :return: the ordered page of matched contents
+    """
+    if keyword_index is not None:
+        return keyword_index.search(keywords, limit, after)
+    return await repositories.call(
+        db,
+        repository.get_contents_by_keywords,
+        repository.get_contents_by_keywords_async,
+        keywords,
+        limit,
+        after,
+    )
+
+
+async def _stream_contents_by_keywords(
+    keywords: List[str],
+    after: Optional[Tuple[int, int]],
+    page_size: int,
+    keyword_index: Optional[KeywordIndexService],
+    db: Union[Session, AsyncSession],
+) -> AsyncIterator[str]:
+    """
+    Yield all the contents matching the keywords as JSON lines.
+    The contents are retrieved page by page so the memory stays bounded.
+    :param keywords: the normalized keywords
+    :param after: the keyset to start after or None to start from the beginning
+    :param page_size: the number of contents retrieved at once
+    :param keyword_index: the keyword index service or None if disabled
+    :param db: the session database object, sync or async
+    :return: an async iterator of JSON lines
+    """
+    while True:
+        matches = await _search_page(keywords, page_size, after, keyword_index, db)
+        for match in matches:
+            content = match.content
+            if not isinstance(content, ContentRead):
+                content = ContentRead.from_orm(content)
+            yield content.json() + "\n"
+        if len(matches) < page_size:
+            break
+        after = (matches[-1].matches, matches[-1].id)
+
+
+def _raise_bad_request(message: str) -> None:
+    """
+    Raise a HTTPException with a bad request status
+    :param message: the error message
+    """
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message)
+
+
+def _raise_too_many_items(max_items: int) -> None:
+    """
+    Raise a HTTPException with a request entity too large status
+    :param max_items: the maximum number of files of a batch upload
+    """
+    raise HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"A batch upload can't have more than {max_items} files",
+    )
+
+
 def _raise_content_not_found(filename: str) -> None:
     """
     Raise a HTTPException with a not found status and a message
@@ -0,0 +1,54 @@
+from typing import List, Optional, Union
+
+from fastapi import APIRouter, Depends, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import dependencies, repositories
+from app.config import Settings
+from app.repositories import keyword as repository
+from app.schemas.content import KeywordCompletion
+from app.services.keyword_completion import KeywordCompletionService
+from app.utils.keywords import normalize_keywords
+
+router = APIRouter()
+
+
+@router.get(
+    "/keywords",
+    tags=["keywords"],
+    description="Complete a keyword prefix, the keywords used by the most contents "
+    "first",
+    status_code=status.HTTP_200_OK,
+    response_model=List[KeywordCompletion],
+)
+async def complete_keywords(
+    prefix: str = Query(..., min_length=1, example="ca"),
+    limit: Optional[int] = Query(
+        None, ge=1, description="Number of keywords, capped to the maximum"
+    ),
+    settings: Settings = Depends(dependency=dependencies.get_settings),
+    keyword_completion: Optional[KeywordCompletionService] = Depends(
+        dependency=dependencies.get_keyword_completion_service
+    ),
+    db: Union[Session, AsyncSession] = Depends(
+        dependency=dependencies.get_read_session
+    ),
+):
+    prefix = next(normalize_keywords([prefix]))
+    if not prefix:
+        return []
+    max_results = settings.keyword_completion_max_results
+    limit = min(limit or max_results, max_results)
+
+    if keyword_completion is not None:
+        completions = keyword_completion.complete(prefix, limit)
+    else:
+        completions = await repositories.call(
+            db,
+            repository.get_keywords_by_prefix,
+            repository.get_keywords_by_prefix_async,
+            prefix,
+            limit,
+        )
+    return [KeywordCompletion(name=name, contents=usage) for name, usage in completions]
@@ -0,0 +1,31 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
+
+from app import dependencies
+from app.services import MetricsService
+
+# Version of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+router = APIRouter()
+
+
+@router.get(
+    "/metrics",
+    tags=["stats"],
+    description="Get the metrics in the Prometheus text format",
+    status_code=status.HTTP_200_OK,
+    response_class=PlainTextResponse,
+)
+async def get_metrics(
+    metrics: Optional[MetricsService] = Depends(
+        dependency=dependencies.get_metrics_service
+    ),
+):
+    if metrics is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="The metrics are disabled"
+        )
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
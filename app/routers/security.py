@@ -1,11 +1,13 @@
 from logging import getLogger
+from typing import Union
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app import dependencies, repositories, schemas
-from app.services import SecurityService
+from app.services import PasswordHashPoolFullError, SecurityService
 
 LOGGER = getLogger("fastapi")
 
@@ -21,13 +23,31 @@ router = APIRouter()
 )
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(dependency=dependencies.get_db),
+    db: Union[Session, AsyncSession] = Depends(
+        dependency=dependencies.get_read_session
+    ),
     security_service: SecurityService = Depends(
         dependency=dependencies.get_security_service
     ),
 ):
-    user = repositories.user.get_user(db, form_data.username)
-    if not user or not security_service.authenticate_user(user, form_data.password):
+    user = await repositories.call(
+        db,
+        repositories.user.get_user,
+        repositories.user.get_user_async,
+        form_data.username,
+    )
+    try:
+        authenticated = user is not None and (
+            await security_service.authenticate_user_async(user, form_data.password)
+        )
+    except PasswordHashPoolFullError:
+        LOGGER.warning("login_for_access_token. The password hash pool is full")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, retry later",
+            headers={"Retry-After": "1"},
+        )
+    if not authenticated:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
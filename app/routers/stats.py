@@ -0,0 +1,27 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from app import dependencies, schemas
+from app.services import ContentCacheService
+
+router = APIRouter()
+
+
+@router.get(
+    "/stats/content-cache",
+    tags=["stats"],
+    description="Get the statistics of the in-memory contents cache",
+    status_code=status.HTTP_200_OK,
+    response_model=schemas.CacheStats,
+)
+async def get_content_cache_stats(
+    content_cache: Optional[ContentCacheService] = Depends(
+        dependency=dependencies.get_content_cache_service
+    ),
+):
+    if content_cache is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="The cache is disabled"
+        )
+    return content_cache.stats()
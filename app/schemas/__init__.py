@@ -1,2 +1,4 @@
-from .content import Content, ContentCreate, ContentRead, Keyword, KeywordRead
+from .cache import CacheStats
+from .content import (Content, ContentBatchItem, ContentCreate, ContentRead,
+                      Keyword, KeywordCompletion, KeywordRead)
 from .security import Token
@@ -0,0 +1,10 @@
+from pydantic import BaseModel, Field
+
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: int
+    items: int = Field(..., description="Number of cached entries")
+    size: int = Field(..., description="Number of cached bytes")
+    max_size: int = Field(..., description="Maximum number of cached bytes")
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -12,6 +12,10 @@ class KeywordRead(_KeywordBase):
         orm_mode = True
 
 
+class KeywordCompletion(_KeywordBase):
+    contents: int = Field(..., example=12, description="Number of contents using it")
+
+
 class Keyword(_KeywordBase):
     id: str
     contents: List["ContentRead"] = []
@@ -23,6 +27,11 @@ class Keyword(_KeywordBase):
 class _ContentBase(BaseModel):
     filename: str = Field(..., example="02lag7ns7KtMWhCqcBdbjp.jpeg")
     keywords: List["str"] = Field([], example=["cat", "computer"])
+    width: Optional[int] = Field(None, example=640)
+    height: Optional[int] = Field(None, example=480)
+    frames: Optional[int] = Field(
+        None, example=1, description="Number of frames, more than 1 if animated"
+    )
 
 
 # Content patch doesn't inherit from _ContentBase because we wont update the file
@@ -41,6 +50,15 @@ class ContentRead(_ContentBase):
         orm_mode = True
 
 
+class ContentBatchItem(BaseModel):
+    name: str = Field(
+        ..., example="cat.jpeg", description="The file name in the request or archive"
+    )
+    status_code: int = Field(..., example=201)
+    content: Optional[ContentRead] = None
+    detail: Optional[str] = Field(None, description="The error, if not created")
+
+
 class Content(_ContentBase):
     id: int
     filepath: str
@@ -10,3 +10,5 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    # Expiration POSIX timestamp of the token
+    exp: Optional[float] = None
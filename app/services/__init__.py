@@ -1,2 +1,15 @@
+from .content_cache import ContentCacheService
+from .counter import AccessCounterService
+from .deletion import FileDeletionService
+from .descriptor_cache import FileDescriptorCacheService
 from .file import FileService
-from .security import JWTBearerService, SecurityService
+from .keyword_completion import KeywordCompletionService
+from .keyword_index import KeywordIndexService
+from .location_cache import ContentLocationCacheService
+from .metrics import MetricsService
+from .reconciliation import ReconciliationService
+from .rendition import Rendition, RenditionService
+from .security import (JWTBearerService, PasswordHashPoolFullError,
+                       SecurityService)
+from .trending import TrendingService
+from .trigram_index import TrigramIndexService
@@ -0,0 +1,108 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app import schemas
+from app.config import Settings
+
+
+class ContentCacheService:
+    """
+    In-process LRU cache of the contents files bodies, bounded by a total number of
+    bytes. The files never change but they can be removed: each worker has its own
+    cache, only the deletions made by the worker are seen at once, the others
+    expire with the entries.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+        Construct the cache service
+        :param settings: the settings object needed to get the cache budgets and
+        the entries TTL
+        """
+        self._ttl = settings.content_cache_ttl
+        self._max_bytes = settings.content_cache_max_bytes
+        self._max_item_bytes = min(
+            settings.content_cache_max_item_bytes, settings.content_cache_max_bytes
+        )
+        # filepath -> (body, expiration time)
+        self._bodies: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def accepts(self, size: int) -> bool:
+        """
+        Tell if a body of this size can be cached
+        :param size: the body size in bytes
+        :return: True if the body isn't larger than the per item limit
+        """
+        return size <= self._max_item_bytes
+
+    def get(self, filepath: str) -> Optional[bytes]:
+        """
+        Get a cached body and mark it as recently used
+        :param filepath: the content filepath
+        :return: the body or None if not cached
+        """
+        entry = self._bodies.get(filepath)
+        if entry is not None and entry[1] <= time.monotonic():
+            self.invalidate(filepath)
+            entry = None
+        if entry is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._bodies.move_to_end(filepath)
+        return entry[0]
+
+    def put(self, filepath: str, body: bytes) -> None:
+        """
+        Cache a body, the least recently used ones are evicted to fit the budget.
+        Do nothing if the body is too large.
+        :param filepath: the content filepath
+        :param body: the file body
+        """
+        if not self.accepts(len(body)):
+            return
+        self.invalidate(filepath)
+        while self._size + len(body) > self._max_bytes:
+            _, (evicted, _) = self._bodies.popitem(last=False)
+            self._size -= len(evicted)
+            self._evictions += 1
+        self._bodies[filepath] = (body, time.monotonic() + self._ttl)
+        self._size += len(body)
+
+    def invalidate(self, filepath: str) -> None:
+        """
+        Remove a body from the cache, do nothing if it isn't cached
+        :param filepath: the content filepath
+        """
+        entry = self._bodies.pop(filepath, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+    def invalidate_file(self, filepath: str) -> None:
+        """
+        Remove the bodies of a removed file and of its renditions
+        :param filepath: the content filepath
+        """
+        prefix = os.path.splitext(filepath)[0]
+        for cached_path in [p for p in self._bodies if p.startswith(prefix)]:
+            self.invalidate(cached_path)
+
+    def stats(self) -> schemas.CacheStats:
+        """
+        Get the cache statistics
+        :return: the statistics since the start
+        """
+        return schemas.CacheStats(
+            hits=self._hits,
+            misses=self._misses,
+            evictions=self._evictions,
+            items=len(self._bodies),
+            size=self._size,
+            max_size=self._max_bytes,
+        )
@@ -0,0 +1,151 @@
+import asyncio
+from logging import getLogger
+from typing import Callable, Dict, List, Optional, Union
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import Settings
+from app.repositories.content import (increment_contents_access,
+                                      increment_contents_access_async)
+from app.repositories.keyword import IN_CHUNK_SIZE
+from app.utils.iterables import chunks
+
+LOGGER = getLogger("fastapi")
+
+
+class AccessCounterService:
+    """
+    Service that buffers the contents access counters in memory
+    and writes them with bulk updates (write-behind).
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        session_factory: Callable[[], Union[Session, AsyncSession]],
+    ):
+        """
+        Construct the access counter service
+        :param settings: the settings object needed to get the flush interval and
+        threshold
+        :param session_factory: the factory of the sessions used to flush the counters
+        """
+        self._flush_interval = settings.access_counter_flush_interval
+        self._flush_threshold = settings.access_counter_flush_threshold
+        self._max_pending = settings.access_counter_max_pending
+        self._session_factory = session_factory
+        self._pending: Dict[int, int] = {}
+        # Accesses not counted since the last flush, the pending counters were full
+        self._dropped = 0
+        self._wake_up: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Number of contents waiting to be flushed"""
+        return len(self._pending)
+
+    def increment(self, content_id: int) -> None:
+        """
+        Increment the access counter of a content entity.
+        The increment is only written at the next flush.
+        :param content_id: The content entity id
+        """
+        self._add(content_id, 1)
+        if len(self._pending) >= self._flush_threshold and self._wake_up is not None:
+            self._wake_up.set()
+
+    def start(self) -> None:
+        """Start the periodic flush task in the running event loop"""
+        self._wake_up = asyncio.Event()
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic flush task and flush the remaining counters"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Write all the pending counters into the database.
+        On failure, the counters are kept for the next flush.
+        """
+        if self._dropped:
+            LOGGER.warning(
+                "AccessCounterService. %s accesses weren't counted, more than %s "
+                "counters were pending",
+                self._dropped,
+                self._max_pending,
+            )
+            self._dropped = 0
+        if not self._pending:
+            return
+        increments, self._pending = self._pending, {}
+        # One update and commit per group, the statement size is bounded and the
+        # groups written before a failure aren't written again
+        groups = [
+            dict(group) for group in chunks(list(increments.items()), IN_CHUNK_SIZE)
+        ]
+        flushed = 0
+
+        try:
+            db = self._session_factory()
+            if isinstance(db, AsyncSession):
+                async with db:
+                    for group in groups:
+                        await increment_contents_access_async(db, group)
+                        flushed += 1
+            else:
+                try:
+                    for group in groups:
+                        await run_in_threadpool(increment_contents_access, db, group)
+                        flushed += 1
+                finally:
+                    await run_in_threadpool(db.close)
+        except Exception as e:
+            LOGGER.error(
+                "AccessCounterService. %s counters couldn't be flushed. %s",
+                sum(len(group) for group in groups[flushed:]),
+                e,
+            )
+            self._restore(groups[flushed:])
+        except BaseException:
+            # Cancelled, the counters are flushed again by stop
+            self._restore(groups[flushed:])
+            raise
+
+    async def _run(self) -> None:
+        """Flush the counters every interval or when the threshold is reached"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wake_up.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake_up.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # The task must survive, or the counters would pile up
+                LOGGER.exception("AccessCounterService. The flush failed")
+
+    def _add(self, content_id: int, increment: int) -> None:
+        """Add to a pending counter, dropped once the maximum is reached"""
+        pending = self._pending.get(content_id)
+        if pending is None and len(self._pending) >= self._max_pending:
+            self._dropped += increment
+            return
+        self._pending[content_id] = (pending or 0) + increment
+
+    def _restore(self, groups: List[Dict[int, int]]) -> None:
+        """Keep the counters that couldn't be flushed for the next flush"""
+        for increments in groups:
+            for content_id, increment in increments.items():
+                self._add(content_id, increment)
@@ -0,0 +1,193 @@
+import asyncio
+import os
+from functools import partial
+from logging import getLogger
+from typing import Callable, List, Optional, Set, Tuple, Union
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import Settings
+from app.repositories.blob import purge_blob, purge_blob_async
+from app.repositories.deletion import (delete_pending_deletions,
+                                       delete_pending_deletions_async,
+                                       get_pending_deletions,
+                                       get_pending_deletions_async)
+from app.services.file import FileService
+
+LOGGER = getLogger("fastapi")
+
+# (number of processed deletions, id of the last one, True if there may be more)
+_BatchResult = Tuple[int, int, bool]
+
+
+class FileDeletionService:
+    """
+    Service that removes the files of the deleted contents in the background.
+    The removals are queued in the database by the contents deletions, so they
+    survive a restart, and are processed by batches: the directories left empty by
+    a batch are pruned once at its end.
+    The blobs are purged one by one, under the lock of their row.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        file_service: FileService,
+        session_factory: Callable[[], Union[Session, AsyncSession]],
+    ):
+        """
+        Construct the file deletion service
+        :param settings: the settings object needed to get the interval and the batch
+        size
+        :param file_service: the file service that removes the files
+        :param session_factory: the factory of the sessions used to read the queue
+        """
+        self._interval = settings.file_deletion_interval
+        self._batch_size = settings.file_deletion_batch_size
+        self._file_service = file_service
+        self._session_factory = session_factory
+        self._wake_up: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self) -> None:
+        """Process the queue without waiting for the interval, after a deletion"""
+        if self._wake_up is not None:
+            self._wake_up.set()
+
+    def start(self) -> None:
+        """Start the processing task in the running event loop"""
+        self._wake_up = asyncio.Event()
+        # The deletions queued before a restart are processed at once
+        self._wake_up.set()
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the processing task, the remaining deletions stay queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def process(self) -> int:
+        """
+        Process all the queued deletions.
+        A removal that fails is logged and kept in the queue, it is retried at the
+        next processing.
+        :return: the number of processed deletions
+        """
+        processed = 0
+        after_id = 0
+        more = True
+        while more:
+            try:
+                db = self._session_factory()
+                if isinstance(db, AsyncSession):
+                    async with db:
+                        done, after_id, more = await self._process_batch_async(
+                            db, after_id
+                        )
+                else:
+                    done, after_id, more = await run_in_threadpool(
+                        self._process_batch, db, after_id
+                    )
+            except SQLAlchemyError as e:
+                LOGGER.error("FileDeletionService. The queue couldn't be read. %s", e)
+                break
+            processed += done
+        return processed
+
+    async def _run(self) -> None:
+        """Process the queue every interval or when notified"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wake_up.wait(), self._interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake_up.clear()
+            await self.process()
+
+    def _process_batch(self, db: Session, after_id: int) -> _BatchResult:
+        try:
+            deletions = get_pending_deletions(db, after_id, self._batch_size)
+            if not deletions:
+                return 0, after_id, False
+            directories: Set[str] = set()
+            done = self._remove_files(deletions, directories)
+            remove_blob = partial(self._remove_blob, directories)
+            for deletion in deletions:
+                if deletion.blob_id is None:
+                    continue
+                try:
+                    purge_blob(db, deletion.blob_id, remove_blob)
+                except OSError as e:
+                    db.rollback()
+                    _log_failure(deletion, e)
+                    continue
+                done.append(deletion.id)
+            self._file_service.prune_directories(directories)
+            delete_pending_deletions(db, done)
+            return len(done), deletions[-1].id, len(deletions) == self._batch_size
+        finally:
+            db.close()
+
+    async def _process_batch_async(
+        self, db: AsyncSession, after_id: int
+    ) -> _BatchResult:
+        deletions = await get_pending_deletions_async(db, after_id, self._batch_size)
+        if not deletions:
+            return 0, after_id, False
+        directories: Set[str] = set()
+        done = await run_in_threadpool(self._remove_files, deletions, directories)
+        remove_blob = partial(run_in_threadpool, self._remove_blob, directories)
+        for deletion in deletions:
+            if deletion.blob_id is None:
+                continue
+            try:
+                await purge_blob_async(db, deletion.blob_id, remove_blob)
+            except OSError as e:
+                await db.rollback()
+                _log_failure(deletion, e)
+                continue
+            done.append(deletion.id)
+        await run_in_threadpool(self._file_service.prune_directories, directories)
+        await delete_pending_deletions_async(db, done)
+        return len(done), deletions[-1].id, len(deletions) == self._batch_size
+
+    def _remove_files(self, deletions: List[Row], directories: Set[str]) -> List[int]:
+        """
+        Remove the files of the deletions without blob
+        :param deletions: the queued deletions
+        :param directories: the set the directories of the removed files are added to
+        :return: the ids of the processed deletions
+        """
+        done = []
+        for deletion in deletions:
+            if deletion.blob_id is not None:
+                continue
+            try:
+                self._file_service.remove(deletion.filepath)
+            except OSError as e:
+                _log_failure(deletion, e)
+                continue
+            directories.add(os.path.dirname(deletion.filepath))
+            done.append(deletion.id)
+        return done
+
+    def _remove_blob(self, directories: Set[str], filepath: str) -> None:
+        self._file_service.remove(filepath)
+        directories.add(os.path.dirname(filepath))
+
+
+def _log_failure(deletion: Row, error: OSError) -> None:
+    LOGGER.error(
+        "FileDeletionService. The file of the deletion %s couldn't be removed. %s",
+        deletion.id,
+        error,
+    )
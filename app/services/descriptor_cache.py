@@ -0,0 +1,94 @@
+import os
+from collections import OrderedDict
+from typing import BinaryIO
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import Settings
+
+
+class FileDescriptor:
+    """An open content file, shared by the responses that send it"""
+
+    __slots__ = ("path", "file", "users", "evicted")
+
+    def __init__(self, path: str, file: BinaryIO):
+        self.path = path
+        self.file = file
+        # Number of responses using the file, it is closed once evicted and unused
+        self.users = 0
+        self.evicted = False
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+
+class FileDescriptorCacheService:
+    """
+    LRU cache of the open contents files, the hot files are sent without opening
+    them at each request. The files never change, the descriptors stay valid until
+    their file is removed.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+        Construct the cache service
+        :param settings: the settings object needed to get the cache size
+        """
+        self._size = settings.file_descriptor_cache_size
+        self._descriptors: "OrderedDict[str, FileDescriptor]" = OrderedDict()
+
+    async def acquire(self, path: str) -> FileDescriptor:
+        """
+        Get an open file, it must be given back with release
+        :param path: the file path
+        :return: the open file
+        :raise FileNotFoundError: the file doesn't exist
+        """
+        descriptor = self._descriptors.get(path)
+        if descriptor is not None and os.fstat(descriptor.fileno()).st_nlink == 0:
+            # Removed by another worker, the descriptor would keep the file alive
+            self._evict(path)
+            descriptor = None
+        if descriptor is None:
+            file = await run_in_threadpool(open, path, mode="rb", buffering=0)
+            # Opened by another response meanwhile
+            descriptor = self._descriptors.get(path)
+            if descriptor is None:
+                descriptor = self._descriptors[path] = FileDescriptor(path, file)
+            else:
+                file.close()
+            while len(self._descriptors) > self._size:
+                self._evict(next(iter(self._descriptors)))
+        self._descriptors.move_to_end(path)
+        descriptor.users += 1
+        return descriptor
+
+    def release(self, descriptor: FileDescriptor) -> None:
+        """
+        Give back a file got with acquire
+        :param descriptor: the open file
+        """
+        descriptor.users -= 1
+        if descriptor.evicted and descriptor.users == 0:
+            descriptor.file.close()
+
+    def invalidate(self, path: str) -> None:
+        """
+        Close a removed file and its renditions so their space is freed
+        :param path: the file path
+        """
+        prefix = os.path.splitext(path)[0]
+        for cached_path in [p for p in self._descriptors if p.startswith(prefix)]:
+            self._evict(cached_path)
+
+    def close(self) -> None:
+        """Close all the unused files"""
+        for path in list(self._descriptors):
+            self._evict(path)
+
+    def _evict(self, path: str) -> None:
+        descriptor = self._descriptors.pop(path)
+        descriptor.evicted = True
+        if descriptor.users == 0:
+            descriptor.file.close()
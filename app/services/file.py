@@ -1,63 +1,313 @@
+import glob
+import hashlib
 import mimetypes
 import os
-import shutil
-from typing import Tuple
+from contextlib import nullcontext
+from typing import (Collection, ContextManager, Iterable, Iterator, NamedTuple,
+                    Optional)
 
+import aiofiles
+import aiofiles.os
+import magic
 import timeflake
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 
 from app.config import Settings
+from app.services.metrics import MetricsService
+from app.utils.images import ImageInfo, ImageInfoParser, sniff_image_type
+
+# Number of bytes given to libmagic to find the mime type
+SNIFF_SIZE = 2048
+# Directory of the uploads in progress, in the upload directory so they can be
+# moved atomically
+STAGING_DIRECTORY = ".staging"
+# Separator between a file name and the name of its renditions
+RENDITION_SEPARATOR = "@"
+# The blobs are named by their hexdigest
+_HEX_DIGITS = frozenset("0123456789abcdef")
+
+
+class StoredFile(NamedTuple):
+    # Final place of the file, once published
+    filepath: str
+    filename: str
+    mimetype: str
+    # Hex sha256 digest of the file
+    checksum: str
+    staging_path: str
+    # Size and frames read from the image headers, unknown if they are invalid
+    image: ImageInfo
+
+
+class UnsupportedMediaTypeError(Exception):
+    """The uploaded file media type is not allowed"""
+
+    def __init__(self, mimetype: str):
+        super().__init__(f"The media type '{mimetype}' is not supported")
+        self.mimetype = mimetype
 
 
 class FileService:
     """Service that handle all saving aspect of content files"""
 
-    def __init__(self, settings: Settings):
+    def __init__(self, settings: Settings, metrics: Optional[MetricsService] = None):
         """
         Construct the file service
         :param settings: the settings object needed to get the upload_directory path
+        :param metrics: the metrics service timing the file operations, None if the
+        metrics are disabled
         """
+        self._metrics = metrics
         self._upload_directory = settings.upload_directory
+        self._staging_directory = os.path.join(
+            self._upload_directory, STAGING_DIRECTORY
+        )
+        self._chunk_size = settings.upload_chunk_size
+        self._content_addressed = settings.content_addressed_storage
 
-        # Check if the directory exists or create it
-        if not os.path.isdir(self._upload_directory):
-            os.makedirs(self._upload_directory)
+        # Check if the directories exist or create them
+        os.makedirs(self._staging_directory, exist_ok=True)
 
-    def push(self, file: UploadFile, mimetype: str = None) -> Tuple[str, str]:
+    @property
+    def content_addressed(self) -> bool:
+        """Tell if the files are stored once per content, named by their checksum"""
+        return self._content_addressed
+
+    async def push_async(
+        self, file: UploadFile, allowed_mimetypes: Collection[str]
+    ) -> StoredFile:
         """
-        Save an uploaded file into the file directory.
-        It will generate a random name and will handle all the saving things.
+        Stage an uploaded file without blocking the event loop.
+        The file is streamed by chunks into the staging directory, its checksum, its
+        mime type and its image size are computed in the same pass.
+        It must then be moved at its place with publish, or removed with discard.
         :param file: the file to save
-        :param mimetype: use the specified mimetype instead of the file.content_type mime type
-        :return: a tuple with the complete filepath (where the file is saved)
-        and the file name
+        :param allowed_mimetypes: the accepted mime types
+        :return: the staged file information
+        :raise UnsupportedMediaTypeError: the file mime type is not allowed, nothing
+        is saved
         """
-        # Create new file name
-        mimetype = mimetype or file.content_type
-        ext = mimetypes.guess_extension(mimetype)
-        name = timeflake.random().base62
-        filename = name + ext
+        with self._time("file_push"):
+            return await self._push_async(file, allowed_mimetypes)
 
-        # Generate filepath
-        # The first dir is a part of the timestamp
-        # The second is the last letter of the random part
-        dirs = os.path.join(self._upload_directory, filename[:5], name[-1])
-        os.makedirs(dirs, exist_ok=True)
-        filepath = os.path.join(dirs, filename)
+    async def _push_async(
+        self, file: UploadFile, allowed_mimetypes: Collection[str]
+    ) -> StoredFile:
+        name = timeflake.random().base62
+        staging_path = os.path.join(self._staging_directory, name + ".part")
+        checksum = hashlib.sha256()
+        mimetype = None
+        header = b""
+        image_parser = None
+        try:
+            async with aiofiles.open(staging_path, mode="wb") as fp:
+                while True:
+                    chunk = await file.read(self._chunk_size)
+                    if not chunk:
+                        break
+                    if mimetype is None:
+                        header += chunk
+                        if len(header) >= SNIFF_SIZE:
+                            mimetype = await self._sniff(header, allowed_mimetypes)
+                            image_parser = ImageInfoParser(mimetype)
+                            image_parser.feed(header)
+                    else:
+                        image_parser.feed(chunk)
+                    checksum.update(chunk)
+                    await fp.write(chunk)
 
-        with open(filepath, mode="wb") as fp:
-            shutil.copyfileobj(file.file, fp)
+            # The file is smaller than the sniff size
+            if mimetype is None:
+                mimetype = await self._sniff(header, allowed_mimetypes)
+                image_parser = ImageInfoParser(mimetype)
+                image_parser.feed(header)
+        except BaseException:
+            await run_in_threadpool(_remove_if_exists, staging_path)
+            raise
 
-        return filepath, filename
+        ext = mimetypes.guess_extension(mimetype)
+        digest = checksum.hexdigest()
+        if self._content_addressed:
+            # Two levels of the checksum, they can't collide with the timeflake ones
+            dirs = os.path.join(self._upload_directory, digest[:2], digest[2:4])
+            filepath = os.path.join(dirs, digest + ext)
+        else:
+            filepath = os.path.join(self._get_directory(name), name + ext)
 
-    def delete(self, filepath: str) -> None:
-        # remove file
-        os.remove(filepath)
+        return StoredFile(
+            filepath, name + ext, mimetype, digest, staging_path, image_parser.info
+        )
 
-        # Try to remove parent directories if their are empty
-        parent_path = os.path.split(filepath)[0]
-        while (
-            len(os.listdir(parent_path)) == 0 and parent_path != self._upload_directory
+    async def publish(self, stored_file: StoredFile) -> None:
+        """
+        Move a staged file at its place. The rename is atomic.
+        With the content addressed storage, the blob reference must be acquired first
+        so the blob can't be purged meanwhile.
+        :param stored_file: the staged file
+        """
+        if self._content_addressed and await run_in_threadpool(
+            os.path.exists, stored_file.filepath
         ):
-            os.rmdir(parent_path)
-            parent_path = os.path.split(parent_path)[0]
+            # Duplicate of an existing blob
+            await self.discard(stored_file)
+            return
+        dirs = os.path.dirname(stored_file.filepath)
+        await run_in_threadpool(os.makedirs, dirs, exist_ok=True)
+        try:
+            await aiofiles.os.rename(stored_file.staging_path, stored_file.filepath)
+        except FileNotFoundError:
+            # The directory has been pruned by a deletion in the meantime
+            await run_in_threadpool(os.makedirs, dirs, exist_ok=True)
+            await aiofiles.os.rename(stored_file.staging_path, stored_file.filepath)
+
+    async def discard(self, stored_file: StoredFile) -> None:
+        """
+        Remove a staged file if it hasn't been published.
+        :param stored_file: the staged file
+        """
+        await run_in_threadpool(_remove_if_exists, stored_file.staging_path)
+
+    async def _sniff(self, header: bytes, allowed_mimetypes: Collection[str]) -> str:
+        """
+        Find the mime type of a file from its first bytes.
+        The supported images are recognized by their signature, libmagic is only
+        used for the other files.
+        :param header: the first bytes of the file
+        :param allowed_mimetypes: the accepted mime types
+        :return: the mime type
+        :raise UnsupportedMediaTypeError: the mime type is not allowed
+        """
+        with self._time("mime_sniff"):
+            mimetype = sniff_image_type(header)
+            if mimetype is None or mimetype not in allowed_mimetypes:
+                mimetype = await run_in_threadpool(
+                    magic.from_buffer, header[:SNIFF_SIZE], mime=True
+                )
+        if mimetype not in allowed_mimetypes:
+            raise UnsupportedMediaTypeError(mimetype)
+        return mimetype
+
+    def _time(self, operation: str) -> ContextManager:
+        """
+        Measure an operation if the metrics are enabled
+        :param operation: the operation name
+        :return: the context manager that measures the operation
+        """
+        if self._metrics is None:
+            return nullcontext()
+        return self._metrics.time(operation)
+
+    @staticmethod
+    def get_rendition_path(filepath: str, name: str, ext: Optional[str] = None) -> str:
+        """
+        Get the path of a rendition of a file, next to the file so it is removed
+        with it
+        :param filepath: the file path
+        :param name: the rendition name
+        :param ext: the rendition extension, the file one if None
+        :return: the rendition path
+        """
+        stem, file_ext = os.path.splitext(filepath)
+        return f"{stem}{RENDITION_SEPARATOR}{name}{file_ext if ext is None else ext}"
+
+    def _get_directory(self, name: str) -> str:
+        """
+        Get the directory of a file
+        The first dir is a part of the timestamp
+        The second is the last letter of the random part
+        :param name: the file name without the extension
+        :return: the directory path
+        """
+        return os.path.join(self._upload_directory, name[:5], name[-1])
+
+    @staticmethod
+    def get_blob_checksum(filepath: str) -> Optional[str]:
+        """
+        Get the checksum of a blob file from its name
+        :param filepath: the file path
+        :return: the hex sha256 digest, None if it isn't a blob file
+        """
+        stem = os.path.splitext(os.path.basename(filepath))[0]
+        if len(stem) == 64 and all(c in _HEX_DIGITS for c in stem):
+            return stem
+        return None
+
+    def remove(self, filepath: str) -> None:
+        """
+        Remove a content file and its renditions, a missing file is ignored.
+        Their directories are left, see prune_directories.
+        :param filepath: the file to remove
+        :raise OSError: the file couldn't be removed
+        """
+        with self._time("file_delete"):
+            _remove_if_exists(filepath)
+            stem = os.path.splitext(filepath)[0]
+            for rendition_path in glob.iglob(
+                glob.escape(stem) + RENDITION_SEPARATOR + "*"
+            ):
+                _remove_if_exists(rendition_path)
+
+    def prune_directories(self, directories: Iterable[str]) -> None:
+        """
+        Remove the empty directories and then their empty parents, up to the upload
+        directory. The deepest are tried first so each directory is tried once.
+        :param directories: the directories of the removed files
+        """
+        prefix = os.path.join(self._upload_directory, "")
+        pending = {
+            directory for directory in directories if directory.startswith(prefix)
+        }
+        while pending:
+            depth = max(directory.count(os.sep) for directory in pending)
+            deepest = {d for d in pending if d.count(os.sep) == depth}
+            pending -= deepest
+            for directory in deepest:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    # Not empty, or already removed
+                    continue
+                parent = os.path.dirname(directory)
+                if parent.startswith(prefix):
+                    pending.add(parent)
+
+    def scan(self) -> Iterator[os.DirEntry]:
+        """
+        Walk the upload directory without loading it whole, only one directory
+        listing per level is held.
+        The hidden entries (the staging directory, the snapshots) and the renditions
+        of an existing file are skipped.
+        :return: an iterator of the files entries ordered by path, compared as the
+        Python strings
+        """
+        return self._scan(self._upload_directory)
+
+    def _scan(self, directory: str) -> Iterator[os.DirEntry]:
+        with os.scandir(directory) as iterator:
+            entries = [entry for entry in iterator if not entry.name.startswith(".")]
+        # The paths of a directory all start with its name and a separator
+        entries.sort(
+            key=lambda e: e.name + os.sep if e.is_dir(follow_symlinks=False) else e.name
+        )
+        stems = {
+            os.path.splitext(entry.name)[0]
+            for entry in entries
+            if RENDITION_SEPARATOR not in entry.name
+        }
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from self._scan(entry.path)
+            elif (
+                RENDITION_SEPARATOR not in entry.name
+                or entry.name.split(RENDITION_SEPARATOR)[0] not in stems
+            ):
+                # Without its file, a rendition is an orphan too
+                yield entry
+
+
+def _remove_if_exists(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
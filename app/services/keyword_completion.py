@@ -0,0 +1,108 @@
+import heapq
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+from app.config import Settings
+
+# Above this number of keywords starting with a prefix, its completions are cached
+SCAN_SIZE = 256
+PREFIX_CACHE_SIZE = 10_000
+# Greater than any character of a keyword, ends the range of a prefix
+_LAST_CHARACTER = "\U0010ffff"
+
+# (keyword name, number of contents)
+Completion = Tuple[str, int]
+
+
+class KeywordCompletionService:
+    """
+    In-process sorted array of the normalized keywords names with their usage, the
+    number of contents that have them. The keywords starting with a prefix are a
+    range of the array, found by bisection.
+    The usages must be updated by every route that changes the contents keywords.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+        Construct an empty completion index, it is filled by build
+        :param settings: the settings object needed to get the maximum number of
+        completions
+        """
+        self._max_results = settings.keyword_completion_max_results
+        self._names: List[str] = []
+        self._usages: Dict[str, int] = {}
+        # The completions of the prefixes with many keywords
+        self._cache: "OrderedDict[str, List[Completion]]" = OrderedDict()
+
+    def build(self, rows: Iterable[Completion]) -> None:
+        """
+        Replace the index content.
+        :param rows: (keyword name, number of contents) rows
+        """
+        self._usages = dict(rows)
+        self._names = sorted(self._usages)
+        self._cache.clear()
+
+    def complete(self, prefix: str, limit: int) -> List[Completion]:
+        """
+        Get the keywords starting with a prefix, the most used first
+        :param prefix: the normalized prefix
+        :param limit: the maximum number of keywords, capped to the maximum number of
+        completions
+        :return: the (keyword name, number of contents) completions
+        """
+        limit = min(limit, self._max_results)
+        cached = self._cache.get(prefix)
+        if cached is not None:
+            self._cache.move_to_end(prefix)
+            return cached[:limit]
+
+        start = bisect_left(self._names, prefix)
+        end = bisect_left(self._names, prefix + _LAST_CHARACTER, start)
+        if end - start <= SCAN_SIZE:
+            return self._rank(start, end, limit)
+        completions = self._rank(start, end, self._max_results)
+        self._cache[prefix] = completions
+        if len(self._cache) > PREFIX_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return completions[:limit]
+
+    def add_keywords(self, names: Iterable[str]) -> None:
+        """
+        Count a new use of keywords, by a created or updated content
+        :param names: the normalized keywords names
+        """
+        for name in names:
+            usage = self._usages.get(name)
+            if usage is None:
+                insort(self._names, name)
+                usage = 0
+            self._usages[name] = usage + 1
+            self._invalidate(name)
+
+    def remove_keywords(self, names: Iterable[str]) -> None:
+        """
+        Remove a use of keywords, by a deleted or updated content. The unused
+        keywords are still completed, like the database the keywords are never
+        removed.
+        :param names: the normalized keywords names
+        """
+        for name in names:
+            usage = self._usages.get(name)
+            if usage:
+                self._usages[name] = usage - 1
+                self._invalidate(name)
+
+    def _rank(self, start: int, end: int, limit: int) -> List[Completion]:
+        names = self._names[start:end]
+        usages = self._usages
+        ranking = heapq.nsmallest(limit, names, key=lambda name: (-usages[name], name))
+        return [(name, usages[name]) for name in ranking]
+
+    def _invalidate(self, name: str) -> None:
+        """Forget the cached completions of the prefixes of a keyword"""
+        if not self._cache:
+            return
+        for length in range(1, len(name) + 1):
+            self._cache.pop(name[:length], None)
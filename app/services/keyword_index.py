@@ -0,0 +1,124 @@
+import heapq
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app import models, schemas
+from app.repositories.content import ContentMatch
+
+
+class _IndexedContent(NamedTuple):
+    filename: str
+    keywords: Tuple[str, ...]
+    width: Optional[int]
+    height: Optional[int]
+    frames: Optional[int]
+
+
+class KeywordIndexService:
+    """
+    In-process inverted index from a normalized keyword to the sorted ids of the
+    contents that have it.
+    It holds what is needed to answer a search without the database, so it must be
+    updated by every route that changes the contents keywords.
+    """
+
+    def __init__(self):
+        """Construct an empty index, it is filled by build and index_content"""
+        self._postings: Dict[str, array] = {}
+        self._contents: Dict[int, _IndexedContent] = {}
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    def build(self, rows: Iterable[Tuple]) -> None:
+        """
+        Replace the index content.
+        :param rows: (content id, content filename, width, height, frames, keyword
+        name) rows, ordered by content id
+        """
+        postings: Dict[str, List[int]] = {}
+        contents: Dict[int, Tuple[Tuple, List[str]]] = {}
+        for content_id, *content, keyword in rows:
+            contents.setdefault(content_id, (content, []))[1].append(keyword)
+            postings.setdefault(keyword, []).append(content_id)
+
+        # Sort once at the end instead of inserting each id at its place
+        self._postings = {
+            keyword: array("q", sorted(ids)) for keyword, ids in postings.items()
+        }
+        self._contents = {
+            content_id: _IndexedContent(filename, tuple(keywords), *image)
+            for content_id, ((filename, *image), keywords) in contents.items()
+        }
+
+    def index_content(self, content: models.Content) -> None:
+        """
+        Add a content to the index or replace its keywords if it is already indexed.
+        :param content: the content entity with its keywords
+        """
+        self.remove_content(content.id)
+        keywords = tuple(dict.fromkeys(keyword.name for keyword in content.keywords))
+        self._contents[content.id] = _IndexedContent(
+            content.filename, keywords, content.width, content.height, content.frames
+        )
+        for keyword in keywords:
+            insort(self._postings.setdefault(keyword, array("q")), content.id)
+
+    def remove_content(self, content_id: int) -> None:
+        """
+        Remove a content from the index. Do nothing if it isn't indexed.
+        :param content_id: the content entity id
+        """
+        indexed = self._contents.pop(content_id, None)
+        if indexed is None:
+            return
+        for keyword in indexed.keywords:
+            ids = self._postings[keyword]
+            i = bisect_left(ids, content_id)
+            if i < len(ids) and ids[i] == content_id:
+                del ids[i]
+            if len(ids) == 0:
+                del self._postings[keyword]
+
+    def search(
+        self,
+        keywords: Iterable[str],
+        limit: Optional[int] = None,
+        after: Optional[Tuple[int, int]] = None,
+    ) -> List[ContentMatch]:
+        """
+        Retrieves the contents that match at least one keyword.
+        The list is ordered by the number of matched keywords, then by id.
+        :param keywords: the normalized keywords
+        :param limit: the maximum number of contents to retrieve, no limit if None
+        :param after: the (matches, id) keyset of the last content of the previous
+        page
+        :return: the ordered list of matched contents
+        """
+        matches: Dict[int, int] = {}
+        for keyword in dict.fromkeys(keywords):
+            for content_id in self._postings.get(keyword, ()):
+                matches[content_id] = matches.get(content_id, 0) + 1
+
+        # Rank on (-matches, id) to get the same order as the database
+        ranking = ((-count, content_id) for content_id, count in matches.items())
+        if after is not None:
+            after_key = (-after[0], after[1])
+            ranking = (key for key in ranking if key > after_key)
+        ranking = sorted(ranking) if limit is None else heapq.nsmallest(limit, ranking)
+
+        return [
+            ContentMatch(self._read(content_id), content_id, -count)
+            for count, content_id in ranking
+        ]
+
+    def _read(self, content_id: int) -> schemas.ContentRead:
+        indexed = self._contents[content_id]
+        return schemas.ContentRead(
+            filename=indexed.filename,
+            keywords=[schemas.KeywordRead(name=name) for name in indexed.keywords],
+            width=indexed.width,
+            height=indexed.height,
+            frames=indexed.frames,
+        )
@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.config import Settings
+from app.repositories.content import ContentLocation
+
+# (location or None if the content doesn't exist, expiration time)
+_Entry = Tuple[Optional[ContentLocation], float]
+
+
+class ContentLocationCacheService:
+    """
+    In-process LRU cache of the contents locations by filename.
+    The filenames are never reused so a location is valid until the content deletion.
+    Each worker has its own cache, only the deletions made by the worker are seen
+    at once, the others expire with the entries. The unknown filenames are cached
+    too, for a shorter time.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+        Construct the cache service
+        :param settings: the settings object needed to get the cache size and the
+        entries TTL
+        """
+        self._max_size = settings.content_location_cache_size
+        self._ttl = settings.content_location_cache_ttl
+        self._negative_ttl = settings.content_location_cache_negative_ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    def get(self, filename: str) -> Tuple[bool, Optional[ContentLocation]]:
+        """
+        Get the cached location of a content
+        :param filename: the content filename
+        :return: a (cached, location) tuple. The location is None if the content is
+        known to not exist
+        """
+        entry = self._entries.get(filename)
+        if entry is None:
+            return False, None
+        location, expiration = entry
+        if expiration <= time.monotonic():
+            del self._entries[filename]
+            return False, None
+        self._entries.move_to_end(filename)
+        return True, location
+
+    def put(self, filename: str, location: Optional[ContentLocation]) -> None:
+        """
+        Cache the location of a content
+        :param filename: the content filename
+        :param location: the content location or None if it doesn't exist
+        """
+        ttl = self._ttl if location is not None else self._negative_ttl
+        expiration = time.monotonic() + ttl
+        self._entries[filename] = (location, expiration)
+        self._entries.move_to_end(filename)
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, filename: str) -> None:
+        """
+        Remove a content location from the cache, do nothing if it isn't cached
+        :param filename: the content filename
+        """
+        self._entries.pop(filename, None)
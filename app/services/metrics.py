@@ -0,0 +1,250 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Prometheus default buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+# Route label of the statements executed outside of a request, e.g. a flush
+BACKGROUND_ROUTE = "background"
+
+Labels = Tuple[str, ...]
+
+
+class _Histogram:
+    def __init__(self, name: str, help_: str, labels: Labels, buckets: Tuple):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self.buckets = buckets
+        # labels values -> counts of each bucket and +Inf, then the sum
+        self.values: Dict[Labels, List[float]] = {}
+
+    def observe(self, values: Labels, amount: float) -> None:
+        series = self.values.get(values)
+        if series is None:
+            series = self.values[values] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, amount)] += 1
+        series[-1] += amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for values, series in self.values.items():
+            labels = _format_labels(self.labels, values)
+            count = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), series):
+                count += bucket_count
+                le = _format_labels(self.labels + ("le",), values + (str(bound),))
+                yield f"{self.name}_bucket{le} {count}"
+            yield f"{self.name}_sum{labels} {series[-1]}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class _Counter:
+    def __init__(self, name: str, help_: str, labels: Labels):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, values: Labels, amount: float = 1) -> None:
+        self.values[values] = self.values.get(values, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for values, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, values)} {value}"
+
+
+class RequestMetrics:
+    """The measures of a request in progress, shared with the threadpool"""
+
+    __slots__ = ("statements_durations", "token")
+
+    def __init__(self):
+        self.statements_durations: List[float] = []
+        self.token: Optional[contextvars.Token] = None
+
+
+# The request being served by the current task, None outside of a request
+_current_request: "contextvars.ContextVar[Optional[RequestMetrics]]" = (
+    contextvars.ContextVar("current_request", default=None)
+)
+
+
+class MetricsService:
+    """
+    Service that collects the requests, database and file operations metrics and
+    renders them in the Prometheus text format.
+    It is only created when enabled, the instrumented code checks for None.
+    """
+
+    def __init__(self):
+        """Construct the metrics service, without any measure"""
+        # The measures come from the event loop and the threadpool
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._requests = _Counter(
+            "fmds_http_requests_total",
+            "Number of HTTP requests",
+            ("route", "method", "status"),
+        )
+        self._requests_duration = _Histogram(
+            "fmds_http_request_duration_seconds",
+            "Duration of the HTTP requests",
+            ("route", "method"),
+            DEFAULT_BUCKETS,
+        )
+        self._statements = _Counter(
+            "fmds_db_statements_total",
+            "Number of SQL statements executed, by route",
+            ("route",),
+        )
+        self._statements_duration = _Histogram(
+            "fmds_db_statement_duration_seconds",
+            "Duration of the SQL statements, by route",
+            ("route",),
+            STATEMENT_BUCKETS,
+        )
+        self._operations_duration = _Histogram(
+            "fmds_operation_duration_seconds",
+            "Duration of the instrumented operations (file push, deletion, "
+            "mime type sniff, rendition)",
+            ("operation",),
+            DEFAULT_BUCKETS,
+        )
+
+    def add_gauge(self, name: str, help_: str, read: Callable[[], float]) -> None:
+        """
+        Add a gauge read at each rendering
+        :param name: the metric name
+        :param help_: the metric description
+        :param read: the function that returns the current value
+        """
+        self._gauges[name] = (help_, read)
+
+    def start_request(self) -> RequestMetrics:
+        """
+        Start measuring a request, its statements are attributed to it
+        :return: the request measures, to give to finish_request
+        """
+        request = RequestMetrics()
+        request.token = _current_request.set(request)
+        with self._lock:
+            self._in_flight += 1
+        return request
+
+    def finish_request(
+        self,
+        request: RequestMetrics,
+        route: str,
+        method: str,
+        status_code: int,
+        duration: float,
+    ) -> None:
+        """
+        Record a served request
+        :param request: the request measures given by start_request
+        :param route: the route name
+        :param method: the HTTP method
+        :param status_code: the response status code
+        :param duration: the request duration in seconds
+        """
+        _current_request.reset(request.token)
+        with self._lock:
+            self._in_flight -= 1
+            self._requests.inc((route, method, str(status_code)))
+            self._requests_duration.observe((route, method), duration)
+            # The statements are attributed once the route is known
+            self._statements.inc((route,), len(request.statements_durations))
+            for statement_duration in request.statements_durations:
+                self._statements_duration.observe((route,), statement_duration)
+
+    def observe_statement(self, duration: float) -> None:
+        """
+        Record an executed statement, for the current request if any
+        :param duration: the statement duration in seconds
+        """
+        request = _current_request.get()
+        if request is not None:
+            request.statements_durations.append(duration)
+            return
+        with self._lock:
+            self._statements.inc((BACKGROUND_ROUTE,))
+            self._statements_duration.observe((BACKGROUND_ROUTE,), duration)
+
+    @contextmanager
+    def time(self, operation: str) -> Iterator[None]:
+        """
+        Measure the duration of an operation
+        :param operation: the operation name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self._operations_duration.observe((operation,), duration)
+
+    def instrument_engine(self, engine: Engine) -> None:
+        """
+        Measure the statements executed by an engine
+        :param engine: the engine, the sync_engine of an async one
+        """
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _after_cursor_execute(self, conn, cursor, statement, *_) -> None:
+        start = conn.info.pop(_STATEMENT_START, None)
+        if start is not None:
+            self.observe_statement(time.perf_counter() - start)
+
+    def render(self) -> str:
+        """
+        Render all the metrics
+        :return: the metrics in the Prometheus text format
+        """
+        lines = [
+            "# HELP fmds_http_requests_in_flight Number of HTTP requests in progress",
+            "# TYPE fmds_http_requests_in_flight gauge",
+            f"fmds_http_requests_in_flight {self._in_flight}",
+        ]
+        for name, (help_, read) in self._gauges.items():
+            lines += [f"# HELP {name} {help_}", f"# TYPE {name} gauge"]
+            lines.append(f"{name} {read()}")
+        with self._lock:
+            for metric in (
+                self._requests,
+                self._requests_duration,
+                self._statements,
+                self._statements_duration,
+                self._operations_duration,
+            ):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+_STATEMENT_START = "metrics_statement_start"
+
+
+def _before_cursor_execute(conn, *_) -> None:
+    conn.info[_STATEMENT_START] = time.perf_counter()
+
+
+def _format_labels(names: Labels, values: Labels) -> str:
+    pairs = (f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,118 @@
+import os
+import time
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from app.config import Settings
+from app.repositories.blob import get_or_create_tombstone
+from app.repositories.content import (delete_content, get_content_by_filename,
+                                      get_contents_files)
+from app.repositories.deletion import queue_deletion
+from app.services.file import FileService
+
+# A file without content, left by a failed removal or a crash
+ORPHAN_FILE = "orphan_file"
+# A content whose file is missing
+DANGLING_CONTENT = "dangling_content"
+
+
+class Mismatch(NamedTuple):
+    # ORPHAN_FILE or DANGLING_CONTENT
+    kind: str
+    filepath: str
+    # The filename of a dangling content
+    filename: Optional[str] = None
+
+
+class ReconciliationService:
+    """
+    Service that compares the upload directory with the contents table.
+    Both are streamed in the same order, the paths compared as the Python strings,
+    and merged, so the memory use doesn't grow with the number of files.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        file_service: FileService,
+        session_factory: Callable[[], Session],
+    ):
+        """
+        Construct the reconciliation service
+        :param settings: the settings object needed to get the grace period and the
+        chunk size
+        :param file_service: the file service that walks the upload directory
+        :param session_factory: the factory of the sync sessions, on the primary
+        database so the recent contents are seen
+        """
+        self._grace_period = settings.reconciliation_grace_period
+        self._chunk_size = settings.reconciliation_chunk_size
+        self._file_service = file_service
+        self._session_factory = session_factory
+
+    def scan(self) -> Iterator[Mismatch]:
+        """
+        Find the orphan files and the dangling contents.
+        The files younger than the grace period are skipped, their content may not
+        be committed yet.
+        :return: an iterator of the mismatches, ordered by path
+        """
+        deadline = time.time() - self._grace_period
+        with self._session_factory() as db:
+            files = self._file_service.scan()
+            rows = get_contents_files(db, self._chunk_size)
+            file = next(files, None)
+            row = next(rows, None)
+            while file is not None or row is not None:
+                if row is None or (file is not None and file.path < row[0]):
+                    if file.stat(follow_symlinks=False).st_mtime < deadline:
+                        yield Mismatch(ORPHAN_FILE, file.path)
+                    file = next(files, None)
+                elif file is None or row[0] < file.path:
+                    # The file may be outside of the upload directory, or removed
+                    # with its content since the row has been read
+                    if not os.path.exists(row[0]):
+                        yield Mismatch(DANGLING_CONTENT, row[0], row[2])
+                    row = next(rows, None)
+                else:
+                    # The contents of a blob share its file
+                    filepath = row[0]
+                    while row is not None and row[0] == filepath:
+                        row = next(rows, None)
+                    file = next(files, None)
+
+    def clean(self, mismatches: Iterable[Mismatch]) -> Iterator[Mismatch]:
+        """
+        Fix the mismatches as they come: the removal of the orphan files is queued,
+        it is done by the FileDeletionService, and the dangling contents are deleted.
+        An orphan blob file gets a tombstone blob so an upload of the same content
+        can't race with its removal.
+        The mismatches must be read once the scan is over: its read cursor stays open
+        until then and SQLite can't commit meanwhile.
+        :param mismatches: the mismatches found by scan
+        :return: an iterator of the fixed mismatches
+        """
+        with self._session_factory() as db:
+            queued = 0
+            for mismatch in mismatches:
+                if mismatch.kind == ORPHAN_FILE:
+                    checksum = FileService.get_blob_checksum(mismatch.filepath)
+                    if checksum is None:
+                        queue_deletion(db, filepath=mismatch.filepath)
+                    else:
+                        blob_id = get_or_create_tombstone(
+                            db, checksum, mismatch.filepath
+                        )
+                        queue_deletion(db, blob_id=blob_id)
+                    queued += 1
+                    if queued % self._chunk_size == 0:
+                        db.commit()
+                else:
+                    content = get_content_by_filename(db, mismatch.filename)
+                    if content is None or content.filepath != mismatch.filepath:
+                        continue
+                    # Commits the queued removals too
+                    delete_content(db, content)
+                yield mismatch
+            db.commit()
@@ -0,0 +1,207 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from logging import getLogger
+from typing import ContextManager, Dict, NamedTuple, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import Settings
+from app.services.file import FileService
+from app.services.metrics import MetricsService
+from app.utils import renditions
+from app.utils.renditions import FORMATS, STILL_MIMETYPE
+
+LOGGER = getLogger("fastapi")
+
+
+class Rendition(NamedTuple):
+    # Maximum width and height, None to keep the original size
+    size: Optional[int]
+    # Only the first frame
+    still: bool
+    mimetype: str
+
+    @property
+    def name(self) -> str:
+        """The rendition name, unique for a file"""
+        if not self.still:
+            return str(self.size)
+        return "still" if self.size is None else f"{self.size}-still"
+
+
+class RenditionService:
+    """
+    Service that generates the renditions of the contents images, in a process pool
+    so neither the event loop nor the threadpool are blocked by Pillow.
+    The renditions are files next to the original, written once and removed with it.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        file_service: FileService,
+        metrics: Optional[MetricsService] = None,
+    ):
+        """
+        Construct the rendition service, the worker processes are started on the
+        first rendering
+        :param settings: the settings object needed to get the renditions sizes
+        :param file_service: the file service that knows where the renditions are
+        :param metrics: the metrics service timing the renderings, None if the
+        metrics are disabled
+        """
+        if renditions.Image is None:
+            raise RuntimeError("Pillow is needed by the renditions")
+        self._file_service = file_service
+        self._metrics = metrics
+        self._sizes = sorted(settings.rendition_sizes)
+        self._gif_still = settings.rendition_gif_still
+        self._max_pending = settings.rendition_max_pending
+        # Forking a process with threads running isn't safe
+        self._executor = ProcessPoolExecutor(
+            max_workers=settings.rendition_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        # Renderings in progress by rendition path, a rendition is rendered once
+        self._renders: Dict[str, asyncio.Future] = {}
+        # Renderings started after an upload, nobody waits for them
+        self._tasks: Set[asyncio.Task] = set()
+
+    def select(
+        self,
+        mimetype: Optional[str],
+        width: Optional[int],
+        height: Optional[int],
+        size: Optional[int],
+        still: bool = False,
+    ) -> Optional[Rendition]:
+        """
+        Select the rendition closest to a requested size: the smallest one at least
+        as large. The images are never enlarged.
+        :param mimetype: the original mime type
+        :param width: the original width, None if unknown
+        :param height: the original height, None if unknown
+        :param size: the requested maximum width and height, None for the original
+        size
+        :param still: the first frame is requested, only for the GIFs
+        :return: the rendition or None if the original must be served
+        """
+        if mimetype not in FORMATS:
+            return None
+        still = still and mimetype == "image/gif"
+        if size is not None:
+            size = next((s for s in self._sizes if s >= size), None)
+        if size is not None and width is not None and height is not None:
+            if size >= max(width, height):
+                size = None
+        if size is None and not still:
+            return None
+        return Rendition(size, still, STILL_MIMETYPE if still else mimetype)
+
+    def get_path(self, filepath: str, rendition: Rendition) -> str:
+        """
+        Get the path of a rendition, it may not be generated yet
+        :param filepath: the original file path
+        :param rendition: the rendition
+        :return: the rendition path
+        """
+        ext = ".png" if rendition.still else None
+        return self._file_service.get_rendition_path(filepath, rendition.name, ext)
+
+    async def get(self, filepath: str, rendition: Rendition) -> str:
+        """
+        Get a rendition, it is generated if it doesn't exist yet
+        :param filepath: the original file path
+        :param rendition: the rendition
+        :return: the rendition path
+        :raise FileNotFoundError: the original file doesn't exist
+        :raise OSError: the image can't be decoded
+        """
+        if not await self._ensure(filepath, rendition):
+            raise FileNotFoundError(filepath)
+        return self.get_path(filepath, rendition)
+
+    def schedule(
+        self,
+        filepath: str,
+        mimetype: str,
+        width: Optional[int],
+        height: Optional[int],
+    ) -> None:
+        """
+        Generate the renditions of a new file in background. When too many
+        renderings are pending, they are left to the requests
+        :param filepath: the original file path
+        :param mimetype: the original mime type
+        :param width: the original width, None if unknown
+        :param height: the original height, None if unknown
+        """
+        selected = {self.select(mimetype, width, height, size) for size in self._sizes}
+        if self._gif_still:
+            selected.add(self.select(mimetype, width, height, None, still=True))
+        selected.discard(None)
+        for rendition in selected:
+            if len(self._renders) >= self._max_pending:
+                return
+            task = asyncio.ensure_future(self._prerender(filepath, rendition))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def stop(self) -> None:
+        """Cancel the pending renderings and stop the worker processes"""
+        for future in [*self._tasks, *self._renders.values()]:
+            future.cancel()
+        await run_in_threadpool(self._executor.shutdown, wait=True)
+
+    async def _prerender(self, filepath: str, rendition: Rendition) -> None:
+        try:
+            await self._ensure(filepath, rendition)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOGGER.error(
+                "rendition. The rendition %s of %s couldn't be generated. %s",
+                rendition.name,
+                filepath,
+                e,
+            )
+
+    async def _ensure(self, filepath: str, rendition: Rendition) -> bool:
+        """
+        Generate a rendition if it doesn't exist, or wait for its rendering
+        :param filepath: the original file path
+        :param rendition: the rendition
+        :return: False if the original file has been removed
+        """
+        path = self.get_path(filepath, rendition)
+        future = self._renders.get(path)
+        if future is None:
+            if await run_in_threadpool(os.path.exists, path):
+                return True
+            # Started by another request meanwhile
+            future = self._renders.get(path)
+        if future is None:
+            future = asyncio.ensure_future(self._render(filepath, path, rendition))
+            self._renders[path] = future
+            future.add_done_callback(lambda _: self._renders.pop(path, None))
+        # A request that gives up doesn't cancel the rendering for the others
+        return await asyncio.shield(future)
+
+    async def _render(self, filepath: str, path: str, rendition: Rendition) -> bool:
+        with self._time("rendition"):
+            return await asyncio.get_event_loop().run_in_executor(
+                self._executor,
+                renditions.render,
+                filepath,
+                path,
+                rendition.size,
+                rendition.still,
+            )
+
+    def _time(self, operation: str) -> ContextManager:
+        if self._metrics is None:
+            return nullcontext()
+        return self._metrics.time(operation)
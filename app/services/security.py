@@ -1,20 +1,31 @@
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Callable, Optional, Tuple, Union
 
 from fastapi import Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from starlette import status
 
 from app.config import Settings
 from app.models.user import User
-from app.repositories.user import get_user
+from app.repositories.user import get_user, get_user_async
 from app.schemas.security import TokenData
 
 ALGORITHM = jwt.ALGORITHMS.HS512
 
 
+class PasswordHashPoolFullError(Exception):
+    """Too many password verifications are waiting for the hash pool"""
+
+
 class SecurityService:
     """Service that handle all security aspect for a user"""
 
@@ -26,6 +37,13 @@ class SecurityService:
         self.pdw_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
         self.oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
         self.settings = settings
+        # bcrypt releases the GIL, threads are enough to keep it off the event loop
+        self._hash_executor = ThreadPoolExecutor(
+            max_workers=settings.password_hash_workers,
+            thread_name_prefix="password-hash",
+        )
+        self._hash_max_pending = settings.password_hash_max_pending
+        self._hash_pending = 0
 
     def authenticate_user(self, user: User, password: str) -> bool:
         """
@@ -36,6 +54,31 @@ class SecurityService:
         """
         return self.pdw_context.verify(password, user.hashed_password)
 
+    async def authenticate_user_async(self, user: User, password: str) -> bool:
+        """
+        Async version of authenticate_user, the password is verified in the hash
+        pool so the event loop isn't blocked.
+        :param user: the user to test
+        :param password: the plain text password
+        :return: True if the password is correct or False otherwise
+        :raise PasswordHashPoolFullError: the pool already has
+        password_hash_max_pending verifications running or waiting
+        """
+        if self._hash_pending >= self._hash_max_pending:
+            raise PasswordHashPoolFullError()
+        # Only changed from the event loop thread, no lock needed
+        self._hash_pending += 1
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+                self._hash_executor, self.authenticate_user, user, password
+            )
+        finally:
+            self._hash_pending -= 1
+
+    def shutdown(self) -> None:
+        """Stop the hash pool threads, once the running verifications are done"""
+        self._hash_executor.shutdown(wait=True)
+
     def create_access_token(self, user: User):
         """
         Create a JWT for an user.
@@ -59,21 +102,38 @@ class SecurityService:
         """
         payload = jwt.decode(token, self.settings.secret_key, algorithms=[ALGORITHM])
         username: str = payload.get("username")
-        return TokenData(username=username)
+        return TokenData(username=username, exp=payload.get("exp"))
 
 
 # Not fan to raise HTTP error from service..
 class JWTBearerService:
-    """Service that handle JWT validation for routes"""
+    """
+    Service that handle JWT validation for routes.
+    The verified tokens are cached with their user, the database is only queried
+    the first time a token is seen. A cached token is valid until its expiration
+    or jwt_cache_ttl seconds, so a removed user is only rejected after that.
+    """
 
-    def __init__(self, db: Session, security_service: SecurityService):
+    def __init__(
+        self,
+        settings: Settings,
+        security_service: SecurityService,
+        session_factory: Callable[[], Union[Session, AsyncSession]],
+    ):
         """
         Construct the security service
-        :param db: the database session
+        :param settings: the settings object needed to get the token cache size and
+        TTL
         :param security_service: the security service to check the tokens
+        :param session_factory: the factory of the sessions used to load the users,
+        a session is opened for each lookup
         """
-        self.db = db
         self.security_service = security_service
+        self._session_factory = session_factory
+        self._cache_size = settings.jwt_cache_size
+        self._cache_ttl = settings.jwt_cache_ttl
+        # token -> (user, expiration timestamp)
+        self._tokens: "OrderedDict[str, Tuple[User, float]]" = OrderedDict()
 
     async def __call__(self, authorization: str = Header("")) -> User:
         """
@@ -85,17 +145,71 @@ class JWTBearerService:
         auth = authorization.split(" ")
         if len(auth) != 2 or auth[0].lower() != "bearer" or auth[1] == "":
             raise _get_jwt_http_exception()
+        token = auth[1]
+
+        user = self._get_cached_user(token)
+        if user is not None:
+            return user
+
         try:
-            token_data = self.security_service.check_user_token(auth[1])
-            user = get_user(self.db, token_data.username)
-            print(user)
-            if user is None:
-                raise _get_jwt_http_exception()
+            token_data = self.security_service.check_user_token(token)
         except JWTError as e:
             # todo log error
             raise _get_jwt_http_exception(format(e))
+        user = await self._load_user(token_data.username)
+        if user is None:
+            raise _get_jwt_http_exception()
+
+        expiration = time.time() + self._cache_ttl
+        if token_data.exp is not None:
+            expiration = min(expiration, token_data.exp)
+        self._cache_user(token, user, expiration)
+        return user
+
+    def _get_cached_user(self, token: str) -> Optional[User]:
+        """
+        Get the user of an already verified token
+        :param token: the bearer token
+        :return: the user or None if the token isn't cached or is expired
+        """
+        entry = self._tokens.get(token)
+        if entry is None:
+            return None
+        user, expiration = entry
+        if expiration <= time.time():
+            del self._tokens[token]
+            return None
+        self._tokens.move_to_end(token)
         return user
 
+    def _cache_user(self, token: str, user: User, expiration: float) -> None:
+        if self._cache_size <= 0:
+            return
+        self._tokens[token] = (user, expiration)
+        self._tokens.move_to_end(token)
+        if len(self._tokens) > self._cache_size:
+            self._tokens.popitem(last=False)
+
+    async def _load_user(self, username: str) -> Optional[User]:
+        """
+        Retrieve an user with a new session, closed right after.
+        The session doesn't expire on commit, the user stays usable once detached.
+        :param username: the user's username
+        :return: the User model or None
+        """
+        db = self._session_factory()
+        if isinstance(db, AsyncSession):
+            async with db:
+                return await get_user_async(db, username)
+        return await run_in_threadpool(_get_user_sync, db, username)
+
+
+def _get_user_sync(db: Session, username: str) -> Optional[User]:
+    try:
+        return get_user(db, username)
+    finally:
+        db.close()
+
 
 def _get_jwt_http_exception(message: str = "Could not validate credentials"):
     """
@@ -0,0 +1,221 @@
+import asyncio
+import base64
+import heapq
+import json
+import math
+import os
+import random
+import time
+from array import array
+from logging import getLogger
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.config import Settings
+
+LOGGER = getLogger("fastapi")
+
+# Name of the default snapshot file, in the upload directory
+SNAPSHOT_FILENAME = ".trending.json"
+SNAPSHOT_VERSION = 1
+# The weights grow exponentially with time, they are scaled down before they
+# overflow the floats precision
+_MAX_EXPONENT = 50.0
+# Mersenne prime of the sketch hash functions
+_PRIME = (1 << 61) - 1
+
+
+class TrendingService:
+    """
+    Service that ranks the contents by their recent downloads, in constant memory.
+    Each download adds a weight that grows exponentially with time (forward decay),
+    so the older downloads count less without decaying all the counters. The
+    downloads of each content are estimated by a count-min sketch and only the
+    most downloaded contents are tracked by a top-K.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+        Construct the trending service, the previous snapshot is restored by load
+        :param settings: the settings object needed to get the decay, the sketch
+        size and the snapshot path
+        """
+        self._decay = math.log(2) / settings.trending_half_life
+        self._capacity = settings.trending_capacity
+        self._width = settings.trending_sketch_width
+        self._depth = settings.trending_sketch_depth
+        self._snapshot_path = settings.trending_snapshot_path or os.path.join(
+            settings.upload_directory, SNAPSHOT_FILENAME
+        )
+        self._snapshot_interval = settings.trending_snapshot_interval
+        # Fixed hash functions, the snapshot sketch stays valid after a restart
+        self._hashes = [_hash_function(row) for row in range(self._depth)]
+        self._sketch = [array("d", bytes(8 * self._width)) for _ in self._hashes]
+        # Time origin of the weights
+        self._landmark = time.time()
+        # Tracked content id -> estimated weight. The heap holds (weight, id) with
+        # the outdated weights, skipped when they are popped
+        self._scores: Dict[int, float] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, content_id: int) -> None:
+        """
+        Record a download of a content
+        :param content_id: the content entity id
+        """
+        exponent = self._decay * (time.time() - self._landmark)
+        if exponent > _MAX_EXPONENT:
+            self._rescale()
+            exponent = 0.0
+        weight = math.exp(exponent)
+
+        estimate = math.inf
+        for row, column in zip(self._sketch, self._columns(content_id)):
+            row[column] += weight
+            estimate = min(estimate, row[column])
+
+        if content_id not in self._scores:
+            if len(self._scores) >= self._capacity:
+                if estimate <= self._min_score():
+                    return
+                del self._scores[heapq.heappop(self._heap)[1]]
+        self._scores[content_id] = estimate
+        heapq.heappush(self._heap, (estimate, content_id))
+        if len(self._heap) > 4 * self._capacity:
+            self._rebuild_heap()
+
+    def remove(self, content_id: int) -> None:
+        """
+        Stop ranking a deleted content
+        :param content_id: the content entity id
+        """
+        self._scores.pop(content_id, None)
+
+    def top(self) -> List[Tuple[int, float]]:
+        """
+        Get the tracked contents
+        :return: (content id, decayed downloads) ordered from the most downloaded
+        """
+        scale = math.exp(-self._decay * (time.time() - self._landmark))
+        ranking = sorted(self._scores.items(), key=lambda item: item[1], reverse=True)
+        return [(content_id, score * scale) for content_id, score in ranking]
+
+    def start(self) -> None:
+        """Start the periodic snapshot task in the running event loop"""
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic snapshot task and write a last snapshot"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save()
+
+    async def load(self) -> None:
+        """
+        Restore the last snapshot if there is one. A snapshot of another sketch size
+        only restores the top-K
+        """
+        try:
+            snapshot = await run_in_threadpool(_read_json, self._snapshot_path)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            LOGGER.error("TrendingService. The snapshot couldn't be read. %s", e)
+            return
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            return
+
+        # The snapshot weights are brought to the current landmark
+        scale = math.exp(self._decay * (snapshot["landmark"] - self._landmark))
+        sketch = [array("d", base64.b64decode(row)) for row in snapshot["sketch"]]
+        if len(sketch) == self._depth and all(
+            len(row) == self._width for row in sketch
+        ):
+            self._sketch = [
+                array("d", (weight * scale for weight in row)) for row in sketch
+            ]
+        scores = heapq.nlargest(
+            self._capacity, snapshot["scores"], key=lambda item: item[1]
+        )
+        self._scores = {content_id: score * scale for content_id, score in scores}
+        self._rebuild_heap()
+
+    async def save(self) -> None:
+        """Write a snapshot, atomically"""
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "landmark": self._landmark,
+            "sketch": [
+                base64.b64encode(row.tobytes()).decode() for row in self._sketch
+            ],
+            "scores": list(self._scores.items()),
+        }
+        try:
+            await run_in_threadpool(_write_json, self._snapshot_path, snapshot)
+        except OSError as e:
+            LOGGER.error("TrendingService. The snapshot couldn't be written. %s", e)
+
+    async def _run(self) -> None:
+        """Write a snapshot every interval"""
+        while True:
+            await asyncio.sleep(self._snapshot_interval)
+            await self.save()
+
+    def _columns(self, content_id: int) -> List[int]:
+        return [(a * content_id + b) % _PRIME % self._width for a, b in self._hashes]
+
+    def _min_score(self) -> float:
+        # Skip the outdated entries
+        while self._heap:
+            score, content_id = self._heap[0]
+            if self._scores.get(content_id) == score:
+                return score
+            heapq.heappop(self._heap)
+        return 0.0
+
+    def _rebuild_heap(self) -> None:
+        self._heap = [(score, content_id) for content_id, score in self._scores.items()]
+        heapq.heapify(self._heap)
+
+    def _rescale(self) -> None:
+        """Move the landmark to now, all the weights are scaled down"""
+        now = time.time()
+        scale = math.exp(-self._decay * (now - self._landmark))
+        self._landmark = now
+        self._sketch = [
+            array("d", (weight * scale for weight in row)) for row in self._sketch
+        ]
+        self._scores = {
+            content_id: score * scale for content_id, score in self._scores.items()
+        }
+        self._rebuild_heap()
+
+
+def _hash_function(row: int) -> Tuple[int, int]:
+    """
+    Get the (a, b) coefficients of the (a * x + b) mod p hash function of a sketch
+    row, the same at each start
+    :param row: the sketch row
+    :return: the coefficients
+    """
+    rng = random.Random(row)
+    return rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)
+
+
+def _read_json(path: str) -> dict:
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def _write_json(path: str, value: dict) -> None:
+    partial_path = path + ".part"
+    with open(partial_path, mode="w") as fp:
+        json.dump(value, fp)
+    os.replace(partial_path, path)
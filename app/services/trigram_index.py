@@ -0,0 +1,85 @@
+from array import array
+from typing import Dict, Iterable, List, Set, Tuple
+
+from app.config import Settings
+
+# The names are padded like pg_trgm, the first letters weight more
+_PADDING_START = "  "
+_PADDING_END = " "
+
+
+def _trigrams(name: str) -> Set[str]:
+    padded = _PADDING_START + name + _PADDING_END
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndexService:
+    """
+    In-process index from the character trigrams to the normalized keywords names
+    that have them, to find the keywords close to a misspelled one.
+    The similarity of two names is the number of trigrams they share divided by the
+    number of distinct trigrams of both (Jaccard index), as pg_trgm.
+    It must be updated by every route that creates keywords.
+    """
+
+    def __init__(self, settings: Settings):
+        """
+        Construct an empty index, it is filled by build and add_keywords
+        :param settings: the settings object needed to get the expansions limits
+        """
+        self._max_expansions = settings.fuzzy_search_max_expansions
+        self._min_similarity = settings.fuzzy_search_min_similarity
+        self._names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        # Number of trigrams of each name, by name id
+        self._sizes = array("H")
+        self._postings: Dict[str, array] = {}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def build(self, names: Iterable[str]) -> None:
+        """
+        Replace the index content.
+        :param names: the normalized keywords names
+        """
+        self._names, self._ids, self._sizes, self._postings = [], {}, array("H"), {}
+        self.add_keywords(names)
+
+    def add_keywords(self, names: Iterable[str]) -> None:
+        """
+        Index new keywords, the ones already indexed are ignored
+        :param names: the normalized keywords names
+        """
+        for name in names:
+            if name in self._ids:
+                continue
+            name_id = len(self._names)
+            self._names.append(name)
+            self._ids[name] = name_id
+            trigrams = _trigrams(name)
+            self._sizes.append(len(trigrams))
+            for trigram in trigrams:
+                self._postings.setdefault(trigram, array("I")).append(name_id)
+
+    def expand(self, name: str) -> List[Tuple[str, float]]:
+        """
+        Get the keywords close to a name, itself included if it exists
+        :param name: the normalized name
+        :return: at most the maximum number of expansions (keyword name,
+        similarity), the most similar first
+        """
+        trigrams = _trigrams(name)
+        shared: Dict[int, int] = {}
+        for trigram in trigrams:
+            for name_id in self._postings.get(trigram, ()):
+                shared[name_id] = shared.get(name_id, 0) + 1
+
+        similar = []
+        for name_id, count in shared.items():
+            similarity = count / (len(trigrams) + self._sizes[name_id] - count)
+            if similarity >= self._min_similarity:
+                similar.append((-similarity, self._names[name_id]))
+        similar.sort()
+        del similar[self._max_expansions :]
+        return [(name, -similarity) for similarity, name in similar]
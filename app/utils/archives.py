@@ -0,0 +1,40 @@
+import tarfile
+import zipfile
+from typing import BinaryIO, Iterator, Tuple
+
+
+class UnsupportedArchiveError(Exception):
+    """The archive is neither a zip nor a tar archive"""
+
+
+def iter_archive_files(fileobj: BinaryIO) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    Iterate over the regular files of a zip or a (compressed) tar archive.
+    The files are read in the archive order, a file must be read before the next
+    one is requested.
+    :param fileobj: the archive file object, seekable
+    :return: an iterator of (path in the archive, file object)
+    :raise UnsupportedArchiveError: the archive format isn't recognized
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as member:
+                    yield info.filename, member
+        return
+
+    fileobj.seek(0)
+    try:
+        # Stream mode, the members are read sequentially without seeking
+        archive = tarfile.open(fileobj=fileobj, mode="r|*")
+    except tarfile.TarError:
+        raise UnsupportedArchiveError("The archive must be a zip or a tar archive")
+    with archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            with archive.extractfile(info) as member:
+                yield info.name, member
@@ -0,0 +1,127 @@
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Mapping, Optional, Tuple
+
+# The contents files never change once uploaded
+CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Above this number of ranges, the whole content is sent instead
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiableError(Exception):
+    """None of the requested ranges overlaps the content"""
+
+
+def format_http_date(timestamp: float) -> str:
+    """
+    Format a timestamp as an HTTP date
+    :param timestamp: the POSIX timestamp
+    :return: the HTTP date
+    """
+    return formatdate(timestamp, usegmt=True)
+
+
+def _parse_http_date(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _strip_weak(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(
+    headers: Mapping[str, str], etag: str, last_modified: Optional[float]
+) -> bool:
+    """
+    Evaluate the If-None-Match and If-Modified-Since conditional headers of a GET.
+    If-Modified-Since is ignored when If-None-Match is present.
+    :param headers: the request headers
+    :param etag: the strong entity tag of the content, with its quotes
+    :param last_modified: the content modification timestamp, None if unknown
+    :return: True if a 304 Not Modified must be answered
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison, the W/ prefix is ignored
+        tags = (tag.strip() for tag in if_none_match.split(","))
+        return any(_strip_weak(tag) == etag for tag in tags)
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is not None and last_modified is not None:
+        since = _parse_http_date(if_modified_since)
+        # The HTTP dates have a one second precision
+        return since is not None and int(last_modified) <= since
+    return False
+
+
+def is_range_applicable(
+    headers: Mapping[str, str], etag: str, last_modified: Optional[float]
+) -> bool:
+    """
+    Evaluate the If-Range header, tell if the Range header must be honored.
+    :param headers: the request headers
+    :param etag: the strong entity tag of the content, with its quotes
+    :param last_modified: the content modification timestamp, None if unknown
+    :return: True if there is no If-Range header or if it matches the content
+    """
+    if_range = headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        # Strong comparison
+        return if_range == etag
+    date = _parse_http_date(if_range)
+    return date is not None and last_modified is not None and int(last_modified) == date
+
+
+def parse_range(range_header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse a Range header (RFC 7233) against the content size.
+    :param range_header: the Range header value, e.g. "bytes=0-99,-50"
+    :param size: the content size in bytes
+    :return: the list of inclusive (first byte, last byte) ranges, in the requested
+    order, or None if the header must be ignored (invalid or too many ranges)
+    :raise RangeNotSatisfiableError: no range overlaps the content
+    """
+    unit, _, specs = range_header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    specs = [spec.strip() for spec in specs.split(",") if spec.strip()]
+    if len(specs) == 0 or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.partition("-")
+        if not dash:
+            return None
+        try:
+            if first == "":
+                # Suffix range, the last N bytes
+                length = int(last)
+                if length < 0:
+                    return None
+                if length == 0 or size == 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            first = int(first)
+            # An open range goes to the end of the content
+            last = int(last) if last != "" else max(first, size - 1)
+        except ValueError:
+            return None
+        if first < 0 or last < first:
+            return None
+        if first >= size:
+            continue
+        ranges.append((first, min(last, size - 1)))
+
+    if len(ranges) == 0:
+        raise RangeNotSatisfiableError()
+    return ranges
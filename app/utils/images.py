@@ -0,0 +1,180 @@
+import struct
+from typing import Generator, NamedTuple, Optional, Tuple
+
+# Signatures of the supported images types, the first bytes of the files
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+)
+# Number of bytes needed to recognize any signature
+SIGNATURE_SIZE = max(len(signature) for signature, _ in SIGNATURES)
+
+# JPEG start of frame markers, they hold the image size
+_JPEG_SOF_MARKERS = frozenset(
+    (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+)
+# JPEG markers without a length
+_JPEG_STANDALONE_MARKERS = frozenset((0x01, 0xD8, *range(0xD0, 0xD8)))
+_JPEG_START_OF_SCAN = 0xDA
+
+_READ = 0
+_SKIP = 1
+
+# What a parser asks for: (_READ, n) to receive n bytes, (_SKIP, n) to ignore them
+_Request = Tuple[int, int]
+_Parser = Generator[_Request, Optional[bytes], None]
+
+
+class ImageInfo(NamedTuple):
+    width: Optional[int] = None
+    height: Optional[int] = None
+    # Number of frames of the animated images, 1 otherwise
+    frames: Optional[int] = None
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """
+    Find the mime type of a supported image from its signature
+    :param header: the first bytes of the file, at least SIGNATURE_SIZE if available
+    :return: the mime type or None if it isn't a supported image
+    """
+    for signature, mimetype in SIGNATURES:
+        if header.startswith(signature):
+            return mimetype
+    return None
+
+
+class ImageInfoParser:
+    """
+    Incremental parser of the images headers. It is fed with the file chunks, in
+    the same pass as the upload, and never decodes the pixels.
+    The GIF files are read until their end to count the frames, the PNG and JPEG
+    ones only until the size (and the APNG animation control) is found.
+    """
+
+    def __init__(self, mimetype: str):
+        """
+        Construct the parser
+        :param mimetype: the sniffed mime type of the file
+        """
+        self.info = ImageInfo()
+        self._buffer = bytearray()
+        parse = _PARSERS.get(mimetype)
+        self._parser: Optional[_Parser] = parse(self) if parse is not None else None
+        self._request = self._next(None)
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Parse the next chunk of the file
+        :param chunk: the bytes following the previous chunk
+        """
+        if self._parser is None:
+            return
+        self._buffer += chunk
+        offset = 0
+        while self._parser is not None:
+            kind, size = self._request
+            available = len(self._buffer) - offset
+            if kind == _SKIP:
+                skipped = min(max(size, 0), available)
+                offset += skipped
+                if skipped < size:
+                    self._request = (_SKIP, size - skipped)
+                    break
+                self._request = self._next(None)
+            else:
+                if available < size:
+                    break
+                data = bytes(self._buffer[offset : offset + size])
+                offset += size
+                self._request = self._next(data)
+        # Compact once per chunk instead of once per request
+        del self._buffer[:offset]
+
+    def _next(self, data: Optional[bytes]) -> Optional[_Request]:
+        if self._parser is None:
+            return None
+        try:
+            return self._parser.send(data)
+        except (StopIteration, struct.error):
+            # Done, or invalid header: what is found so far is kept
+            self._parser = None
+            self._buffer = bytearray()
+            return None
+
+
+def _parse_png(parser: ImageInfoParser) -> _Parser:
+    yield _SKIP, 8  # Signature
+    length, kind = struct.unpack(">I4s", (yield _READ, 8))
+    if kind != b"IHDR":
+        return
+    width, height = struct.unpack(">II", (yield _READ, 8))
+    parser.info = ImageInfo(width, height, 1)
+    yield _SKIP, length - 8 + 4  # Rest of the header and CRC
+
+    # An animated PNG has an animation control chunk before the image data
+    while True:
+        length, kind = struct.unpack(">I4s", (yield _READ, 8))
+        if kind in (b"IDAT", b"IEND"):
+            return
+        if kind == b"acTL":
+            frames = struct.unpack(">I", (yield _READ, 4))[0]
+            parser.info = parser.info._replace(frames=frames)
+            return
+        yield _SKIP, length + 4
+
+
+def _parse_gif(parser: ImageInfoParser) -> _Parser:
+    yield _SKIP, 6  # Signature
+    width, height, flags = struct.unpack("<HHB", (yield _READ, 7)[:5])
+    parser.info = ImageInfo(width, height, 0)
+    if flags & 0x80:
+        yield _SKIP, 3 << ((flags & 0x07) + 1)  # Global color table
+
+    frames = 0
+    while True:
+        introducer = (yield _READ, 1)[0]
+        if introducer == 0x2C:  # Image descriptor, a frame
+            frames += 1
+            parser.info = parser.info._replace(frames=frames)
+            flags = (yield _READ, 9)[8]
+            if flags & 0x80:
+                yield _SKIP, 3 << ((flags & 0x07) + 1)  # Local color table
+            yield _SKIP, 1  # LZW minimum code size
+        elif introducer == 0x21:  # Extension
+            yield _SKIP, 1  # Label
+        else:  # Trailer or invalid
+            return
+        # Data sub-blocks, until an empty one
+        while True:
+            size = (yield _READ, 1)[0]
+            if size == 0:
+                break
+            yield _SKIP, size
+
+
+def _parse_jpeg(parser: ImageInfoParser) -> _Parser:
+    yield _SKIP, 2  # Start of image
+    while True:
+        marker = (yield _READ, 1)[0]
+        if marker != 0xFF:
+            return
+        # Fill bytes
+        while marker == 0xFF:
+            marker = (yield _READ, 1)[0]
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == _JPEG_START_OF_SCAN:
+            # The image data starts, there is no frame header
+            return
+        length = struct.unpack(">H", (yield _READ, 2))[0]
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">xHH", (yield _READ, 5))
+            parser.info = ImageInfo(width, height, 1)
+            return
+        yield _SKIP, length - 2
+
+
+_PARSERS = {"image/png": _parse_png, "image/gif": _parse_gif, "image/jpeg": _parse_jpeg}
@@ -0,0 +1,12 @@
+from typing import Iterator, Sequence
+
+
+def chunks(values: Sequence, size: int) -> Iterator[Sequence]:
+    """
+    Split a sequence in consecutive chunks
+    :param values: the sequence to split
+    :param size: the maximum size of a chunk
+    :return: an iterator of the chunks, the last one can be smaller
+    """
+    for i in range(0, len(values), size):
+        yield values[i : i + size]
@@ -1,38 +1,53 @@
 import unicodedata
+from functools import lru_cache
 from typing import Generator, Iterator, List
 
+# Number of normalized keywords kept in memory
+NORMALIZE_CACHE_SIZE = 10_000
+
+# The comma separator is replaced by a space so one split is enough
+_SEPARATORS_TABLE = str.maketrans(",", " ")
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_keyword(keyword: str) -> str:
+    keyword = keyword.lower().strip()
+    if keyword.isascii():
+        # Nothing to decompose nor to remove
+        return keyword
+    return (
+        unicodedata.normalize("NFD", keyword)
+        .encode(encoding="ascii", errors="ignore")
+        .decode(encoding="utf-8")
+    )
+
 
 def normalize_keywords(keywords: [Iterator[str], List[str]]) -> Iterator[str]:
     """
     Normalize keywords.
+    The normalized forms are cached, the keywords with the same normalized form
+    are only yielded once.
     :param keywords: an iterator or list of keywords
-    :return: an interator of normalized keywords
+    :return: an interator of unique normalized keywords
     """
-    return map(
-        lambda k: unicodedata.normalize("NFD", k.lower().strip())
-        .encode(encoding="ascii", errors="ignore")
-        .decode(encoding="utf-8"),
-        keywords,
-    )
+    # dict.fromkeys removes the duplicates and keep the order
+    return iter(dict.fromkeys(map(_normalize_keyword, keywords)))
 
 
 def split_keywords_generator(keywords_string: str) -> Generator[str, str, None]:
     """
     Create a generator that splits a string given multiple separators and yield only unique value.
+    The keywords of one letter are ignored, except the last one.
     :param keywords_string: The keywords to split
     :return: A generator that yield each keyword
     """
-    size = len(keywords_string)
-    last = 0
-    separators = {" ", ","}
+    # The words followed by a separator, then the last one, empty if the string
+    # ends with a separator
+    *words, last = keywords_string.translate(_SEPARATORS_TABLE).split(" ")
     seen = set()
-    for i in range(0, size):
-        if keywords_string[i] in separators:
-            if i - last > 1:  # Avoid the case of separators that follow each other
-                word = keywords_string[last:i]
-                if word not in seen:  # Don't yield a keyword already yielded
-                    seen.add(word)
-                    yield word
-            last = min(i + 1, size)  # Avoid an OOB
-        elif i + 1 == size:  # Return the last word if not a separator
-            yield keywords_string[last:size]
+    for word in words:
+        if len(word) > 1 and word not in seen:  # Don't yield a keyword already yielded
+            seen.add(word)
+            yield word
+    if last and last not in seen:
+        yield last
@@ -0,0 +1,26 @@
+import base64
+from typing import Tuple
+
+
+def encode_cursor(matches: int, content_id: int) -> str:
+    """
+    Encode the keyset of the last returned search result into an opaque cursor.
+    :param matches: The number of matched keywords of the last result
+    :param content_id: The content id of the last result
+    :return: The cursor string, safe for an url
+    """
+    return base64.urlsafe_b64encode(f"{matches}:{content_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """
+    Decode a cursor created by encode_cursor.
+    :param cursor: The cursor string
+    :return: The (matches, content id) keyset
+    :raise ValueError: the cursor is invalid
+    """
+    try:
+        matches, content_id = base64.urlsafe_b64decode(cursor.encode()).split(b":")
+        return int(matches), int(content_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid cursor '{cursor}'") from e
@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+from typing import Iterator, List, Union
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+class QueryCounter:
+    """
+    Context manager that records the statements executed by an engine.
+    Usage:
+        with QueryCounter(engine) as counter:
+            ...
+        counter.count
+    """
+
+    def __init__(self, engine: Union[Engine, AsyncEngine]):
+        """
+        Construct the counter
+        :param engine: the engine to listen to, sync or async
+        """
+        self._engine = getattr(engine, "sync_engine", engine)
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        """Number of statements executed"""
+        return len(self.statements)
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(self._engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        event.remove(self._engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def assert_query_count(
+    engine: Union[Engine, AsyncEngine], expected: int
+) -> Iterator[QueryCounter]:
+    """
+    Assert that a block executes exactly the expected number of statements.
+    Usage:
+        with assert_query_count(engine, 2):
+            client.get("/api/v1/contents/", params={"keywords": ["cat"]})
+    :param engine: the engine to listen to, sync or async
+    :param expected: the expected number of statements
+    :raise AssertionError: a different number of statements has been executed
+    """
+    with QueryCounter(engine) as counter:
+        yield counter
+    if counter.count != expected:
+        statements = "\n".join(counter.statements)
+        raise AssertionError(
+            f"{counter.count} statements executed instead of {expected}:\n{statements}"
+        )
@@ -0,0 +1,87 @@
+import os
+from typing import Optional
+
+try:
+    from PIL import Image, ImageOps, ImageSequence
+except ImportError:  # Optional, only needed when the renditions are enabled
+    Image = None
+
+# Pillow formats of the supported mime types
+FORMATS = {"image/gif": "GIF", "image/jpeg": "JPEG", "image/png": "PNG"}
+# The stills are the first frame of the animated images
+STILL_MIMETYPE = "image/png"
+
+# The functions below run in the renditions worker processes, their arguments
+# and results must be picklable.
+
+
+def render(source: str, target: str, size: Optional[int], still: bool) -> bool:
+    """
+    Write a smaller copy of an image, or its first frame.
+    The image is written in a temporary file then renamed, a rendition is never
+    seen partially written.
+    :param source: the original image path
+    :param target: the rendition path
+    :param size: the maximum width and height, None to keep the original size
+    :param still: keep only the first frame, saved as PNG
+    :return: False if the original image has been removed meanwhile
+    :raise FileNotFoundError: the original image doesn't exist
+    :raise OSError: the image can't be decoded or written
+    """
+    with Image.open(source) as image:
+        image_format = image.format
+        if size is not None and image_format == "JPEG":
+            # Decode the JPEG directly at a reduced scale
+            image.draft("RGB", (size, size))
+        if still or not getattr(image, "is_animated", False):
+            frame = ImageOps.exif_transpose(image)
+            if size is not None:
+                frame.thumbnail((size, size))
+            save = dict(format="PNG" if still else image_format)
+        else:
+            frame, save = _resize_animation(image, size)
+
+        partial_path = f"{target}.{os.getpid()}.part"
+        try:
+            frame.save(partial_path, **save)
+            os.replace(partial_path, target)
+        except BaseException:
+            _remove_if_exists(partial_path)
+            raise
+
+    # The original may have been deleted during the rendering, its renditions
+    # are removed with it
+    if not os.path.exists(source):
+        _remove_if_exists(target)
+        return False
+    return True
+
+
+def _resize_animation(image, size: Optional[int]):
+    """
+    Resize all the frames of an animated image
+    :param image: the opened animated image
+    :param size: the maximum width and height, None to keep the original size
+    :return: the first frame and the save arguments with the following frames
+    """
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(image):
+        durations.append(frame.info.get("duration", 100))
+        frame = frame.copy()
+        if size is not None:
+            frame.thumbnail((size, size))
+        frames.append(frame)
+    return frames[0], dict(
+        format=image.format,
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=image.info.get("loop", 0),
+    )
+
+
+def _remove_if_exists(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,65 @@
+"""Helpers shared by the benchmark scripts"""
+import os
+import struct
+import sys
+import zlib
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+def configure(directory: str) -> None:
+    """
+    Point the application settings to a temporary directory, before importing it.
+    The variables already set are kept, e.g. ASYNC_DATABASE or the caches.
+    :param directory: the directory of the SQLite database and of the uploads
+    """
+    database = os.path.join(directory, "fmds.sqlite")
+    os.environ.setdefault(
+        "SQLALCHEMY_DATABASE_URL", f"sqlite:///{database}?check_same_thread=false"
+    )
+    os.environ.setdefault(
+        "SQLALCHEMY_ASYNC_DATABASE_URL", f"sqlite+aiosqlite:///{database}"
+    )
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("UPLOAD_DIRECTORY", os.path.join(directory, "upload"))
+    os.environ["FMDS_ENV_FILE"] = os.devnull
+    sys.path.insert(0, ROOT)
+
+
+def create_user(username: str, password: str) -> None:
+    """
+    Create an user directly in the database
+    :param username: the user's username
+    :param password: the plain text password
+    """
+    from passlib.context import CryptContext
+
+    from app import models
+    from app.database import SessionLocal
+
+    with SessionLocal() as db:
+        hashed_password = CryptContext(schemes=["bcrypt"]).hash(password)
+        db.add(models.User(username=username, hashed_password=hashed_password))
+        db.commit()
+
+
+def png(width: int, height: int) -> bytes:
+    """
+    Build a black RGB PNG image
+    :param width: the image width
+    :param height: the image height
+    :return: the PNG file
+    """
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        crc = struct.pack(">I", zlib.crc32(kind + data))
+        return struct.pack(">I", len(data)) + kind + data + crc
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    rows = b"".join(b"\x00" + b"\x00\x00\x00" * width for _ in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(rows))
+        + chunk(b"IEND", b"")
+    )
@@ -0,0 +1,107 @@
+"""
+Keywords tokenizer and normalizer micro-benchmarks.
+
+Compare app.utils.keywords with the previous character by character
+implementation on short queries, long pasted tag lists and non-ASCII input.
+The outputs are checked against the previous implementation first.
+
+    python benchmarks/keywords.py --number 20000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+import unicodedata
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.utils import keywords  # noqa: E402
+
+
+def reference_split(keywords_string):
+    """The previous tokenizer, the last word wasn't deduplicated"""
+    size = len(keywords_string)
+    last = 0
+    separators = {" ", ","}
+    seen = set()
+    for i in range(0, size):
+        if keywords_string[i] in separators:
+            if i - last > 1:
+                word = keywords_string[last:i]
+                if word not in seen:
+                    seen.add(word)
+                    yield word
+            last = min(i + 1, size)
+        elif i + 1 == size:
+            yield keywords_string[last:size]
+
+
+def reference_normalize(keywords_list):
+    """The previous normalizer, neither cached nor deduplicated"""
+    return map(
+        lambda k: unicodedata.normalize("NFD", k.lower().strip())
+        .encode(encoding="ascii", errors="ignore")
+        .decode(encoding="utf-8"),
+        keywords_list,
+    )
+
+
+def _random_string(rng, alphabet, size):
+    return "".join(rng.choice(alphabet) for _ in range(size))
+
+
+def check(rng, count=20000):
+    """Compare the outputs with the previous implementation on random strings"""
+    alphabet = "ab ,Éé"
+    for _ in range(count):
+        value = _random_string(rng, alphabet, rng.randint(0, 12))
+        words = list(dict.fromkeys(reference_split(value)))
+        assert list(keywords.split_keywords_generator(value)) == words, value
+        expected = list(dict.fromkeys(reference_normalize(words)))
+        assert list(keywords.normalize_keywords(words)) == expected, value
+
+
+_RNG = random.Random(1)
+CASES = {
+    "short query": "cat dog",
+    "long tag list": ", ".join(
+        _random_string(_RNG, string.ascii_lowercase, 8) for _ in range(200)
+    ),
+    "non-ascii": "Café, crème brûlée, Ærøskøbing, naïve, Noël, São Paulo, Ελλάδα",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--number", type=int, default=10000)
+    args = parser.parse_args()
+
+    check(random.Random(0))
+    print(f"{'case':<16}{'step':<12}{'previous':>12}{'current':>12}{'speedup':>10}")
+    for name, value in CASES.items():
+        words = list(reference_split(value))
+        benches = {
+            "split": (
+                lambda: list(reference_split(value)),
+                lambda: list(keywords.split_keywords_generator(value)),
+            ),
+            "normalize": (
+                lambda: list(reference_normalize(words)),
+                lambda: list(keywords.normalize_keywords(words)),
+            ),
+        }
+        for step, (previous, current) in benches.items():
+            previous_time = timeit.timeit(previous, number=args.number)
+            current_time = timeit.timeit(current, number=args.number)
+            print(
+                f"{name:<16}{step:<12}"
+                f"{previous_time / args.number * 1e6:>10.2f}us"
+                f"{current_time / args.number * 1e6:>10.2f}us"
+                f"{previous_time / current_time:>9.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+Mixed workload load test of the API.
+
+Boot the application in process against a temporary SQLite database and upload
+directory, seed it with contents and keywords, then drive a mix of downloads,
+searches, uploads, patches and deletions with concurrent clients. The latency
+percentiles, the throughput and the database statements of each endpoint are
+printed as JSON, to compare the runs.
+The settings can be changed with the usual environment variables (e.g.
+ASYNC_DATABASE=1, KEYWORD_INDEX_ENABLED=1).
+
+    pip install httpx aiosqlite
+    python benchmarks/load.py --contents 5000 --clients 32 --duration 30 \\
+        --mix download=70,search=20,upload=5,patch=3,delete=2 --output run.json
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import tempfile
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import accumulate
+from typing import Dict, List
+
+from common import configure, create_user, png
+
+# Endpoint of the statements executed by the current request
+_operation = contextvars.ContextVar("operation", default="background")
+
+
+class Popularity:
+    """Pick the ranks of a population with a uniform or a zipf distribution"""
+
+    def __init__(self, rng: random.Random, size: int, distribution: str, s: float):
+        self._rng = rng
+        if distribution == "zipf":
+            weights = [1 / rank**s for rank in range(1, size + 1)]
+        else:
+            weights = [1] * size
+        self._cum_weights = list(accumulate(weights))
+
+    def rank(self, population: int) -> int:
+        """Pick a rank, clamped to the current population size"""
+        draw = self._rng.random() * self._cum_weights[-1]
+        rank = bisect_right(self._cum_weights, draw)
+        return min(rank, population - 1)
+
+
+def _check_popularity() -> None:
+    """Check that the low ranks are the popular ones"""
+    samples = 10_000
+    for distribution, low, high in (("zipf", 0.45, 0.7), ("uniform", 0.05, 0.15)):
+        popularity = Popularity(random.Random(0), 100, distribution, 1.0)
+        top = sum(popularity.rank(100) < 10 for _ in range(samples)) / samples
+        assert low < top < high, f"{distribution} top-10 share {top:.2f}"
+
+
+class Workload:
+    """The operations of the load test and their measures"""
+
+    def __init__(self, client, args, rng: random.Random, headers: Dict[str, str]):
+        self.client = client
+        self.rng = rng
+        self.headers = headers
+        self.keywords = [f"kw{i}" for i in range(args.keywords)]
+        self.keywords_per_content = args.keywords_per_content
+        self.filenames: List[str] = []
+        self.keyword_popularity = Popularity(
+            rng, args.keywords, args.distribution, args.zipf_s
+        )
+        self.content_popularity = Popularity(
+            rng, args.contents, args.distribution, args.zipf_s
+        )
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statements: Dict[str, int] = defaultdict(int)
+
+    def count_statement(self, *_) -> None:
+        self.statements[_operation.get()] += 1
+
+    def pick_keywords(self) -> List[str]:
+        count = self.rng.randint(1, self.keywords_per_content)
+        ranks = (self.keyword_popularity.rank(len(self.keywords)) for _ in range(count))
+        return list(dict.fromkeys(self.keywords[rank] for rank in ranks))
+
+    def pick_filename(self) -> str:
+        return self.filenames[self.content_popularity.rank(len(self.filenames))]
+
+    async def seed(self, count: int, batch_size: int) -> None:
+        _operation.set("seed")
+        for start in range(0, count, batch_size):
+            size = min(batch_size, count - start)
+            files = [
+                ("files", (f"{i}.png", png(1 + i % 64, 1), "image/png"))
+                for i in range(size)
+            ]
+            keywords = [" ".join(self.pick_keywords()) for _ in range(size)]
+            response = await self.client.post(
+                "/api/v1/contents/batch",
+                files=files,
+                data={"keywords": keywords},
+                headers=self.headers,
+            )
+            response.raise_for_status()
+            self.filenames.extend(
+                item["content"]["filename"] for item in response.json()
+            )
+
+    async def run(self, operation: str) -> None:
+        _operation.set(operation)
+        start = time.perf_counter()
+        response = await getattr(self, operation)()
+        self.latencies[operation].append(time.perf_counter() - start)
+        if response is not None and response.status_code >= 400:
+            self.errors[operation] += 1
+
+    async def download(self):
+        if not self.filenames:
+            return None
+        return await self.client.get(f"/api/v1/contents/{self.pick_filename()}")
+
+    async def search(self):
+        return await self.client.get(
+            "/api/v1/contents/", params={"keywords": self.pick_keywords()}
+        )
+
+    async def upload(self):
+        response = await self.client.post(
+            "/api/v1/contents",
+            files={"file": ("a.png", png(self.rng.randint(1, 64), 1), "image/png")},
+            data={"keywords": " ".join(self.pick_keywords())},
+            headers=self.headers,
+        )
+        if response.status_code == 201:
+            self.filenames.append(response.json()["filename"])
+        return response
+
+    async def patch(self):
+        if not self.filenames:
+            return None
+        return await self.client.patch(
+            f"/api/v1/contents/{self.pick_filename()}",
+            json={"keywords": self.pick_keywords()},
+            headers=self.headers,
+        )
+
+    async def delete(self):
+        if not self.filenames:
+            return None
+        # Swap with the last one so the popularity ranks stay stable
+        i = self.content_popularity.rank(len(self.filenames))
+        self.filenames[i], self.filenames[-1] = self.filenames[-1], self.filenames[i]
+        filename = self.filenames.pop()
+        return await self.client.delete(
+            f"/api/v1/contents/{filename}", headers=self.headers
+        )
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def _report(workload: Workload, elapsed: float, args) -> dict:
+    endpoints = {}
+    for operation, latencies in sorted(workload.latencies.items()):
+        latencies.sort()
+        endpoints[operation] = {
+            "requests": len(latencies),
+            "errors": workload.errors[operation],
+            "throughput": len(latencies) / elapsed,
+            "latency_ms": {
+                "mean": sum(latencies) / len(latencies) * 1000,
+                "p50": _percentile(latencies, 50) * 1000,
+                "p95": _percentile(latencies, 95) * 1000,
+                "p99": _percentile(latencies, 99) * 1000,
+                "max": latencies[-1] * 1000,
+            },
+            "statements": workload.statements[operation],
+            "statements_per_request": workload.statements[operation] / len(latencies),
+        }
+    requests = sum(endpoint["requests"] for endpoint in endpoints.values())
+    return {
+        "parameters": vars(args),
+        "duration": elapsed,
+        "requests": requests,
+        "throughput": requests / elapsed,
+        "background_statements": workload.statements["background"],
+        "endpoints": endpoints,
+    }
+
+
+async def _run(args) -> dict:
+    import httpx
+    from sqlalchemy import event
+
+    from app.database import async_engine, engine
+    from app.main import app
+
+    # The rejected or failed requests are counted, don't log each of them
+    logging.getLogger("fastapi").setLevel(logging.CRITICAL)
+    create_user("benchmark", "benchmark")
+    rng = random.Random(args.seed)
+    mix = {}
+    for item in args.mix.split(","):
+        operation, _, weight = item.partition("=")
+        mix[operation.strip()] = float(weight)
+    operations, weights = list(mix), list(mix.values())
+
+    # No lifespan with the ASGI transport, the events are sent by hand
+    await app.router.startup()
+    try:
+        async with httpx.AsyncClient(app=app, base_url="http://fmds") as client:
+            response = await client.post(
+                "/api/v1/token", data={"username": "benchmark", "password": "benchmark"}
+            )
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            workload = Workload(client, args, rng, headers)
+            for sync_engine in (engine, async_engine and async_engine.sync_engine):
+                if sync_engine is not None:
+                    event.listen(
+                        sync_engine, "before_cursor_execute", workload.count_statement
+                    )
+            await workload.seed(args.contents, args.batch_size)
+
+            deadline = time.perf_counter() + args.duration
+            remaining = [args.requests]
+
+            async def client_loop():
+                while time.perf_counter() < deadline and remaining[0] != 0:
+                    remaining[0] -= 1
+                    await workload.run(rng.choices(operations, weights)[0])
+
+            start = time.perf_counter()
+            await asyncio.gather(*(client_loop() for _ in range(args.clients)))
+            elapsed = time.perf_counter() - start
+    finally:
+        await app.router.shutdown()
+    return _report(workload, elapsed, args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--contents", type=int, default=1000, help="seeded contents")
+    parser.add_argument("--keywords", type=int, default=500, help="keywords vocabulary")
+    parser.add_argument("--keywords-per-content", type=int, default=4)
+    parser.add_argument(
+        "--distribution",
+        choices=["zipf", "uniform"],
+        default="zipf",
+        help="popularity of the contents and keywords",
+    )
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument(
+        "--requests", type=int, default=-1, help="stop after N requests, -1 no limit"
+    )
+    parser.add_argument(
+        "--mix", default="download=70,search=20,upload=5,patch=3,delete=2"
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file, stdout if not set")
+    args = parser.parse_args()
+    _check_popularity()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure(directory)
+        report = asyncio.get_event_loop().run_until_complete(_run(args))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Login throughput benchmark.
+
+Send bursts of concurrent logins to the application, in process, while a reader
+downloads an unknown content in a loop, and print the logins throughput, the
+rejected logins and the read latency during the burst.
+It runs against a temporary SQLite database, the settings can be changed with the
+usual environment variables (e.g. PASSWORD_HASH_WORKERS).
+
+    pip install httpx aiosqlite
+    python benchmarks/login.py --logins 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import tempfile
+import time
+
+from common import configure, create_user
+
+
+async def _login(client, username: str, password: str) -> int:
+    response = await client.post(
+        "/api/v1/token", data={"username": username, "password": password}
+    )
+    return response.status_code
+
+
+async def _read_loop(client, stop: asyncio.Event, latencies: list) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/api/v1/contents/unknown.png", params={"count": "false"})
+        latencies.append(time.perf_counter() - start)
+
+
+async def _run(args) -> None:
+    import httpx
+
+    from app.main import app
+
+    # The rejected logins are expected, don't log each of them
+    logging.getLogger("fastapi").setLevel(logging.ERROR)
+
+    create_user("benchmark", args.password)
+
+    async with httpx.AsyncClient(app=app, base_url="http://fmds") as client:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def login() -> int:
+            async with semaphore:
+                return await _login(client, "benchmark", args.password)
+
+        stop = asyncio.Event()
+        latencies = []
+        reader = asyncio.ensure_future(_read_loop(client, stop, latencies))
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*(login() for _ in range(args.logins)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await reader
+
+    accepted = statuses.count(200)
+    print(f"logins:    {args.logins} in {elapsed:.2f}s")
+    print(f"accepted:  {accepted} ({accepted / elapsed:.1f}/s)")
+    print(f"rejected:  {statuses.count(503)} (503)")
+    if latencies:
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(
+            f"reads:     {len(latencies)}, "
+            f"p50 {statistics.median(latencies) * 1000:.1f}ms, "
+            f"p99 {p99 * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--password", default="benchmark-password")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure(directory)
+        asyncio.get_event_loop().run_until_complete(_run(args))
+
+
+if __name__ == "__main__":
+    main()
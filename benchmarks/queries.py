@@ -0,0 +1,103 @@
+"""
+Database statements count check.
+
+Boot the application in process against a temporary SQLite database and check the
+number of statements executed by the search, the upload and the keywords update,
+so an N+1 loading of the contents keywords can't come back unnoticed. The search
+is checked with one and with many results, its count must not depend on them.
+Run it with the default settings, the caches change the counts. With
+ASYNC_DATABASE=1, the async engine statements are counted.
+
+    pip install httpx aiosqlite
+    python benchmarks/queries.py
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+
+from common import configure, create_user, png
+
+# The expected statements of each request
+SEARCH_STATEMENTS = 2
+UPLOAD_STATEMENTS = 5
+PATCH_STATEMENTS = 7
+
+
+async def _run(args) -> None:
+    import httpx
+
+    from app.database import async_engine, engine
+    from app.main import app
+    from app.utils.queries import assert_query_count
+
+    logging.getLogger("fastapi").setLevel(logging.CRITICAL)
+    create_user("benchmark", "benchmark")
+    counted_engine = async_engine or engine
+
+    # No lifespan with the ASGI transport, the events are sent by hand
+    await app.router.startup()
+    try:
+        async with httpx.AsyncClient(app=app, base_url="http://fmds") as client:
+            response = await client.post(
+                "/api/v1/token", data={"username": "benchmark", "password": "benchmark"}
+            )
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            async def upload(keywords: str) -> str:
+                response = await client.post(
+                    "/api/v1/contents",
+                    files={"file": ("image.png", png(1, 1), "image/png")},
+                    data={"keywords": keywords},
+                    headers=headers,
+                )
+                assert response.status_code == 201, response.text
+                return response.json()["filename"]
+
+            filenames = [await upload("many shared") for _ in range(args.contents)]
+            await upload("single shared")
+            # Let the startup background tasks run before counting
+            await asyncio.sleep(0.1)
+
+            for keyword, results in (("single", 1), ("many", args.contents)):
+                with assert_query_count(counted_engine, SEARCH_STATEMENTS):
+                    response = await client.get(
+                        "/api/v1/contents/",
+                        params={"keywords": [keyword], "limit": args.contents},
+                    )
+                assert len(response.json()) == results, len(response.json())
+                print(f"search ({results} results): {SEARCH_STATEMENTS} statements")
+
+            with assert_query_count(counted_engine, UPLOAD_STATEMENTS):
+                await upload("one two three")
+            print(f"upload: {UPLOAD_STATEMENTS} statements")
+
+            with assert_query_count(counted_engine, PATCH_STATEMENTS):
+                response = await client.patch(
+                    f"/api/v1/contents/{filenames[0]}",
+                    json={"keywords": ["four", "five"]},
+                    headers=headers,
+                )
+            assert response.status_code == 200, response.text
+            print(f"patch: {PATCH_STATEMENTS} statements")
+    finally:
+        await app.router.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--contents",
+        type=int,
+        default=50,
+        help="search results, at most the page size limit (100)",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure(directory)
+        asyncio.get_event_loop().run_until_complete(_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -23,4 +23,10 @@ setup(
         "timeflake>=0.4.0,<0.5.0",
         "uvicorn[standard]>=0.13.0,<0.14.0",
     ],
+    extras_require={
+        # Needed by the async_database mode
+        "async": ["aiomysql>=0.0.21,<0.1.0", "greenlet>=1.0.0"],
+        # Needed by the renditions
+        "renditions": ["Pillow>=8.0.0"],
+    },
 )